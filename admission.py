@@ -0,0 +1,335 @@
+import asyncio
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+# Admission control for the RAG pipeline (async and sync paths share the limits):
+# each upstream stage (embed, search, generate) gets at most `limit` concurrent calls. Callers beyond that wait in a
+# bounded queue; when the queue is full, or a slot does not free up before the
+# request's deadline, the call fails fast with Overloaded instead of piling onto
+# Gemini quota and the Mongo pool. api_app turns Overloaded into 503 + Retry-After.
+#
+# TokenBucketLimiter is the per-client side (429 + Retry-After), applied at the door.
+
+_deadline = ContextVar("rag_request_deadline", default=None)
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; `status_code` is 429 (rate limited) or 503 (overloaded)."""
+
+    def __init__(self, message, retry_after, status_code=503, stage=None, reason=None):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.status_code = status_code
+        self.stage = stage
+        self.reason = reason
+
+
+class Deadline:
+    """
+    A time.monotonic() instant (None: no deadline). Work shared by coalesced requests
+    (see single_flight.py) runs under one Deadline that each joining request extends.
+    """
+
+    def __init__(self, at=None):
+        self.at = at
+
+    @classmethod
+    def after(cls, seconds):
+        return cls(time.monotonic() + seconds if seconds and seconds > 0 else None)
+
+    def extend(self, at):
+        """Moves the deadline to `at` if that is later (None: no deadline any more)."""
+        if self.at is not None:
+            self.at = None if at is None else max(self.at, at)
+
+    def remaining(self):
+        return float("inf") if self.at is None else self.at - time.monotonic()
+
+
+def start_deadline(seconds):
+    """Sets the current request's deadline `seconds` from now (None or <= 0: no deadline)."""
+    _deadline.set(Deadline.after(seconds))
+
+
+def use_deadline(deadline):
+    """Makes `deadline` (a Deadline, or None) the current context's deadline."""
+    _deadline.set(deadline)
+
+
+def current_deadline():
+    """The current context's Deadline, or None when none was started."""
+    return _deadline.get()
+
+
+def remaining_seconds():
+    """Seconds left before the current request's deadline (inf when none is set)."""
+    deadline = _deadline.get()
+    return float("inf") if deadline is None else deadline.remaining()
+
+
+class _Waiter:
+    """A queued caller; `wake()` is called (from any thread) once the slot is handed to it."""
+
+    __slots__ = ("wake", "granted")
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class StageLimiter:
+    """
+    Concurrency limit with a bounded wait queue for one pipeline stage, shared by
+    coroutines and threads (the sync get_rag_answer):
+
+        async with limiter.slot():
+            response = await client.aio.models.generate_content(...)
+
+        with limiter.sync_slot():
+            response = client.models.generate_content(...)
+
+    limit <= 0 disables it. Queue waits are capped by max_wait_seconds and by the
+    time left before the request deadline (see start_deadline). A released slot is
+    handed to the longest-waiting caller, whichever event loop or thread it is on.
+    """
+
+    def __init__(self, name, limit, max_queue, max_wait_seconds, on_wait=None, on_reject=None):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.on_wait = on_wait          # callback(stage, seconds) for every admitted call
+        self.on_reject = on_reject      # callback(stage, reason)
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self.active = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {}
+        self._avg_hold = 0.0            # moving average of how long a slot is held
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """Rough seconds until a queued request would get a slot (at least 1)."""
+        if not self.limit:
+            return 1
+        return max(1.0, self._avg_hold * (self.waiting + 1) / self.limit)
+
+    def _reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        if self.on_reject:
+            self.on_reject(self.name, reason)
+        raise Overloaded(f"{self.name} stage overloaded ({reason})", self.retry_after(), stage=self.name, reason=reason)
+
+    def _try_acquire(self, waiter):
+        """Takes a free slot, or queues `waiter`; returns 'acquired', 'queued' or a rejection reason."""
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return "acquired"
+            if len(self._waiters) >= self.max_queue:
+                return "queue_full"
+            if min(self.max_wait_seconds, remaining_seconds()) <= 0:
+                return "deadline"
+            self._waiters.append(waiter)
+            self.queued += 1
+            return "queued"
+
+    def _give_up(self, waiter):
+        """After a timeout / cancellation: True if the slot was handed over meanwhile (the caller owns it)."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _release(self, acquired):
+        with self._lock:
+            if self._waiters:
+                # Hand the slot straight to the next waiter: `active` stays the same
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self.active -= 1
+        held = time.perf_counter() - acquired
+        self._avg_hold = held if self._avg_hold == 0.0 else self._avg_hold + 0.1 * (held - self._avg_hold)
+
+    def _admitted(self, started):
+        acquired = time.perf_counter()
+        if self.on_wait:
+            self.on_wait(self.name, acquired - started)
+        self.admitted += 1
+        return acquired
+
+    def _timeout_reason(self):
+        return "deadline" if remaining_seconds() <= 0 else "timeout"
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.limit <= 0:
+            yield
+            return
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = _Waiter(lambda: loop.call_soon_threadsafe(_resolve, future))
+        outcome = self._try_acquire(waiter)
+        if outcome == "queued":
+            try:
+                await asyncio.wait_for(future, min(self.max_wait_seconds, remaining_seconds()))
+            except asyncio.TimeoutError:
+                if not self._give_up(waiter):
+                    self._reject(self._timeout_reason())
+            except asyncio.CancelledError:
+                if self._give_up(waiter):
+                    self._release(time.perf_counter())
+                raise
+        elif outcome != "acquired":
+            self._reject(outcome)
+        acquired = self._admitted(started)
+        try:
+            yield
+        finally:
+            self._release(acquired)
+
+    @contextmanager
+    def sync_slot(self):
+        """Blocking variant of slot() for worker threads."""
+        if self.limit <= 0:
+            yield
+            return
+        started = time.perf_counter()
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        outcome = self._try_acquire(waiter)
+        if outcome == "queued":
+            if not event.wait(min(self.max_wait_seconds, remaining_seconds())) and not self._give_up(waiter):
+                self._reject(self._timeout_reason())
+        elif outcome != "acquired":
+            self._reject(outcome)
+        acquired = self._admitted(started)
+        try:
+            yield
+        finally:
+            self._release(acquired)
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": dict(self.rejected),
+            "avg_hold_ms": round(self._avg_hold * 1000, 1),
+        }
+
+
+class AdmissionController:
+    """StageLimiters by stage name; `slot(stage)` for a stage without a limiter is a no-op."""
+
+    def __init__(self, limits, max_queue, max_wait_seconds, on_wait=None, on_reject=None):
+        self.stages = {
+            name: StageLimiter(name, limit, max_queue, max_wait_seconds, on_wait, on_reject)
+            for name, limit in limits.items()
+        }
+        self._unlimited = StageLimiter("unlimited", 0, 0, 0)
+
+    def slot(self, stage):
+        return self.stages.get(stage, self._unlimited).slot()
+
+    def sync_slot(self, stage):
+        return self.stages.get(stage, self._unlimited).sync_slot()
+
+    def stats(self):
+        return {name: limiter.stats() for name, limiter in self.stages.items()}
+
+    def gauge_lines(self):
+        """Prometheus gauge lines for in-flight and queued calls per stage."""
+        lines = ["# HELP rag_admission_active Calls holding a stage slot", "# TYPE rag_admission_active gauge"]
+        lines += [f'rag_admission_active{{stage="{name}"}} {s.active}' for name, s in self.stages.items()]
+        lines += ["# HELP rag_admission_waiting Calls queued for a stage slot", "# TYPE rag_admission_waiting gauge"]
+        lines += [f'rag_admission_waiting{{stage="{name}"}} {s.waiting}' for name, s in self.stages.items()]
+        return lines
+
+
+def parse_networks(spec):
+    """IP networks from a comma-separated list of addresses / CIDRs, e.g. "10.0.0.0/8,127.0.0.1"."""
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in (spec or "").split(",") if part.strip()]
+
+
+def _trusted(address, networks):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_address(peer, forwarded_for=None, trusted_proxies=()):
+    """
+    The address a rate limit should key on. X-Forwarded-For is only believed when the
+    peer is one of `trusted_proxies`; then the right-most hop that is not a trusted
+    proxy is the client (entries left of it are whatever the client chose to send).
+    """
+    if not forwarded_for or not trusted_proxies or not _trusted(peer, trusted_proxies):
+        return peer
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop, trusted_proxies):
+            return hop
+    return hops[0] if hops else peer
+
+
+class TokenBucketLimiter:
+    """
+    Per-client token buckets: `rate` requests per second on average, bursts of up to
+    `burst`. Only the `max_clients` most recently seen clients are tracked.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = max(1.0, float(burst))
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()   # client -> (tokens, updated_at)
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, client):
+        """Returns (allowed, retry_after_seconds)."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+            self.allowed += 1
+        else:
+            self.limited += 1
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1.0 - tokens) / self.rate
+
+    def stats(self):
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
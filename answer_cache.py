@@ -0,0 +1,133 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+def source_key(sources):
+    """
+    Identifies the retrieved document set: sorted (unique_id, updated_at) pairs.
+
+    main.py and backfill_embeddings.py stamp 'updated_at' on every upsert, so a
+    re-upserted document changes the key and any answer built from it stops
+    matching, in every worker, without an explicit invalidation message.
+    Returns None when a source has no unique_id (such answers are not cached).
+    """
+    pairs = []
+    for doc in sources:
+        uid = doc.get('unique_id')
+        if not uid:
+            return None
+        pairs.append((str(uid), str(doc.get('updated_at'))))
+    if not pairs:
+        return None
+    return tuple(sorted(set(pairs)))
+
+
+def _unit(vector):
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return None
+    return [x / norm for x in vector]
+
+
+class SemanticAnswerCache:
+    """
+    Caches generated answers by (retrieved document set, query embedding).
+
+    A lookup hits when an earlier answer was generated from exactly the same
+    document set and its query embedding has cosine similarity >= threshold with
+    the new one, so paraphrased questions reuse the answer and skip generation.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 512, ttl_seconds: float = 6 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # source key -> OrderedDict(entry_id -> (stored_at, unit query vector, answer))
+        self._by_sources = {}
+        self._order = OrderedDict()   # entry_id -> source key, oldest first (LRU)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def lookup(self, query_vector, sources):
+        """Returns a cached answer for this query/document set or None."""
+        key = source_key(sources)
+        unit = _unit(query_vector) if (key and query_vector is not None) else None
+        now = time.time()
+        with self._lock:
+            if unit is None or self.max_entries <= 0:
+                self.misses += 1
+                return None
+            best_id, best_sim = None, self.threshold
+            entries = self._by_sources.get(key, {})
+            for entry_id, (stored_at, vec, answer) in list(entries.items()):
+                if now - stored_at > self.ttl_seconds:
+                    self._drop(entry_id)
+                    continue
+                sim = sum(a * b for a, b in zip(unit, vec))
+                if sim >= best_sim:
+                    best_id, best_sim = entry_id, sim
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._order.move_to_end(best_id)
+            self.hits += 1
+            return entries[best_id][2]
+
+    def store(self, query_vector, sources, answer):
+        key = source_key(sources)
+        if key is None or query_vector is None or not answer or self.max_entries <= 0:
+            return
+        unit = _unit(query_vector)
+        if unit is None:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._by_sources.setdefault(key, OrderedDict())[entry_id] = (time.time(), unit, answer)
+            self._order[entry_id] = key
+            while len(self._order) > self.max_entries:
+                self._drop(next(iter(self._order)))
+
+    def invalidate_documents(self, unique_ids):
+        """Drops every answer that was generated from any of the given documents."""
+        unique_ids = {str(u) for u in unique_ids}
+        with self._lock:
+            stale = [k for k in self._by_sources if any(uid in unique_ids for uid, _ in k)]
+            for key in stale:
+                for entry_id in list(self._by_sources.get(key, {})):
+                    self._drop(entry_id)
+                    self.invalidations += 1
+
+    def _drop(self, entry_id):
+        key = self._order.pop(entry_id, None)
+        if key is None:
+            return
+        entries = self._by_sources.get(key)
+        if entries is not None:
+            entries.pop(entry_id, None)
+            if not entries:
+                del self._by_sources[key]
+
+    def clear(self):
+        with self._lock:
+            self._by_sources.clear()
+            self._order.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._order),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
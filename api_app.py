@@ -1,10 +1,116 @@
-from fastapi import FastAPI
+import time
+_IMPORT_STARTED = time.perf_counter()   # cold-start clock: measured from the top of this module
+
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from ragService import get_rag_answer # <--- Imports your core RAG function
+from ragService import get_rag_answer_async, stream_rag_answer, query_embedding_cache, answer_cache, context_builder, reranker, warm_up, warmup_state, metrics, admission, mongo_pool_stats, mongo_command_stats, gemini_stats # <--- Imports your core RAG functions (async variants)
+from single_flight import SingleFlight, StreamSingleFlight
+from admission import Overloaded, TokenBucketLimiter, client_address, parse_networks, start_deadline
+
+IMPORT_MS = (time.perf_counter() - _IMPORT_STARTED) * 1000
+WARMUP_ENABLED = (os.getenv("WARMUP_ENABLED") or "1").lower() not in ("0", "false", "no")
+WARMUP_RETRY_SECONDS = 30   # a failed warm-up is retried by the readiness probe at most this often
+# Identical in-flight questions (after normalize_query) share one pipeline run (see single_flight.py)
+COALESCE_REQUESTS = (os.getenv("COALESCE_REQUESTS") or "1").lower() not in ("0", "false", "no")
+# Backpressure (see admission.py): a /chat request that cannot get its stage slots within
+# REQUEST_DEADLINE_MS is shed with 503 + Retry-After. RATE_LIMIT_PER_MINUTE > 0 also gives
+# each client (its peer address) a token bucket of RATE_LIMIT_BURST requests refilled at that
+# rate; clients over it get 429 + Retry-After. Behind a load balancer, list its addresses in
+# TRUSTED_PROXIES so the client is read from X-Forwarded-For (right-most untrusted hop).
+REQUEST_DEADLINE_MS = float(os.getenv("REQUEST_DEADLINE_MS") or 30000)
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE") or 0)
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST") or 10)
+TRUSTED_PROXIES = parse_networks(os.getenv("TRUSTED_PROXIES"))
+
+# A coalesced run gets the latest deadline of the requests waiting on it
+answer_flight = SingleFlight(REQUEST_DEADLINE_MS / 1000.0, metrics)
+stream_flight = StreamSingleFlight(REQUEST_DEADLINE_MS / 1000.0, metrics)
+rate_limiter = TokenBucketLimiter(RATE_LIMIT_PER_MINUTE / 60.0, RATE_LIMIT_BURST) if RATE_LIMIT_PER_MINUTE > 0 else None
+
+# Request-level metrics (the per-stage ones live in ragService, see metrics.py)
+request_seconds = metrics.histogram("rag_request_duration_seconds", "End-to-end /chat latency", labels=("endpoint",))
+ttft_seconds = metrics.histogram("rag_time_to_first_token_seconds", "Time to the first streamed token on /chat/stream")
+coalesced_counter = metrics.counter("rag_coalesced_requests_total", "Requests served by another request's in-flight run", ("endpoint",))
+shed_counter = metrics.counter("rag_shed_requests_total", "Requests rejected with 429 / 503", ("endpoint", "status"))
+
+cold_start = {"import_ms": round(IMPORT_MS, 1), "startup_to_ready_ms": None, "first_request_ms": None}
+_warmup_task = None
+
+
+async def _run_warm_up():
+    await warm_up()
+    if warmup_state["status"] == "ready" and cold_start["startup_to_ready_ms"] is None:
+        cold_start["startup_to_ready_ms"] = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+        print(f"Cold start: ready {cold_start['startup_to_ready_ms']} ms after import began (imports {cold_start['import_ms']} ms)")
+
+
+def _start_warm_up():
+    global _warmup_task
+    if _warmup_task is None or _warmup_task.done():
+        _warmup_task = asyncio.create_task(_run_warm_up())
+
 
 # 1. Initialize the FastAPI application
-app = FastAPI(title="USDA RAG Chatbot API")
+# Warm-up (Mongo pool, one embed call, vector/keyword indexes) runs in the background
+# on startup: /health/live answers at once, /health/ready turns 200 once it succeeds.
+@asynccontextmanager
+async def lifespan(app):
+    if WARMUP_ENABLED:
+        _start_warm_up()
+    yield
+
+app = FastAPI(title="USDA RAG Chatbot API", lifespan=lifespan)
+
+
+# Records how long the first /chat request took (a cold path if it arrives before warm-up finishes)
+@app.middleware("http")
+async def first_request_timer(request: Request, call_next):
+    if cold_start["first_request_ms"] is not None or not request.url.path.startswith("/chat"):
+        return await call_next(request)
+    started = time.perf_counter()
+    response = await call_next(request)
+    if cold_start["first_request_ms"] is None:
+        cold_start["first_request_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        cold_start["first_request_warm"] = warmup_state["status"] == "ready"
+        print(f"First request: {request.url.path} took {cold_start['first_request_ms']} ms (warm={cold_start['first_request_warm']})")
+    return response
+
+def _client_id(request: Request):
+    peer = request.client.host if request.client else "unknown"
+    return client_address(peer, request.headers.get("x-forwarded-for"), TRUSTED_PROXIES)
+
+
+def _overloaded_response(error: Overloaded, endpoint):
+    shed_counter.inc(endpoint, str(error.status_code))
+    return JSONResponse(
+        {"detail": str(error), "retry_after": error.retry_after},
+        status_code=error.status_code,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+# Per-client rate limit, checked before any pipeline work (only when RATE_LIMIT_PER_MINUTE is set)
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    if rate_limiter is None or not request.url.path.startswith("/chat"):
+        return await call_next(request)
+    allowed, retry_after = rate_limiter.acquire(_client_id(request))
+    if not allowed:
+        return _overloaded_response(
+            Overloaded("rate limit exceeded", retry_after, status_code=429, reason="rate_limited"), request.url.path)
+    return await call_next(request)
+
+
+# A stage that could not admit the request (see admission.py) -> 503 + Retry-After
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, error: Overloaded):
+    return _overloaded_response(error, request.url.path)
 
 # 2. Configure CORS (Crucial for frontend communication)
 # *WARNING*: Using "*" (wildcard) is easy for development, but specify 
@@ -28,19 +134,183 @@ class UserQuery(BaseModel):
     
 # 4. Define the API endpoint that your frontend will call
 # The endpoint is POST /chat
+# Declared async so the worker's event loop stays free while Gemini/Atlas respond;
+# a sync def here would pin one threadpool slot per in-flight question.
 @app.post("/chat")
-def chat_endpoint(user_query: UserQuery):
+async def chat_endpoint(user_query: UserQuery):
     """
     Receives a user query, calls the RAG service, and returns the AI's response.
+    With METRICS_ENABLED the per-stage timings are sent in a Server-Timing header.
     """
     
     # Extract the query string from the validated Pydantic model
     question = user_query.query
+    trace = metrics.start_request()
+    start_deadline(REQUEST_DEADLINE_MS / 1000.0)
     
-    # Call the core RAG function defined in rag_service.py
-    answer = get_rag_answer(question)
+    # Call the core RAG function defined in ragService.py (shared with identical in-flight questions)
+    if COALESCE_REQUESTS:
+        pending, coalesced = answer_flight.join(question, lambda: get_rag_answer_async(question))
+        if coalesced:
+            coalesced_counter.inc("/chat")
+        answer = await pending
+    else:
+        answer = await get_rag_answer_async(question)
     
     # Return the AI response as a JSON object
-    return {"response": answer}
+    if trace is None:
+        return {"response": answer}
+    request_seconds.observe(time.perf_counter() - trace.started, "/chat")
+    return JSONResponse({"response": answer}, headers={"Server-Timing": trace.server_timing()})
+
+# 5. Streaming variant: POST /chat/stream
+# Sends the answer as Server-Sent Events while Gemini is still generating, so the
+# frontend can render the first words instead of waiting for the whole answer.
+#   event: token  data: {"text": "<next piece of the formatted answer>"}
+#   event: done   data: {"ttft_ms": <time to first token>, "total_ms": <total time>, "coalesced": <bool>}
+#   event: error  data: {"status": 503, "detail": "...", "retry_after": <seconds>}  (shed, see admission.py)
+# A request for a question that is already streaming attaches to that stream
+# ("coalesced": true): it gets the pieces produced so far, then the rest live.
+# Headers go out before any stage has run, so instead of a Server-Timing header the
+# done event carries "timings" ({stage: ms}) when METRICS_ENABLED is set.
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(user_query: UserQuery):
+    """
+    Streams the RAG answer as Server-Sent Events and reports time-to-first-token.
+    """
+    question = user_query.query
+    started = time.perf_counter()
+
+    async def event_stream():
+        # Started here: the generator runs in the response's own context, not the endpoint's
+        trace = metrics.start_request()
+        start_deadline(REQUEST_DEADLINE_MS / 1000.0)
+        ttft_ms = None
+        coalesced = False
+        if COALESCE_REQUESTS:
+            pieces, coalesced = stream_flight.stream(question, lambda: stream_rag_answer(question))
+            if coalesced:
+                coalesced_counter.inc("/chat/stream")
+        else:
+            pieces = stream_rag_answer(question)
+        try:
+            async for piece in pieces:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                    ttft_seconds.observe(ttft_ms / 1000)
+                yield _sse("token", {"text": piece})
+        except Overloaded as e:
+            # The 200 headers are already out, so the rejection travels as an event
+            shed_counter.inc("/chat/stream", str(e.status_code))
+            yield _sse("error", {"status": e.status_code, "detail": str(e), "retry_after": e.retry_after})
+            return
+
+        total_ms = (time.perf_counter() - started) * 1000
+        request_seconds.observe(total_ms / 1000, "/chat/stream")
+        done = {
+            "ttft_ms": None if ttft_ms is None else round(ttft_ms, 1),
+            "total_ms": round(total_ms, 1),
+            "coalesced": coalesced,
+        }
+        if trace is not None:
+            done["timings"] = trace.as_dict()
+        yield _sse("done", done)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Keep proxies (e.g. Render / nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# 6. Cache statistics: GET /stats/cache
+@app.get("/stats/cache")
+def cache_stats_endpoint():
+    """
+    Returns hit/miss counters for the query-embedding, semantic answer and rerank caches.
+    """
+    return {
+        "query_embedding": query_embedding_cache.stats(),
+        "answer": answer_cache.stats(),
+        "rerank": reranker.stats(),
+    }
+
+# 7. Context statistics: GET /stats/context
+@app.get("/stats/context")
+def context_stats_endpoint():
+    """
+    Returns cumulative prompt-context token counts (raw vs used vs saved) from the context builder.
+    """
+    return context_builder.stats()
+
+# 8. Request coalescing statistics: GET /stats/coalescing
+@app.get("/stats/coalescing")
+def coalescing_stats_endpoint():
+    """
+    Returns leader / follower counts of the single-flight groups for /chat and /chat/stream.
+    """
+    return {"enabled": COALESCE_REQUESTS, "chat": answer_flight.stats(), "chat_stream": stream_flight.stats()}
+
+# 9. Admission control statistics: GET /stats/admission
+@app.get("/stats/admission")
+def admission_stats_endpoint():
+    """
+    Returns per-stage slot usage, queue depth and rejections, plus the per-client rate limiter.
+    """
+    return {
+        "deadline_ms": REQUEST_DEADLINE_MS,
+        "stages": admission.stats(),
+        "rate_limit": rate_limiter.stats() if rate_limiter is not None else None,
+    }
+
+# 10. Mongo connection pool / command statistics: GET /stats/mongo
+@app.get("/stats/mongo")
+def mongo_stats_endpoint():
+    """
+    Returns pool usage and checkout waits, and per-command counts / latency / timeouts,
+    from pymongo's pool and command monitoring.
+    """
+    return {"pool": mongo_pool_stats.stats(), "commands": mongo_command_stats.stats()}
+
+# 11. Gemini client statistics: GET /stats/gemini
+@app.get("/stats/gemini")
+def gemini_stats_endpoint():
+    """
+    Returns circuit breaker states, current hedge delays and per-model call outcomes
+    (retries, hedges, failovers) of the resilient Gemini client.
+    """
+    return gemini_stats() or {"status": "not initialized"}
+
+# 12. Prometheus metrics: GET /metrics
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Stage latency / token / score histograms and cache counters in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# 13. Health probes: GET /health/live and GET /health/ready
+@app.get("/health/live")
+def liveness_endpoint():
+    """
+    Liveness: the process is up and serving requests.
+    """
+    return {"status": "alive", "uptime_s": round(time.perf_counter() - _IMPORT_STARTED, 1)}
+
+@app.get("/health/ready")
+async def readiness_endpoint():
+    """
+    Readiness: 200 once warm-up has connected to Mongo and Gemini, 503 before that
+    (or after a failure, which is retried in the background).
+    """
+    ready = warmup_state["status"] == "ready" or not WARMUP_ENABLED
+    if (WARMUP_ENABLED and warmup_state["status"] == "failed"
+            and time.time() - (warmup_state["finished_at"] or 0) >= WARMUP_RETRY_SECONDS):
+        _start_warm_up()
+    body = {"status": warmup_state["status"] if WARMUP_ENABLED else "ready", "warmup": warmup_state, "cold_start": cold_start}
+    return JSONResponse(body, status_code=200 if ready else 503)
 
 # End of api_app.py
\ No newline at end of file
@@ -0,0 +1,32 @@
+import sys
+
+import ragService
+ragService.require_settings()   # the clients imported below are created on first use; fail before that
+from ragService import collection, chunk_collection, gemini_client, EMBEDDING_MODEL, VECTOR_FIELD, TEXT_FIELD, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, VECTOR_STORAGE
+from batch_embedder import BatchEmbedder, TokenBucketRateLimiter
+from chunking import SECTION_FIELDS, store_program_chunks
+from work_queue import WORK_QUEUE_PATH
+
+# Writes passage chunks (see chunking.py) for stored programs that have none yet,
+# e.g. programs ingested before chunking existed. Pass --all to re-chunk every
+# program (after changing CHUNK_MAX_TOKENS / CHUNK_OVERLAP_TOKENS).
+
+REQUESTS_PER_SECOND = 5    # starting rate; the limiter backs off on 429 and honours Retry-After
+
+rechunk_all = '--all' in sys.argv
+chunked = set() if rechunk_all else set(chunk_collection.distinct('parent_id'))
+
+projection = {'_id': 0, 'unique_id': 1, 'title': 1, 'program_name': 1, 'website': 1, TEXT_FIELD: 1}
+projection.update({field: 1 for field, _ in SECTION_FIELDS})
+docs = [doc for doc in collection.find({'unique_id': {'$exists': True}}, projection) if doc.get('unique_id') not in chunked]
+print(f"{len(docs)} program(s) to chunk")
+
+embedder = BatchEmbedder(
+    gemini_client,
+    EMBEDDING_MODEL,
+    limiter=TokenBucketRateLimiter(rate_per_second=REQUESTS_PER_SECOND, burst=REQUESTS_PER_SECOND),
+)
+written, failed = store_program_chunks(docs, embedder, chunk_collection, WORK_QUEUE_PATH, TEXT_FIELD, VECTOR_FIELD,
+                                       max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS,
+                                       vector_storage=VECTOR_STORAGE)
+print(f"Chunk backfill complete. Chunks written: {written}, failed: {failed} ({embedder.requests} embedding request(s))")
@@ -1,17 +1,24 @@
-import time
-import json
+from datetime import datetime, timezone
 from bson import ObjectId
-from ragService import collection, gemini_client, EMBEDDING_MODEL, VECTOR_FIELD, TEXT_FIELD, embedding_to_list
+import ragService
+ragService.require_settings()   # the clients imported below are created on first use; fail before that
+from ragService import collection, gemini_client, EMBEDDING_MODEL, VECTOR_FIELD, TEXT_FIELD, BM25_INDEX_PATH, VECTOR_STORAGE
+from batch_embedder import BatchEmbedder, TokenBucketRateLimiter
+from bulk_writer import BulkUpsertWriter, append_failure
+from bm25_index import update_index
+from work_queue import WORK_QUEUE_PATH
 
-BATCH_SIZE = 10
-SLEEP_BETWEEN = 0.35  # seconds between embed calls to be polite with API rate limits
+BATCH_SIZE = 100           # texts per embed_content request (Gemini's per-call maximum)
+REQUESTS_PER_SECOND = 5    # starting rate; the limiter backs off on 429 and honours Retry-After
 
 query = {VECTOR_FIELD: {'$exists': False}}  # find docs missing embeddings
-cursor = collection.find(query)
+cursor = collection.find(query, {TEXT_FIELD: 1, 'program_overview': 1, 'title': 1, 'program_name': 1, 'unique_id': 1})
 
 count = 0
 failed = 0
 
+# Collect everything that needs an embedding, then embed it in batches
+todo = []
 for doc in cursor:
     count += 1
     _id = doc.get('_id')
@@ -19,37 +26,41 @@ for doc in cursor:
     if not text:
         print(f"Skipping {_id} - no text available to embed")
         continue
-    try:
-        resp = gemini_client.models.embed_content(model=EMBEDDING_MODEL, contents=[text])
-        # try to extract embedding robustly
-        raw_vec = None
-        if hasattr(resp, 'embedding'):
-            raw_vec = resp.embedding
-        elif hasattr(resp, 'embeddings'):
-            raw_vec = resp.embeddings[0]
-        elif isinstance(resp, dict):
-            raw_vec = resp.get('embedding') or (resp.get('embeddings') and resp.get('embeddings')[0])
-            if not raw_vec and resp.get('data'):
-                try:
-                    raw_vec = resp['data'][0].get('embedding')
-                except Exception:
-                    raw_vec = None
-
-        vec = embedding_to_list(raw_vec)
-        if not vec:
-            raise ValueError('Could not extract embedding as list')
-
-        collection.update_one({'_id': ObjectId(_id)}, {'$set': {VECTOR_FIELD: vec}})
-        print(f"Backfilled embedding for doc {_id} ({count})")
-    except Exception as e:
+    todo.append((doc, text))
+
+embedder = BatchEmbedder(
+    gemini_client,
+    EMBEDDING_MODEL,
+    limiter=TokenBucketRateLimiter(rate_per_second=REQUESTS_PER_SECOND, burst=REQUESTS_PER_SECOND),
+    max_items=BATCH_SIZE,
+)
+vectors = embedder.embed_texts([text for _, text in todo])
+print(f"Embedded {len(todo) - len(embedder.errors)}/{len(todo)} documents in {embedder.requests} request(s)")
+
+writer = BulkUpsertWriter(collection, WORK_QUEUE_PATH, vector_field=VECTOR_FIELD, vector_storage=VECTOR_STORAGE)
+for n, (doc, text) in enumerate(todo):
+    _id = doc['_id']
+    vec = vectors[n]
+    if not vec:
         failed += 1
-        print(f"Failed to backfill {_id}: {e}")
-        try:
-            with open('failed_backfill.jsonl', 'a', encoding='utf-8') as f:
-                json.dump({'_id': str(_id), 'error': str(e)}, f)
-                f.write('\n')
-        except Exception:
-            pass
-    time.sleep(SLEEP_BETWEEN)
+        error = embedder.errors.get(n) or 'Could not extract embedding as list'
+        print(f"Failed to backfill {_id}: {error}")
+        append_failure(WORK_QUEUE_PATH, 'embed', RuntimeError(error), filter_q={'_id': ObjectId(_id)})
+        continue
+
+    # updated_at invalidates cached answers built from this document (see answer_cache.py)
+    writer.add({'_id': ObjectId(_id)}, {VECTOR_FIELD: vec, 'updated_at': datetime.now(timezone.utc)},
+               upsert=False, unique_id=str(_id))
+
+writer.close()
+failed += writer.failed
+print(f"Backfilled {writer.modified} document(s)")
+written = [doc for n, (doc, _) in enumerate(todo) if vectors[n] and str(doc['_id']) not in writer.failed_ids]
 
 print(f"Backfill complete. Attempted: {count}, failed: {failed}")
+
+# Keyword index (see bm25_index.py): re-tokenize only the backfilled programs; built from the collection the first time
+try:
+    update_index(BM25_INDEX_PATH, TEXT_FIELD, docs=written, collection=collection)
+except Exception as e:
+    print(f"Could not update the BM25 index: {e}")
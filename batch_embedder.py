@@ -0,0 +1,168 @@
+import random
+import threading
+import time
+
+from google.genai.errors import APIError
+from ragService import embedding_to_list
+from resilient_gemini import ResilientGeminiClient, retry_after_seconds
+
+# Gemini accepts up to 100 texts per embed_content call. The character budget keeps
+# one request comfortably under the request-size limit for long program pages.
+MAX_BATCH_ITEMS = 100
+MAX_BATCH_CHARS = 200_000
+
+
+class TokenBucketRateLimiter:
+    """
+    Token bucket shared by every embed request of a run.
+
+    The refill rate adapts: it is halved whenever Gemini answers 429 and creeps
+    back up (additively, to max_rate) after each success. A Retry-After from the
+    server pauses all callers until it has elapsed.
+    """
+
+    def __init__(self, rate_per_second: float = 5.0, burst: int = 5, min_rate: float = 0.2):
+        self.max_rate = rate_per_second
+        self.rate = rate_per_second
+        self.min_rate = min_rate
+        self.capacity = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until one request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1)
+
+    def on_rate_limited(self, retry_after=None):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+
+def pack_batches(texts, max_items=MAX_BATCH_ITEMS, max_chars=MAX_BATCH_CHARS):
+    """Groups text indices into request-sized batches (item count and character budget)."""
+    batches, current, current_chars = [], [], 0
+    for i, text in enumerate(texts):
+        size = len(text)
+        if current and (len(current) >= max_items or current_chars + size > max_chars):
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(i)
+        current_chars += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+class BatchEmbedder:
+    """
+    Embeds many texts with as few embed_content calls as possible.
+
+    embed_texts() returns one vector (list of floats) per input, in input order,
+    with None for texts that could not be embedded; the reason is in .errors
+    (input index -> message). A failing batch is split in half so one bad text
+    does not fail its neighbours.
+    """
+
+    def __init__(self, client, model, task_type=None, limiter=None, max_items=MAX_BATCH_ITEMS,
+                 max_chars=MAX_BATCH_CHARS, max_retries=5):
+        # BatchEmbedder retries and adapts its rate itself; the shared client keeps its
+        # breaker and timeouts but does not retry on top of that
+        self.client = client.with_options(max_attempts=1, hedge=False) if isinstance(client, ResilientGeminiClient) else client
+        self.model = model
+        self.task_type = task_type
+        self.limiter = limiter or TokenBucketRateLimiter()
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self.max_retries = max_retries
+        self.errors = {}
+        self.requests = 0
+
+    def _config(self):
+        if not self.task_type:
+            return None
+        from google.genai import types
+        return types.EmbedContentConfig(task_type=self.task_type)
+
+    def _call(self, texts):
+        """One embed_content request with 429 / transient-error retries; returns raw embeddings."""
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            self.requests += 1
+            try:
+                resp = self.client.models.embed_content(model=self.model, contents=texts, config=self._config())
+                self.limiter.on_success()
+                return list(getattr(resp, 'embeddings', None) or [])
+            except APIError as e:
+                attempt += 1
+                code = getattr(e, 'code', None)
+                if code == 429:
+                    delay = retry_after_seconds(e)
+                    self.limiter.on_rate_limited(delay)
+                    print(f"Embedding rate limited (429); retry after {delay if delay else 'backoff'}s, rate now {self.limiter.rate:.2f}/s")
+                elif code is None or code < 500:
+                    raise
+                if attempt > self.max_retries:
+                    raise
+                if code != 429:
+                    # 5xx: jittered exponential backoff
+                    time.sleep(min(30.0, 0.5 * (2 ** attempt)) * random.uniform(0.5, 1.5))
+
+    def _embed_indices(self, texts, indices, vectors):
+        try:
+            raw = self._call([texts[i] for i in indices])
+            if len(raw) != len(indices):
+                raise ValueError(f"Gemini returned {len(raw)} embeddings for {len(indices)} texts")
+        except Exception as e:
+            if isinstance(e, APIError) and getattr(e, 'code', None) == 429:
+                # Still rate limited after all retries: splitting would only send more requests
+                for i in indices:
+                    self.errors[i] = str(e)
+                return
+            if len(indices) > 1:
+                mid = len(indices) // 2
+                self._embed_indices(texts, indices[:mid], vectors)
+                self._embed_indices(texts, indices[mid:], vectors)
+            else:
+                self.errors[indices[0]] = str(e)
+            return
+        for i, raw_vec in zip(indices, raw):
+            vec = embedding_to_list(raw_vec)
+            if vec is None:
+                self.errors[i] = 'Could not extract/normalize embedding vector from Gemini response'
+            vectors[i] = vec
+
+    def embed_texts(self, texts):
+        texts = [t if isinstance(t, str) else str(t or '') for t in texts]
+        vectors = [None] * len(texts)
+        self.errors = {}
+        pending = []
+        for i, text in enumerate(texts):
+            if text.strip():
+                pending.append(i)
+            else:
+                self.errors[i] = 'No text available to embed'
+        for batch in pack_batches([texts[i] for i in pending], self.max_items, self.max_chars):
+            self._embed_indices(texts, [pending[j] for j in batch], vectors)
+        return vectors
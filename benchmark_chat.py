@@ -0,0 +1,220 @@
+# Benchmark: sync get_rag_answer (threadpool, like a plain `def` FastAPI endpoint)
+# vs get_rag_answer_async (event loop) with stubbed Gemini and Mongo backends.
+#
+# Usage: python benchmark_chat.py [--concurrency 1,50,500] [--embed-ms 50] [--search-ms 30] [--generate-ms 800]
+#
+# No network access is needed: ragService's clients are replaced by fakes that
+# only sleep for the configured latency and return canned data.
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import ragService
+from answer_cache import SemanticAnswerCache
+from embedding_cache import EmbeddingCache
+
+# Starlette runs sync endpoints on an anyio threadpool limited to 40 tokens by default
+DEFAULT_THREADPOOL_SIZE = 40
+
+FAKE_DOCS = [
+    {
+        "text_chunk": "The Single Family Housing Direct Home Loans program helps low-income applicants buy homes.",
+        "title": "Single Family Housing Direct Home Loans",
+        "program_name": "Section 502 Direct Loan Program",
+        "score": 0.91,
+    },
+    {
+        "text_chunk": "Farm Labor Housing Direct Loans & Grants provide affordable financing for farmworker housing.",
+        "title": "Farm Labor Housing Direct Loans & Grants",
+        "program_name": "Farm Labor Housing",
+        "score": 0.87,
+    },
+]
+
+
+# --------------------------------------------------------------------------
+# Stubbed backends
+# --------------------------------------------------------------------------
+
+class FakeModels:
+    """Blocking stand-in for gemini_client.models."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def embed_content(self, model, contents, config=None):
+        time.sleep(self.latency['embed'])
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=[0.1] * 768) for _ in contents])
+
+    def generate_content(self, model, contents, config=None):
+        time.sleep(self.latency['generate'])
+        return SimpleNamespace(text="* **Purpose:** Stubbed answer.")
+
+
+class FakeAsyncModels:
+    """Awaitable stand-in for gemini_client.aio.models."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def embed_content(self, model, contents, config=None):
+        await asyncio.sleep(self.latency['embed'])
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=[0.1] * 768) for _ in contents])
+
+    async def generate_content(self, model, contents, config=None):
+        await asyncio.sleep(self.latency['generate'])
+        return SimpleNamespace(text="* **Purpose:** Stubbed answer.")
+
+    async def generate_content_stream(self, model, contents, config=None):
+        pieces = ["Here is what I found.", " * **Purpose:**", " Stubbed", " answer."]
+
+        async def _stream():
+            for piece in pieces:
+                await asyncio.sleep(self.latency['generate'] / len(pieces))
+                yield SimpleNamespace(text=piece)
+
+        return _stream()
+
+
+class FakeCollection:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def with_options(self, **options):
+        return self
+
+    def aggregate(self, pipeline, **kwargs):
+        time.sleep(self.latency['search'])
+        return iter([dict(d) for d in FAKE_DOCS])
+
+
+class FakeAsyncCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length=None):
+        return self.docs
+
+
+class FakeAsyncCollection:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def with_options(self, **options):
+        return self
+
+    async def aggregate(self, pipeline, **kwargs):
+        await asyncio.sleep(self.latency['search'])
+        return FakeAsyncCursor([dict(d) for d in FAKE_DOCS])
+
+
+def install_stubs(latency):
+    ragService.clients.override(
+        gemini_client=SimpleNamespace(
+            models=FakeModels(latency),
+            aio=SimpleNamespace(models=FakeAsyncModels(latency)),
+        ),
+        collection=FakeCollection(latency),
+        async_collection=FakeAsyncCollection(latency),
+        search_collection=FakeCollection(latency),
+        async_search_collection=FakeAsyncCollection(latency),
+    )
+    # Every request must pay for its embed and generate calls: with the caches on,
+    # only the first request would, and the runs would mostly time cache hits
+    ragService.query_embedding_cache = EmbeddingCache(max_entries=0)
+    ragService.answer_cache = SemanticAnswerCache(max_entries=0)
+
+
+# --------------------------------------------------------------------------
+# Runners
+# --------------------------------------------------------------------------
+
+QUERIES = [
+    "How do I apply for a farm loan?",
+    "What housing assistance is available for low-income rural families?",
+    "Are there grants for farmworker housing?",
+    "Who can get a Section 502 direct loan?",
+    "What programs help beginning farmers buy land?",
+]
+
+
+def _query(n):
+    """A distinct question per request (the caches are off too, see install_stubs)."""
+    return f"{QUERIES[n % len(QUERIES)]} (request {n})"
+
+
+# Latency is measured from when the whole burst is submitted, so time spent
+# waiting for a free worker thread counts against the sync path.
+
+def _timed_sync_call(n, submitted):
+    ragService.get_rag_answer(_query(n))
+    return time.perf_counter() - submitted
+
+
+async def _timed_async_call(n, submitted):
+    await ragService.get_rag_answer_async(_query(n))
+    return time.perf_counter() - submitted
+
+
+def run_sync(concurrency, threadpool_size):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threadpool_size) as pool:
+        latencies = list(pool.map(lambda n: _timed_sync_call(n, start), range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+
+def run_async(concurrency):
+    async def _main():
+        submitted = time.perf_counter()
+        return await asyncio.gather(*[_timed_async_call(n, submitted) for n in range(concurrency)])
+
+    start = time.perf_counter()
+    latencies = asyncio.run(_main())
+    return time.perf_counter() - start, list(latencies)
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+def report(label, concurrency, wall, latencies):
+    print(
+        f"{label:<6} c={concurrency:<4} wall={wall:7.3f}s "
+        f"throughput={concurrency / wall:8.1f} req/s "
+        f"p50={statistics.median(latencies) * 1000:8.1f}ms "
+        f"p95={_percentile(latencies, 95) * 1000:8.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync vs async RAG path with stubbed backends")
+    parser.add_argument("--concurrency", default="1,50,500", help="Comma-separated concurrency levels")
+    parser.add_argument("--embed-ms", type=float, default=50)
+    parser.add_argument("--search-ms", type=float, default=30)
+    parser.add_argument("--generate-ms", type=float, default=800)
+    parser.add_argument("--threadpool", type=int, default=DEFAULT_THREADPOOL_SIZE,
+                        help="Worker threads for the sync path (Starlette default: 40)")
+    args = parser.parse_args()
+
+    latency = {
+        'embed': args.embed_ms / 1000.0,
+        'search': args.search_ms / 1000.0,
+        'generate': args.generate_ms / 1000.0,
+    }
+    install_stubs(latency)
+
+    print(f"Stub latency (ms): embed={args.embed_ms} search={args.search_ms} generate={args.generate_ms}")
+    for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+        wall, latencies = run_sync(concurrency, args.threadpool)
+        report("sync", concurrency, wall, latencies)
+        wall, latencies = run_async(concurrency)
+        report("async", concurrency, wall, latencies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Benchmark: query-embedding cache on a replayed query log.
+#
+# Usage: python benchmark_embedding_cache.py [--log queries.txt] [--embed-ms 120] [--shared-path cache.sqlite]
+#
+# The query log is one question per line. Without --log a synthetic log with the
+# kind of repeats/near-duplicates we see in production is used. Gemini and Mongo
+# are stubbed (see benchmark_chat.py), so only the embed step costs time.
+import argparse
+import random
+import time
+
+import ragService
+from benchmark_chat import install_stubs
+from embedding_cache import EmbeddingCache
+
+SAMPLE_QUERIES = [
+    "How do I apply for a farm loan?",
+    "how do i apply for a farm loan",
+    "How do I apply for a  farm loan??",
+    "What is the Section 502 Direct Loan Program?",
+    "Who can apply for MPPEP?",
+    "What are the requirements for Farm Labor Housing grants?",
+    "Is the Rural Business Development Grant open?",
+    "What is the interest rate on a Single Family Housing Direct Home Loan?",
+]
+
+
+def load_log(path, size, seed):
+    if path:
+        with open(path, encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    rng = random.Random(seed)
+    # Skewed popularity: the first few questions dominate, like real traffic
+    weights = [1.0 / (i + 1) for i in range(len(SAMPLE_QUERIES))]
+    return rng.choices(SAMPLE_QUERIES, weights=weights, k=size)
+
+
+class CountingModels:
+    """Wraps the stubbed models object and records time spent in embed_content."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.embed_calls = 0
+        self.embed_seconds = 0.0
+
+    def embed_content(self, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.inner.embed_content(**kwargs)
+        finally:
+            self.embed_calls += 1
+            self.embed_seconds += time.perf_counter() - start
+
+    def generate_content(self, **kwargs):
+        return self.inner.generate_content(**kwargs)
+
+
+def replay(queries, cache):
+    ragService.query_embedding_cache = cache
+    models = CountingModels(ragService.gemini_client.models)
+    original = ragService.gemini_client.models
+    ragService.gemini_client.models = models
+    start = time.perf_counter()
+    try:
+        for q in queries:
+            ragService.get_rag_answer(q)
+    finally:
+        ragService.gemini_client.models = original
+    return time.perf_counter() - start, models
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a query log with and without the query-embedding cache")
+    parser.add_argument("--log", help="Query log file (one question per line)")
+    parser.add_argument("--size", type=int, default=500, help="Synthetic log size when --log is not given")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--embed-ms", type=float, default=120)
+    parser.add_argument("--shared-path", help="Also replay against a SQLite-backed cache at this path")
+    args = parser.parse_args()
+
+    install_stubs({'embed': args.embed_ms / 1000.0, 'search': 0.0, 'generate': 0.0})
+    queries = load_log(args.log, args.size, args.seed)
+    print(f"Replaying {len(queries)} queries ({len(set(queries))} distinct strings), embed latency {args.embed_ms} ms")
+
+    runs = [("no cache", EmbeddingCache(max_entries=0)), ("in-process", EmbeddingCache())]
+    if args.shared_path:
+        runs.append(("sqlite (cold)", EmbeddingCache(path=args.shared_path)))
+        # A fresh in-process cache over the same file behaves like a restarted / second worker
+        runs.append(("sqlite (warm)", EmbeddingCache(path=args.shared_path)))
+
+    for label, cache in runs:
+        wall, models = replay(queries, cache)
+        stats = cache.stats()
+        print(
+            f"{label:<14} wall={wall:7.3f}s embed_calls={models.embed_calls:<5} "
+            f"embed_time={models.embed_seconds:7.3f}s hits={stats['hits']:<5} "
+            f"misses={stats['misses']:<5} hit_rate={stats['hit_rate']:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,614 @@
+# Offline benchmark suite: replays a query corpus through get_rag_answer (threads),
+# get_rag_answer_async (event loop) and POST /chat (the FastAPI app in-process) with
+# deterministic local stand-ins for Gemini and Mongo.
+#
+# Usage: python benchmark_rag.py [--targets sync,async,api] [--concurrency 1,8,32] [--requests 200]
+#                                [--backend local|atlas] [--docs 500] [--embed-ms 40] [--search-ms 25]
+#                                [--generate-ms 400] [--queries fixtures/rag/queries.txt] [--duplicates 8]
+#                                [--output results.json] [--compare baseline.json --threshold 10]
+#
+#   - fake embedder: hashed bag-of-words vectors (same text -> same vector) after --embed-ms
+#   - vector store:  --backend local uses ragService's LocalVectorIndex (NumPy, in-process);
+#                    --backend atlas answers $vectorSearch by brute force after --search-ms
+#   - fake generator: sleeps --generate-ms and reports usage_metadata token counts
+#   - --stall-rate 0.02 --stall-ms 3000: that share of Gemini calls stalls for that long
+#     (tail latency; GEMINI_HEDGE=0 vs 1 shows what hedged requests buy)
+#   Gemini calls go through ragService's ResilientGeminiClient, as in production.
+#
+# Each (target, concurrency) run keeps `concurrency` requests in flight until --requests
+# have completed and reports p50/p95/p99 latency, throughput, memory and the number of
+# upstream (fake Gemini) calls. --duplicates N sends every question N times in a row, so
+# concurrent workers ask the same thing at once (see single_flight.py);
+# targets: sync, async, api (POST /chat) and stream (POST /chat/stream). --output saves
+# the results as JSON; --compare prints the change against an earlier results file and
+# exits 1 when p95 latency or throughput regressed by more than --threshold percent.
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+os.environ.setdefault("WARMUP_ENABLED", "0")   # api_app must not try to reach Atlas/Gemini
+
+import ragService
+from bm25_index import tokenize
+from vector_codec import decode_vector
+
+EMBED_DIM = 768
+DEFAULT_QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "rag", "queries.txt")
+
+# Seed programs the synthetic corpus is generated from (title, program_name, overview)
+SEED_PROGRAMS = [
+    ("Single Family Housing Direct Home Loans", "Section 502 Direct Loan Program",
+     "Helps low- and very-low-income applicants obtain decent, safe and sanitary housing in eligible rural areas by providing payment assistance to increase an applicant's repayment ability."),
+    ("Single Family Housing Guaranteed Loan Program", "Section 502 Guaranteed Loan Program",
+     "Assists approved lenders in providing low- and moderate-income households the opportunity to own adequate, modest, decent, safe and sanitary dwellings as their primary residence in eligible rural areas."),
+    ("Single Family Housing Repair Loans & Grants", "Section 504 Home Repair Program",
+     "Provides loans to very-low-income homeowners to repair, improve or modernize their homes, or grants to elderly very-low-income homeowners to remove health and safety hazards."),
+    ("Farm Labor Housing Direct Loans & Grants", "Farm Labor Housing",
+     "Provides affordable financing to develop housing for year-round and migrant or seasonal domestic farm laborers."),
+    ("Multifamily Housing Direct Loans", "Section 515 Rural Rental Housing",
+     "Provides competitive financing for affordable multifamily rental housing for low-income, elderly and disabled individuals and families in eligible rural areas."),
+    ("Multifamily Housing Rental Assistance", "Section 521 Rental Assistance",
+     "Provides an additional source of support for household rents that exceed 30 percent of an eligible tenant's income."),
+    ("Mutual Self-Help Housing Technical Assistance Grants", "Section 523 Self-Help",
+     "Provides grants to qualified organizations to help them carry out local self-help housing construction projects where families build their own homes."),
+    ("Community Facilities Direct Loan & Grant Program", "Community Facilities",
+     "Provides affordable funding to develop essential community facilities in rural areas such as hospitals, fire stations, schools and libraries; public bodies, nonprofits and federally recognized tribes may apply."),
+    ("Water & Waste Disposal Loan & Grant Program", "Water and Environmental Programs",
+     "Provides funding for clean and reliable drinking water systems, sanitary sewage disposal, sanitary solid waste disposal and storm water drainage to households and businesses in eligible rural areas."),
+    ("Business & Industry Loan Guarantees", "B&I Guaranteed Loans",
+     "Bolsters the availability of private credit by guaranteeing loans for rural businesses, helping them create jobs and stimulate rural economies."),
+    ("Rural Energy for America Program Renewable Energy Systems & Energy Efficiency Improvement Guaranteed Loans & Grants", "REAP",
+     "Provides guaranteed loan financing and grant funding to agricultural producers and rural small businesses for renewable energy systems or energy efficiency improvements."),
+    ("Value-Added Producer Grants", "VAPG",
+     "Helps agricultural producers enter into value-added activities related to the processing and marketing of new products, generating new income and expanding markets."),
+    ("Rural Cooperative Development Grant Program", "RCDG",
+     "Improves the economic condition of rural areas by helping individuals and businesses start, expand or improve rural cooperatives and other mutually owned businesses."),
+    ("ReConnect Loan and Grant Program", "ReConnect",
+     "Furnishes loans and grants to provide funds for the costs of construction, improvement or acquisition of facilities and equipment needed to provide broadband service in eligible rural areas."),
+    ("Rural Economic Development Loan & Grant Program", "REDLG",
+     "Provides funding for rural projects through local utility organizations for economic development planning and job creation."),
+    ("Farm Ownership Loans", "Farm Service Agency Direct Farm Ownership",
+     "Helps farmers and ranchers purchase farmland, construct and repair buildings and make farm improvements; applicants apply through their local service center."),
+]
+
+FILLER = ("eligible applicants rural areas population funding application deadline state office "
+          "interest rate term years collateral nonprofit public body tribe income limits program "
+          "requirements contact local office assistance construction improvement").split()
+
+
+# --------------------------------------------------------------------------
+# Deterministic stand-ins
+# --------------------------------------------------------------------------
+
+def fake_embedding(text, dim=EMBED_DIM):
+    """Hashed bag-of-words vector: identical text gives identical vectors, shared words give similarity."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for token in tokenize(text):
+        h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    return vec.tolist()
+
+
+def build_corpus(num_docs, seed=7):
+    """num_docs program documents derived from SEED_PROGRAMS, with embeddings."""
+    rng = random.Random(seed)
+    updated_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for n in range(num_docs):
+        title, program_name, overview = SEED_PROGRAMS[n % len(SEED_PROGRAMS)]
+        if n >= len(SEED_PROGRAMS):
+            title = f"{title} (variant {n // len(SEED_PROGRAMS)})"
+        text = overview + " " + " ".join(rng.choice(FILLER) for _ in range(rng.randint(40, 160))) + "."
+        docs.append({
+            "_id": n,
+            "unique_id": f"bench-{n}",
+            "title": title,
+            "program_name": program_name,
+            "program_overview": overview,
+            ragService.TEXT_FIELD: text,
+            ragService.VECTOR_FIELD: fake_embedding(f"{title} {program_name} {overview}"),
+            "updated_at": updated_at,
+        })
+    return docs
+
+
+def _matches(doc, query):
+    for field, cond in (query or {}).items():
+        value = doc.get(field)
+        if isinstance(cond, dict):
+            for op, arg in cond.items():
+                if op == "$exists" and (value is not None) != bool(arg):
+                    return False
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$gt" and not (value is not None and value > arg):
+                    return False
+                if op not in ("$exists", "$in", "$gt"):
+                    return False
+        elif field.startswith("$"):
+            return False   # $text / $or regex fallbacks: no text index here
+        elif value != cond:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    return {field: doc[field] for field, keep in projection.items() if keep and field in doc}
+
+
+class InMemoryCollection:
+    """
+    pymongo-style collection over a list of documents: find()/find_one()/count_documents()
+    with simple filters, and aggregate() answering a $vectorSearch + $project pipeline by
+    brute-force cosine similarity after `latency['search']`.
+    """
+
+    def __init__(self, docs, latency):
+        self.docs = docs
+        self.latency = latency
+        self._matrix = None
+
+    def _vector_matrix(self):
+        if self._matrix is None:
+            matrix = np.asarray([decode_vector(d[ragService.VECTOR_FIELD]) for d in self.docs], dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._matrix = matrix / np.where(norms == 0, 1, norms)
+        return self._matrix
+
+    def find(self, query=None, projection=None, **kwargs):
+        return _Cursor([_project(d, projection) for d in self.docs if _matches(d, query)])
+
+    def find_one(self, query=None, projection=None):
+        return next(iter(self.find(query, projection)), None)
+
+    def count_documents(self, query):
+        return sum(1 for d in self.docs if _matches(d, query))
+
+    def run_pipeline(self, pipeline):
+        stage = pipeline[0].get("$vectorSearch") if pipeline else None
+        if stage is None:
+            return []   # $search (Atlas Search) is not emulated
+        q = decode_vector(stage["queryVector"]).astype(np.float32)
+        scores = self._vector_matrix() @ (q / (np.linalg.norm(q) or 1.0))
+        top = np.argsort(-scores)[:stage["limit"]]
+        project = next((s["$project"] for s in pipeline[1:] if "$project" in s), {})
+        results = []
+        for row in top:
+            doc, out = self.docs[row], {}
+            for field, spec in project.items():
+                if isinstance(spec, str) and spec.startswith("$"):
+                    out[field] = doc.get(spec[1:])
+                elif isinstance(spec, dict) and spec.get("$meta") == "vectorSearchScore":
+                    out[field] = (1.0 + float(scores[row])) / 2.0
+            results.append(out)
+        return results
+
+    def aggregate(self, pipeline, **kwargs):
+        time.sleep(self.latency["search"])
+        return iter(self.run_pipeline(pipeline))
+
+
+class _Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def limit(self, n):
+        self.docs = self.docs[:n] if n else self.docs
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    async def to_list(self, length=None):
+        return self.docs
+
+
+class AsyncInMemoryCollection:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, query=None, projection=None, **kwargs):
+        return self.collection.find(query, projection)
+
+    async def find_one(self, query=None, projection=None):
+        return self.collection.find_one(query, projection)
+
+    async def count_documents(self, query):
+        return self.collection.count_documents(query)
+
+    async def aggregate(self, pipeline, **kwargs):
+        await asyncio.sleep(self.collection.latency["search"])
+        return _Cursor(self.collection.run_pipeline(pipeline))
+
+
+def _fake_answer(contents):
+    text = "Here is what I found. * **Purpose:** Deterministic benchmark answer. * **Eligibility:** See the program page."
+    usage = SimpleNamespace(prompt_token_count=len(contents) // 4, candidates_token_count=len(text) // 4)
+    return text, usage
+
+
+# Calls that reached the fake Gemini models, by kind (embed / generate)
+upstream_calls = {"embed": 0, "generate": 0}
+_upstream_lock = threading.Lock()
+
+
+_stall_rng = random.Random(7)
+
+
+def _count_upstream(kind):
+    with _upstream_lock:
+        upstream_calls[kind] += 1
+
+
+def _delay(latency, kind):
+    """Fake call latency; occasionally a stall (--stall-rate / --stall-ms)."""
+    with _upstream_lock:
+        stalled = _stall_rng.random() < latency.get("stall_rate", 0.0)
+    return latency[kind] + (latency.get("stall", 0.0) if stalled else 0.0)
+
+
+class FakeModels:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def embed_content(self, model, contents, config=None):
+        _count_upstream("embed")
+        time.sleep(_delay(self.latency, "embed"))
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=fake_embedding(c)) for c in contents])
+
+    def generate_content(self, model, contents, config=None):
+        _count_upstream("generate")
+        time.sleep(_delay(self.latency, "generate"))
+        text, usage = _fake_answer(contents)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+class FakeAsyncModels:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def embed_content(self, model, contents, config=None):
+        _count_upstream("embed")
+        await asyncio.sleep(_delay(self.latency, "embed"))
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=fake_embedding(c)) for c in contents])
+
+    async def generate_content(self, model, contents, config=None):
+        _count_upstream("generate")
+        await asyncio.sleep(_delay(self.latency, "generate"))
+        text, usage = _fake_answer(contents)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        _count_upstream("generate")
+        text, usage = _fake_answer(contents)
+        words = text.split(" ")
+        pieces = [" ".join(words[i:i + 4]) + " " for i in range(0, len(words), 4)]
+
+        async def _stream():
+            for n, piece in enumerate(pieces):
+                await asyncio.sleep(self.latency["generate"] / len(pieces))
+                yield SimpleNamespace(text=piece, usage_metadata=usage if n == len(pieces) - 1 else None)
+
+        return _stream()
+
+
+def install_backends(docs, latency, backend):
+    collection = InMemoryCollection(docs, latency)
+    async_collection = AsyncInMemoryCollection(collection)
+    ragService.clients.override(
+        gemini_client=ragService.make_gemini_client(
+            SimpleNamespace(models=FakeModels(latency), aio=SimpleNamespace(models=FakeAsyncModels(latency)))),
+        collection=collection,
+        async_collection=async_collection,
+        search_collection=collection,
+        async_search_collection=async_collection,
+    )
+    ragService.RETRIEVAL_UNIT = "program"   # the corpus has no chunk collection
+    ragService.RETRIEVER_BACKEND = backend
+    ragService._local_vector_index = None
+    if backend == "local":
+        ragService.get_local_vector_index().load()
+
+
+def reset_caches():
+    ragService.query_embedding_cache.clear()
+    ragService.answer_cache.clear()
+    ragService.reranker.clear()
+
+
+# --------------------------------------------------------------------------
+# Runners: `concurrency` requests in flight until `total` have completed
+# --------------------------------------------------------------------------
+
+def _is_error(answer):
+    return not answer or answer.startswith("Error")
+
+
+def run_sync(queries, total, concurrency):
+    def worker(offset):
+        latencies, errors = [], 0
+        for n in range(offset, total, concurrency):
+            started = time.perf_counter()
+            answer = ragService.get_rag_answer(queries[n % len(queries)])
+            latencies.append(time.perf_counter() - started)
+            errors += _is_error(answer)
+        return latencies, errors
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return _merge(pool.map(worker, range(concurrency)))
+
+
+def run_async(queries, total, concurrency):
+    async def worker(offset):
+        latencies, errors = [], 0
+        for n in range(offset, total, concurrency):
+            started = time.perf_counter()
+            answer = await ragService.get_rag_answer_async(queries[n % len(queries)])
+            latencies.append(time.perf_counter() - started)
+            errors += _is_error(answer)
+        return latencies, errors
+
+    async def main():
+        return await asyncio.gather(*[worker(offset) for offset in range(concurrency)])
+
+    return _merge(asyncio.run(main()))
+
+
+def run_api(queries, total, concurrency):
+    import httpx
+    import api_app
+
+    async def worker(client, offset):
+        latencies, errors = [], 0
+        for n in range(offset, total, concurrency):
+            started = time.perf_counter()
+            response = await client.post("/chat", json={"query": queries[n % len(queries)]})
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code != 200 or _is_error(response.json().get("response"))
+        return latencies, errors
+
+    async def main():
+        transport = httpx.ASGITransport(app=api_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            return await asyncio.gather(*[worker(client, offset) for offset in range(concurrency)])
+
+    return _merge(asyncio.run(main()))
+
+
+def run_stream(queries, total, concurrency):
+    import httpx
+    import api_app
+
+    async def worker(client, offset):
+        latencies, errors = [], 0
+        for n in range(offset, total, concurrency):
+            started = time.perf_counter()
+            response = await client.post("/chat/stream", json={"query": queries[n % len(queries)]})
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code != 200 or "event: done" not in response.text
+        return latencies, errors
+
+    async def main():
+        transport = httpx.ASGITransport(app=api_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            return await asyncio.gather(*[worker(client, offset) for offset in range(concurrency)])
+
+    return _merge(asyncio.run(main()))
+
+
+def _merge(parts):
+    latencies, errors = [], 0
+    for part_latencies, part_errors in parts:
+        latencies.extend(part_latencies)
+        errors += part_errors
+    return latencies, errors
+
+
+RUNNERS = {"sync": run_sync, "async": run_async, "api": run_api, "stream": run_stream}
+
+
+# --------------------------------------------------------------------------
+# Reporting
+# --------------------------------------------------------------------------
+
+def percentile(values, pct):
+    """Linear-interpolated percentile (numpy's default method)."""
+    return float(np.percentile(values, pct)) if values else 0.0
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def _maxrss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0   # KiB on Linux
+
+
+def _cache_counts():
+    return {name: (cache.hits, cache.misses)
+            for name, cache in (("embedding", ragService.query_embedding_cache), ("answer", ragService.answer_cache))}
+
+
+def measure(target, queries, total, concurrency, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+    rss_before = _rss_mb()
+    counts_before = _cache_counts()
+    upstream_before = dict(upstream_calls)
+    started = time.perf_counter()
+    latencies, errors = RUNNERS[target](queries, total, concurrency)
+    wall = time.perf_counter() - started
+    hit_rates = {}
+    for name, (hits, misses) in _cache_counts().items():
+        hits, misses = hits - counts_before[name][0], misses - counts_before[name][1]
+        hit_rates[name] = round(hits / (hits + misses), 3) if hits + misses else None
+    result = {
+        "target": target,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "mean_ms": round(float(np.mean(latencies)) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "rss_mb": None if rss_before is None else round(_rss_mb(), 1),
+        "rss_delta_mb": None if rss_before is None else round(_rss_mb() - rss_before, 1),
+        "maxrss_mb": round(_maxrss_mb(), 1),
+        "cache_hit_rate": hit_rates,
+        "upstream_calls": {kind: upstream_calls[kind] - upstream_before[kind] for kind in upstream_calls},
+    }
+    if trace_memory:
+        result["py_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    return result
+
+
+def print_result(r):
+    print(f"{r['target']:<6} c={r['concurrency']:<4} n={r['requests']:<5} err={r['errors']:<3} "
+          f"throughput={r['throughput_rps']:8.1f} req/s p50={r['p50_ms']:8.1f}ms p95={r['p95_ms']:8.1f}ms "
+          f"p99={r['p99_ms']:8.1f}ms rss={r['rss_mb']}MB (+{r['rss_delta_mb']}) maxrss={r['maxrss_mb']}MB "
+          f"answer_hits={r['cache_hit_rate']['answer']} upstream={r['upstream_calls']}"
+          + (f" py_peak={r['py_peak_mb']}MB" if "py_peak_mb" in r else ""))
+
+
+def _git_revision():
+    repo = os.path.dirname(os.path.abspath(__file__))
+    git = lambda *cmd: subprocess.run(["git", *cmd], cwd=repo, capture_output=True, text=True, timeout=10).stdout.strip()
+    try:
+        rev = git("rev-parse", "--short", "HEAD")
+        dirty = git("status", "--porcelain", "--untracked-files=no")
+        return f"{rev}{'-dirty' if dirty else ''}" if rev else None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline_path, threshold_pct):
+    """Prints the change against a previous results file; returns the number of regressions."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["config"].get("backend") != results["config"].get("backend"):
+        print(f"Note: baseline used backend {baseline['config'].get('backend')!r}")
+    previous = {(r["target"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline_path} ({baseline.get('git_revision') or 'unknown revision'}):")
+    regressions = 0
+    for r in results["results"]:
+        old = previous.get((r["target"], r["concurrency"]))
+        if old is None:
+            continue
+        change = lambda key: (r[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        p95, throughput = change("p95_ms"), change("throughput_rps")
+        regressed = p95 > threshold_pct or throughput < -threshold_pct
+        regressions += regressed
+        print(f"{r['target']:<6} c={r['concurrency']:<4} p50 {change('p50_ms'):+6.1f}%  p95 {p95:+6.1f}%  "
+              f"p99 {change('p99_ms'):+6.1f}%  throughput {throughput:+6.1f}%{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def load_queries(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line)["query"] for line in f if line.strip()]
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline RAG benchmark with deterministic Gemini/Mongo stand-ins")
+    parser.add_argument("--targets", default="sync,async,api",
+                        help="Comma-separated: sync, async, api (/chat), stream (/chat/stream)")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per (target, concurrency) run")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES, help="Query corpus: one per line, or JSONL with a 'query' field")
+    parser.add_argument("--duplicates", type=int, default=1,
+                        help="Send each question this many times in a row (bursts of identical questions)")
+    parser.add_argument("--docs", type=int, default=500, help="Synthetic program documents in the vector store")
+    parser.add_argument("--backend", choices=("local", "atlas"), default="local",
+                        help="local: ragService's NumPy index; atlas: stubbed $vectorSearch with --search-ms latency")
+    parser.add_argument("--embed-ms", type=float, default=40)
+    parser.add_argument("--search-ms", type=float, default=25)
+    parser.add_argument("--generate-ms", type=float, default=400)
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of Gemini calls that stall")
+    parser.add_argument("--stall-ms", type=float, default=3000, help="Extra latency of a stalled Gemini call")
+    parser.add_argument("--warm-caches", action="store_true", help="Keep embedding/answer caches between runs")
+    parser.add_argument("--no-answer-cache", action="store_true",
+                        help="Disable the semantic answer cache so every request reaches the generator")
+    parser.add_argument("--trace-memory", action="store_true", help="Also report the tracemalloc peak (slower)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent (p95 / throughput)")
+    args = parser.parse_args()
+
+    latency = {"embed": args.embed_ms / 1000.0, "search": args.search_ms / 1000.0, "generate": args.generate_ms / 1000.0,
+               "stall_rate": args.stall_rate, "stall": args.stall_ms / 1000.0}
+    queries = [query for query in load_queries(args.queries) for _ in range(max(1, args.duplicates))]
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = set(targets) - set(RUNNERS)
+    if unknown:
+        parser.error(f"unknown target(s): {', '.join(sorted(unknown))}")
+    install_backends(build_corpus(args.docs), latency, args.backend)
+    if args.no_answer_cache:
+        ragService.answer_cache.max_entries = 0
+
+    print(f"Corpus: {len(queries) // max(1, args.duplicates)} queries x{args.duplicates}, {args.docs} documents, backend={args.backend}; "
+          f"stub latency (ms): embed={args.embed_ms} search={args.search_ms} generate={args.generate_ms}")
+    results = []
+    for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+        for target in targets:
+            if not args.warm_caches:
+                reset_caches()
+            result = measure(target, queries, args.requests, concurrency, args.trace_memory)
+            print_result(result)
+            results.append(result)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "config": {
+            "backend": args.backend,
+            "docs": args.docs,
+            "query_file": args.queries,
+            "queries": len(queries) // max(1, args.duplicates),
+            "duplicates": args.duplicates,
+            "requests": args.requests,
+            "latency_ms": {"embed": args.embed_ms, "search": args.search_ms, "generate": args.generate_ms,
+                           "stall_rate": args.stall_rate, "stall": args.stall_ms},
+            "warm_caches": args.warm_caches,
+            "answer_cache": not args.no_answer_cache,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.output}")
+    if args.compare:
+        regressions = compare(report, args.compare, args.threshold)
+        if regressions:
+            print(f"{regressions} regression(s) above {args.threshold}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
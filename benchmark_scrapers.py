@@ -0,0 +1,104 @@
+# Benchmark: HTTP + HTML-parser scrape engine vs the Selenium WebDriver pool.
+#
+# Usage: python benchmark_scrapers.py [--pages 200] [--concurrency 16] [--selenium --workers 4]
+#
+# Runs fully offline: the saved fixtures in fixtures/usda/ are served from a local
+# HTTP server, so both engines fetch real HTTP responses with the same markup.
+# The Selenium run is opt-in (--selenium) because it needs Firefox/geckodriver.
+import argparse
+import asyncio
+import functools
+import os
+import resource
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import http_scraper
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "usda")
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real site
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_fixtures():
+    handler = functools.partial(_QuietHandler, directory=FIXTURE_DIR)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024.0
+
+
+def check_fixtures():
+    """Offline contract check: every field of the program fixture parses; the JS fixture needs a browser."""
+    with open(os.path.join(FIXTURE_DIR, "program_page.html"), encoding="utf-8") as f:
+        fields = http_scraper.parse_program_page(f.read(), "https://www.rd.usda.gov/programs-services/mppep")
+    missing = [name for name, value in fields.items() if not value]
+    with open(os.path.join(FIXTURE_DIR, "js_only_page.html"), encoding="utf-8") as f:
+        js_needs_browser = http_scraper.needs_browser(http_scraper.parse_program_page(f.read(), "x"))
+    print(f"Fixture check: {len(fields) - len(missing)}/{len(fields)} fields parsed"
+          f"{' (missing: ' + ', '.join(missing) + ')' if missing else ''}; "
+          f"JS-only page routed to browser: {js_needs_browser}")
+    return fields
+
+
+def run_http(links, concurrency):
+    start = time.perf_counter()
+    items, browser_links, failures = asyncio.run(http_scraper.scrape_programs_http(links, concurrency))
+    wall = time.perf_counter() - start
+    print(f"http      pages={len(links):<5} wall={wall:7.3f}s pages/sec={len(links) / wall:8.1f} "
+          f"maxrss(self)={_rss_mb():7.1f}MB browser_fallbacks={len(browser_links)} failures={len(failures)}")
+    return items
+
+
+def run_selenium(links, workers):
+    from parallel_scraper import scrape_programs
+    start = time.perf_counter()
+    items, failures = scrape_programs(links, workers=workers, retries=0)
+    wall = time.perf_counter() - start
+    # Browser processes have exited by now, so their peak RSS is in RUSAGE_CHILDREN
+    print(f"selenium  pages={len(links):<5} wall={wall:7.3f}s pages/sec={len(links) / wall:8.1f} "
+          f"maxrss(self)={_rss_mb():7.1f}MB maxrss(largest browser process)={_rss_mb(resource.RUSAGE_CHILDREN):7.1f}MB "
+          f"failures={len(failures)}")
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the HTTP scrape engine with the Selenium pool on local fixtures")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16, help="HTTP engine concurrency")
+    parser.add_argument("--selenium", action="store_true", help="Also run the Selenium pool (needs Firefox)")
+    parser.add_argument("--workers", type=int, default=4, help="Selenium pool size")
+    args = parser.parse_args()
+
+    expected = check_fixtures()
+    server, base = serve_fixtures()
+    try:
+        # Distinct query strings so nothing is served from a cache
+        links = [f"{base}/program_page.html?p={i}" for i in range(args.pages)]
+        http_items = run_http(links, args.concurrency)
+        mismatched = sum(1 for item in http_items if item is None or item.get("title") != expected["title"])
+        print(f"http engine field check: {len(http_items) - mismatched}/{len(http_items)} pages match the fixture")
+
+        if args.selenium:
+            selenium_items = run_selenium(links, args.workers)
+            same = sum(
+                1 for a, b in zip(http_items, selenium_items)
+                if a and b and all(a.get(k) == b.get(k) for k in ("title", "program_status", "program_deadline", "program_overview"))
+            )
+            print(f"engines agree on title/status/deadline/overview for {same}/{len(links)} pages")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+# Compact on-disk BM25 inverted index over the program documents.
+#
+# Layout of the index directory (one immutable "generation" per commit):
+#   manifest.json        -> {"generation", "num_docs", "avg_length", "num_postings", ...}
+#   terms.<gen>.json     -> term -> [first posting, document frequency]
+#   postings.<gen>.i32   -> int32 pairs (doc number, weighted term frequency), grouped by term
+#   lengths.<gen>.i32    -> int32 weighted length per doc number
+#   docs.<gen>.json      -> doc number -> {unique_id, title, program_name}
+#   forward.<gen>.json   -> unique_id -> {term: tf} (only read by the writer for incremental updates)
+#
+# Readers memory-map the postings and lengths; writers re-tokenize only the
+# documents that changed, rebuild the postings from the forward index and
+# switch generations by atomically replacing manifest.json.
+
+K1 = 1.2
+B = 0.75
+
+# (field, weight): a title or program_name hit counts as FIELD_WEIGHT term occurrences
+FIELD_WEIGHTS = (("title", 3), ("program_name", 3), ("program_overview", 1))
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or our "
+    "the this to what when where which who why with you your".split()
+)
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercased alphanumeric tokens without stopwords; numbers are kept ("502")."""
+    if not text:
+        return []
+    return [t for t in _TOKEN.findall(str(text).lower()) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+def document_terms(doc, text_field):
+    """Weighted term frequencies of one document over the indexed fields."""
+    weights = FIELD_WEIGHTS
+    # TEXT_FIELD usually holds the overview itself; only index it when it adds something
+    if text_field not in dict(weights) and doc.get(text_field) and doc.get(text_field) != doc.get("program_overview"):
+        weights = weights + ((text_field, 1),)
+    terms = {}
+    for field, weight in weights:
+        for token in tokenize(doc.get(field)):
+            terms[token] = terms.get(token, 0) + weight
+    return terms
+
+
+def _atomic_write(path, data, mode="w"):
+    tmp = f"{path}.tmp"
+    with open(tmp, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class BM25IndexWriter:
+    """
+    Builds and incrementally updates the on-disk index.
+
+        writer = BM25IndexWriter(path, TEXT_FIELD)
+        writer.upsert(docs)          # program documents (unique_id, title, program_overview, ...)
+        writer.remove(unique_ids)
+        writer.commit()              # writes a new generation; readers pick it up on reload
+    """
+
+    def __init__(self, path, text_field):
+        self.path = path
+        self.text_field = text_field
+        self._forward = {}   # unique_id -> {term: tf}
+        self._meta = {}      # unique_id -> {unique_id, title, program_name}
+        self._generation = 0
+        self._dirty = False
+        manifest = _read_manifest(path)
+        if manifest:
+            self._generation = manifest["generation"]
+            with open(os.path.join(path, f"forward.{self._generation}.json"), encoding="utf-8") as f:
+                stored = json.load(f)
+            self._forward = {uid: entry["terms"] for uid, entry in stored.items()}
+            self._meta = {uid: entry["meta"] for uid, entry in stored.items()}
+
+    def exists(self):
+        return self._generation > 0
+
+    def __len__(self):
+        return len(self._forward)
+
+    def upsert(self, docs):
+        for doc in docs:
+            uid = doc.get("unique_id")
+            if not uid:
+                continue
+            self._forward[str(uid)] = document_terms(doc, self.text_field)
+            self._meta[str(uid)] = {"unique_id": uid, "title": doc.get("title"), "program_name": doc.get("program_name")}
+            self._dirty = True
+
+    def remove(self, unique_ids):
+        for uid in unique_ids:
+            if self._forward.pop(str(uid), None) is not None:
+                self._meta.pop(str(uid), None)
+                self._dirty = True
+
+    def rebuild_from(self, collection):
+        """Replaces the forward index with every program document in the collection."""
+        projection = {"_id": 0, "unique_id": 1, "title": 1, "program_name": 1, "program_overview": 1, self.text_field: 1}
+        self._forward, self._meta = {}, {}
+        self.upsert(collection.find({"unique_id": {"$exists": True}}, projection))
+        self._dirty = True
+
+    def commit(self):
+        """Writes a new generation if anything changed; returns the generation number."""
+        if not self._dirty and self.exists():
+            return self._generation
+        os.makedirs(self.path, exist_ok=True)
+        uids = sorted(self._forward)
+        postings = {}
+        lengths = np.zeros(len(uids), dtype=np.int32)
+        for doc_no, uid in enumerate(uids):
+            terms = self._forward[uid]
+            lengths[doc_no] = sum(terms.values())
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((doc_no, tf))
+
+        term_table, flat = {}, []
+        for term in sorted(postings):
+            term_table[term] = [len(flat), len(postings[term])]
+            flat.extend(postings[term])
+        postings_array = np.asarray(flat, dtype=np.int32).reshape(-1, 2)
+
+        generation = self._generation + 1
+        join = lambda name: os.path.join(self.path, f"{name}.{generation}")
+        _atomic_write(join("postings") + ".i32", postings_array.tobytes(), "wb")
+        _atomic_write(join("lengths") + ".i32", lengths.tobytes(), "wb")
+        _atomic_write(join("terms") + ".json", json.dumps(term_table, separators=(",", ":")))
+        _atomic_write(join("docs") + ".json", json.dumps([self._meta[uid] for uid in uids], default=str))
+        forward = {uid: {"terms": self._forward[uid], "meta": self._meta[uid]} for uid in uids}
+        _atomic_write(join("forward") + ".json", json.dumps(forward, default=str, separators=(",", ":")))
+        manifest = {
+            "generation": generation,
+            "num_docs": len(uids),
+            "num_terms": len(term_table),
+            "num_postings": int(postings_array.shape[0]),
+            "avg_length": float(lengths.mean()) if len(uids) else 0.0,
+            "text_field": self.text_field,
+            "committed_at": time.time(),
+        }
+        _atomic_write(os.path.join(self.path, "manifest.json"), json.dumps(manifest, indent=2))
+
+        self._remove_generations(keep=(self._generation, generation))
+        self._generation = generation
+        self._dirty = False
+        return generation
+
+    def _remove_generations(self, keep):
+        # The previous generation is kept so a reader that has not reloaded yet stays valid
+        pattern = re.compile(r"^(postings|lengths|terms|docs|forward)\.(\d+)\.")
+        for name in os.listdir(self.path):
+            m = pattern.match(name)
+            if m and int(m.group(2)) not in keep:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class BM25Index:
+    """
+    Read side: memory-maps the current generation and answers BM25 queries.
+
+    search() returns [{unique_id, title, program_name, score}] best first; the
+    caller fetches the text of the few hits it keeps. maybe_reload() switches to
+    a newer generation written by main.py / backfill_embeddings.py.
+    """
+
+    def __init__(self, path, reload_seconds: float = 30):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.generation = 0
+        self._state = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def available(self):
+        return _read_manifest(self.path) is not None
+
+    def load(self):
+        """Maps the generation named in manifest.json; returns False if there is no index yet."""
+        manifest = _read_manifest(self.path)
+        if not manifest:
+            return False
+        generation = manifest["generation"]
+        join = lambda name: os.path.join(self.path, f"{name}.{generation}")
+        with open(join("terms") + ".json", encoding="utf-8") as f:
+            terms = json.load(f)
+        with open(join("docs") + ".json", encoding="utf-8") as f:
+            docs = json.load(f)
+        num_postings = manifest["num_postings"]
+        postings = (np.memmap(join("postings") + ".i32", dtype=np.int32, mode="r", shape=(num_postings, 2))
+                    if num_postings else np.zeros((0, 2), dtype=np.int32))
+        lengths = (np.memmap(join("lengths") + ".i32", dtype=np.int32, mode="r", shape=(len(docs),))
+                   if docs else np.zeros(0, dtype=np.int32))
+        state = {
+            "terms": terms,
+            "docs": docs,
+            "postings": postings,
+            "length_norm": (K1 * (1 - B + B * lengths / max(manifest["avg_length"], 1e-9))).astype(np.float32),
+            "num_docs": len(docs),
+        }
+        with self._lock:
+            self._state = state
+            self.generation = generation
+            self._last_check = time.time()
+        print(f"BM25 index: mapped generation {generation} ({len(docs)} docs, {len(terms)} terms, {num_postings} postings)")
+        return True
+
+    def maybe_reload(self):
+        now = time.time()
+        if now - self._last_check < self.reload_seconds:
+            return
+        self._last_check = now
+        manifest = _read_manifest(self.path)
+        if manifest and manifest["generation"] != self.generation:
+            self.load()
+
+    def search(self, query, k: int = 10):
+        if self._state is None and not self.load():
+            return []
+        with self._lock:
+            state = self._state
+        n = state["num_docs"]
+        if n == 0 or k <= 0:
+            return []
+        scores = np.zeros(n, dtype=np.float32)
+        matched = False
+        for term in set(tokenize(query)):
+            entry = state["terms"].get(term)
+            if entry is None:
+                continue
+            start, df = entry
+            block = state["postings"][start:start + df]
+            doc_nos, tf = block[:, 0], block[:, 1].astype(np.float32)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            scores[doc_nos] += idf * tf * (K1 + 1) / (tf + state["length_norm"][doc_nos])
+            matched = True
+        if not matched:
+            return []
+        hits = np.flatnonzero(scores)
+        k = min(k, hits.size)
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]] if k < hits.size else hits
+        top = top[np.argsort(-scores[top])]
+        return [dict(state["docs"][i], score=float(scores[i])) for i in top]
+
+    def __len__(self):
+        return self._state["num_docs"] if self._state else 0
+
+
+def update_index(path, text_field, docs=(), removed=(), collection=None):
+    """
+    Applies upserted / removed program documents to the index at `path` and commits.
+    When no index exists yet and a collection is given, it is first built from the
+    whole collection. Returns the committed generation.
+    """
+    writer = BM25IndexWriter(path, text_field)
+    if not writer.exists() and collection is not None:
+        writer.rebuild_from(collection)
+    writer.upsert(docs)
+    writer.remove(removed)
+    generation = writer.commit()
+    print(f"BM25 index: generation {generation} with {len(writer)} documents")
+    return generation
+
+
+def rebuild_index(path, text_field, collection):
+    """Re-indexes every program document in the collection and commits a new generation."""
+    writer = BM25IndexWriter(path, text_field)
+    writer.rebuild_from(collection)
+    generation = writer.commit()
+    print(f"BM25 index: rebuilt generation {generation} with {len(writer)} documents")
+    return generation
@@ -0,0 +1,175 @@
+import time
+import traceback
+
+import bson
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, InvalidDocument
+
+from vector_codec import encode_vector, is_binary_vector
+from work_queue import open_queue
+
+
+def append_failure(path, stage, error, unique_id=None, title=None, filter_q=None, update=None, extra=None):
+    """
+    Records one failed task in the retry queue at `path` (see work_queue.py), to be
+    replayed with replay_failures.py.
+
+    Every task has the same shape so failures can be grouped and retried: stage
+    ('scrape', 'embed', 'embed_chunk', 'upsert'), unique_id, title, error_class,
+    error, and a payload with the filter/update needed to replay the write plus
+    `extra`. An 'error' in extra (e.g. a bulk writeError's errmsg) replaces str(error).
+    """
+    payload = {'filter': filter_q, 'update': update}
+    payload.update(extra or {})
+    message = payload.pop('error', None) or str(error)
+    error_class = type(error).__name__ if isinstance(error, BaseException) else 'Error'
+    try:
+        open_queue(path).add(stage, message, unique_id=unique_id, title=title, payload=payload,
+                             error_class=error_class)
+    except Exception as e:
+        print(f"Could not record failure in {path}: {e}")
+
+
+def _clean_value(value):
+    if isinstance(value, dict):
+        return sanitize_document(value)
+    if isinstance(value, (list, tuple)):
+        return [_clean_value(v) for v in value]
+    return value
+
+
+def sanitize_document(doc, vector_field=None, vector_storage="array"):
+    """
+    Returns a copy of doc that BSON can store: keys starting with '$' or containing
+    '.' are dropped (at any depth), and the vector field is encoded in
+    `vector_storage` (a list of floats, or a float32 / int8 binary vector; see
+    vector_codec.py), or dropped if that is impossible.
+    """
+    safe_doc = {}
+    for k, v in doc.items():
+        if not isinstance(k, str) or k.startswith('$') or '.' in k:
+            continue
+        safe_doc[k] = _clean_value(v)
+    if vector_field and vector_field in safe_doc and not is_binary_vector(doc.get(vector_field)):
+        try:
+            safe_doc[vector_field] = encode_vector(safe_doc[vector_field], vector_storage)
+        except Exception:
+            safe_doc.pop(vector_field, None)
+    return safe_doc
+
+
+class BulkUpsertWriter:
+    """
+    Buffers UpdateOne operations and sends them with one unordered bulk_write
+    whenever `batch_size` operations are queued or, checked on add() and
+    maybe_flush(), `flush_interval` seconds have passed since the oldest queued
+    one. There is no background timer: a caller doing slow work between adds
+    (embedding, scraping) calls maybe_flush() in that loop so queued writes do
+    not wait for the next add. Call close() (or flush()) at the end.
+
+    Documents are sanitized and BSON-encoded when they are added, so one invalid
+    document is reported on its own instead of failing a whole batch. Operations
+    the server rejects are queued for retry in `failure_log` via append_failure(),
+    and their unique_ids collected in `failed_ids` so callers only index what was stored.
+    """
+
+    def __init__(self, collection, failure_log, batch_size=100, flush_interval=5.0, vector_field=None,
+                 vector_storage="array"):
+        self.collection = collection
+        self.collection_name = getattr(collection, 'name', None)   # recorded with failed writes for replay
+        self.failure_log = failure_log
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.vector_field = vector_field
+        self.vector_storage = vector_storage
+        self._ops = []
+        self._contexts = []      # per queued op: {'unique_id', 'title', 'filter', 'update'}
+        self._oldest = None
+        self.upserted = 0
+        self.modified = 0
+        self.matched = 0
+        self.failed = 0
+        self.failed_ids = set()  # unique_id of every operation that was not written
+        self.flushes = 0
+
+    def add(self, filter_q, set_doc, upsert=True, unique_id=None, title=None):
+        """Queues an {'$set': set_doc} update; returns False if the document could not be encoded."""
+        safe_doc = sanitize_document(set_doc, self.vector_field, self.vector_storage)
+        update = {'$set': safe_doc}
+        try:
+            bson.encode(update)
+            bson.encode(filter_q)
+        except (InvalidDocument, TypeError, OverflowError) as e:
+            self._failed(unique_id)
+            append_failure(self.failure_log, 'upsert', e, unique_id=unique_id, title=title, filter_q=filter_q,
+                           extra={'collection': self.collection_name, 'trace': traceback.format_exc()})
+            print(f"Skipping unencodable document for {title or unique_id}: {e}")
+            return False
+
+        self._ops.append(UpdateOne(filter_q, update, upsert=upsert))
+        self._contexts.append({'unique_id': unique_id, 'title': title, 'filter': filter_q, 'update': update,
+                               'upsert': upsert})
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if len(self._ops) >= self.batch_size:
+            self.flush()
+        else:
+            self.maybe_flush()
+        return True
+
+    def maybe_flush(self):
+        """Flushes if the oldest queued operation has waited `flush_interval` seconds; returns True if it did."""
+        if self._oldest is None or time.monotonic() - self._oldest < self.flush_interval:
+            return False
+        self.flush()
+        return True
+
+    def flush(self):
+        if not self._ops:
+            return
+        ops, contexts = self._ops, self._contexts
+        self._ops, self._contexts, self._oldest = [], [], None
+        self.flushes += 1
+        try:
+            result = self.collection.bulk_write(ops, ordered=False)
+            self._count(result.bulk_api_result)
+        except BulkWriteError as bwe:
+            details = bwe.details or {}
+            self._count(details)
+            for err in details.get('writeErrors', []):
+                ctx = contexts[err.get('index', 0)]
+                self._failed(ctx['unique_id'])
+                append_failure(self.failure_log, 'upsert', bwe, unique_id=ctx['unique_id'], title=ctx['title'],
+                               filter_q=ctx['filter'], update=ctx['update'],
+                               extra={'collection': self.collection_name, 'upsert': ctx['upsert'],
+                                      'error': err.get('errmsg'), 'code': err.get('code')})
+                print(f"Upsert failed for {ctx['title'] or ctx['unique_id']}: {err.get('errmsg')}")
+        except Exception as e:
+            # The whole batch failed (network, auth, ...): record every operation for retry
+            for ctx in contexts:
+                self._failed(ctx['unique_id'])
+                append_failure(self.failure_log, 'upsert', e, unique_id=ctx['unique_id'], title=ctx['title'],
+                               filter_q=ctx['filter'], update=ctx['update'],
+                               extra={'collection': self.collection_name, 'upsert': ctx['upsert']})
+            print(f"Bulk write of {len(ops)} operations failed: {e}")
+            return
+        print(f"Bulk write: {len(ops)} operations (upserted={self.upserted}, modified={self.modified}, failed={self.failed} so far)")
+
+    def _failed(self, unique_id):
+        self.failed += 1
+        if unique_id is not None:
+            self.failed_ids.add(unique_id)
+
+    def _count(self, result):
+        self.upserted += result.get('nUpserted', 0)
+        self.modified += result.get('nModified', 0)
+        self.matched += result.get('nMatched', 0)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+
+# Scraped fields that make up a program's content. The hash deliberately ignores
+# bookkeeping fields (website, validators, timestamps) so only real edits count.
+CONTENT_FIELDS = (
+    'title', 'program_status', 'program_deadline', 'program_overview', 'program_apply',
+    'program_requirements', 'program_contact', 'program_contact_link', 'program_events',
+)
+
+
+def content_hash(item, text_content=None):
+    """Stable sha256 over the program's scraped content (and the text that gets embedded)."""
+    payload = {name: item.get(name) for name in CONTENT_FIELDS}
+    payload['text_content'] = text_content
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def program_text(item):
+    """Text embedded and stored for a program: the overview, else its link, else the other fields joined."""
+    if item.get('program_overview'):
+        return item.get('program_overview')
+    if item.get('program_overview_link'):
+        return item.get('program_overview_link')
+    parts = []
+    for v in ['title', 'website', 'program_status', 'program_deadline', 'program_apply', 'program_requirements', 'program_contact', 'program_events']:
+        if item.get(v):
+            parts.append(str(item.get(v)))
+    return "\n\n".join(parts) if parts else ""
+
+
+def program_document(item, text_field):
+    """
+    (document, text to embed) for a scraped program item: the item plus the text
+    field, a stable unique_id (overview link, else title, else a hash of the text)
+    used as the upsert key, and its content_hash. The embedding is added by the caller.
+    """
+    text_content = program_text(item)
+    doc = item.copy()
+    doc[text_field] = text_content
+    doc['unique_id'] = (item.get('program_overview_link') or item.get('title')
+                        or hashlib.sha256(text_content.encode('utf-8')).hexdigest())
+    doc['content_hash'] = content_hash(item, text_content)
+    return doc, text_content
+
+
+def load_known_programs(collection):
+    """
+    Returns website -> {unique_id, content_hash, http_etag, http_last_modified}
+    for every stored program, used for conditional requests and change detection.
+    """
+    known = {}
+    projection = {'_id': 0, 'website': 1, 'unique_id': 1, 'content_hash': 1, 'http_etag': 1, 'http_last_modified': 1}
+    for doc in collection.find({'website': {'$exists': True}}, projection):
+        if doc.get('website'):
+            known[doc['website']] = doc
+    return known
+
+
+def validators_for(known):
+    """Conditional-request validators (ETag / Last-Modified) per website."""
+    return {
+        website: {'etag': state.get('http_etag'), 'last_modified': state.get('http_last_modified')}
+        for website, state in known.items()
+        if state.get('http_etag') or state.get('http_last_modified')
+    }
+
+
+class IngestSummary:
+    """Counts what an ingest run found: added, changed, unchanged, removed and failed programs."""
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.unchanged = []
+        self.removed = []
+        self.failed = []
+
+    def classify(self, website, new_hash, known):
+        """Records the program and returns 'added', 'changed' or 'unchanged'."""
+        previous = known.get(website)
+        if previous is None:
+            self.added.append(website)
+            return 'added'
+        if previous.get('content_hash') == new_hash:
+            self.unchanged.append(website)
+            return 'unchanged'
+        self.changed.append(website)
+        return 'changed'
+
+    def mark_failed(self, website):
+        """Moves a program that was classified but could not be stored into `failed`."""
+        for bucket in (self.added, self.changed):
+            if website in bucket:
+                bucket.remove(website)
+        self.failed.append(website)
+
+    def find_removed(self, known, current_links):
+        current = set(current_links)
+        self.removed = [website for website in known if website not in current]
+        return self.removed
+
+    def as_dict(self):
+        return {
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'added': len(self.added),
+            'changed': len(self.changed),
+            'unchanged': len(self.unchanged),
+            'removed': len(self.removed),
+            'failed': len(self.failed),
+            'added_programs': self.added,
+            'changed_programs': self.changed,
+            'removed_programs': self.removed,
+            'failed_programs': self.failed,
+        }
+
+    def report(self, path=None):
+        print(f"Ingest summary: added={len(self.added)} changed={len(self.changed)} "
+              f"unchanged={len(self.unchanged)} removed={len(self.removed)} failed={len(self.failed)}")
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.as_dict(), f, indent=2)
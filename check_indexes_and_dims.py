@@ -1,5 +1,8 @@
-from ragService import collection, gemini_client, EMBEDDING_MODEL, VECTOR_FIELD
+from ragService import collection, gemini_client, EMBEDDING_MODEL, VECTOR_FIELD, TEXT_FIELD, SEARCH_INDEX_NAME, VECTOR_INDEX_NAME, VECTOR_STORAGE
+from hybrid_search import ensure_search_index
+from vector_codec import decode_vector, describe_vector, ensure_vector_index
 import certifi
+import sys
 
 print('Collection:', collection.full_name)
 
@@ -12,6 +15,30 @@ try:
 except Exception as e:
     print('Error listing indexes:', e)
 
+# List Atlas Search / Vector Search indexes (used by $search and $vectorSearch)
+try:
+    search_idxs = list(collection.list_search_indexes())
+    print('\nSearch indexes found:')
+    for i in search_idxs:
+        print('-', i.get('name'), 'type->', i.get('type'), 'status->', i.get('status'))
+        for field in (i.get('latestDefinition') or {}).get('fields', []):
+            if field.get('type') == 'vector':
+                print('    vector field', field.get('path'), 'numDimensions->', field.get('numDimensions'),
+                      'similarity->', field.get('similarity'), 'quantization->', field.get('quantization', 'none'))
+    if SEARCH_INDEX_NAME not in {i.get('name') for i in search_idxs}:
+        print(f"Keyword index '{SEARCH_INDEX_NAME}' (HYBRID_RETRIEVAL) is missing; rerun with --create-search-index to create it")
+except Exception as e:
+    print('Error listing search indexes:', e)
+
+if '--create-search-index' in sys.argv:
+    try:
+        if ensure_search_index(collection, SEARCH_INDEX_NAME, TEXT_FIELD):
+            print(f"Created Atlas Search index '{SEARCH_INDEX_NAME}' (it becomes queryable once Atlas finishes building it)")
+        else:
+            print(f"Atlas Search index '{SEARCH_INDEX_NAME}' already exists")
+    except Exception as e:
+        print('Error creating search index:', e)
+
 # Count docs with VECTOR_FIELD
 try:
     have_vec = collection.count_documents({VECTOR_FIELD: {'$exists': True}})
@@ -19,23 +46,39 @@ try:
 except Exception as e:
     print('Error counting vector-field docs:', e)
 
-# Sample vector length
+# Sample vector length (array of doubles or float32 / int8 binary vector, see vector_codec.py)
+sample_dims = None
 try:
     doc = collection.find_one({VECTOR_FIELD: {'$exists': True}})
     if doc:
         vec = doc.get(VECTOR_FIELD)
+        kind, sample_dims = describe_vector(vec)
         print('\nSample doc _id:', doc.get('_id'))
-        print('Type of vector in sample doc:', type(vec))
-        if isinstance(vec, list):
-            print('Sample vector length:', len(vec))
-            print('First 5 values:', vec[:5])
+        print(f'Type of vector in sample doc: {kind} (VECTOR_STORAGE={VECTOR_STORAGE})')
+        arr = decode_vector(vec)
+        if arr is not None:
+            print('Sample vector length:', sample_dims)
+            print('First 5 values:', arr[:5].tolist())
         else:
-            print('Vector is not a list; repr (truncated):', repr(vec)[:200])
+            print('Vector is not a list or binary vector; repr (truncated):', repr(vec)[:200])
     else:
         print('\nNo document with vector field found')
 except Exception as e:
     print('Error sampling vector:', e)
 
+# --create-vector-index [--quantization scalar|binary]: builds VECTOR_INDEX_NAME for the stored vectors
+if '--create-vector-index' in sys.argv:
+    quantization = sys.argv[sys.argv.index('--quantization') + 1] if '--quantization' in sys.argv else None
+    try:
+        if not sample_dims:
+            print('Cannot create the vector index: no stored vector to take the dimension from')
+        elif ensure_vector_index(collection, VECTOR_INDEX_NAME, VECTOR_FIELD, sample_dims, quantization=quantization):
+            print(f"Created vector index '{VECTOR_INDEX_NAME}' ({sample_dims} dims, cosine, quantization={quantization or 'none'})")
+        else:
+            print(f"Vector index '{VECTOR_INDEX_NAME}' already exists (drop it in Atlas to change its definition)")
+    except Exception as e:
+        print('Error creating vector index:', e)
+
 # Request a test embedding to compare lengths
 try:
     test_text = 'This is a short test sentence to measure embedding length.'
@@ -0,0 +1,215 @@
+import re
+from datetime import datetime, timezone
+
+# Splits program pages into passages for retrieval. Every scraped section (overview,
+# requirements, ...) is chunked on its own: paragraphs are packed up to a token
+# budget, oversized paragraphs are split by sentence (then by word), and each chunk
+# repeats the tail of the previous one so a fact cut at a boundary is still found.
+# Chunks are stored in their own collection with a `parent_id` pointing at the
+# program's unique_id; retrieval groups them back by program (group_chunks_by_program).
+
+CHUNK_MAX_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 40
+
+# (field, label) in the order sections appear on a program page
+SECTION_FIELDS = (
+    ('program_overview', 'Overview'),
+    ('program_status', 'Status'),
+    ('program_deadline', 'Deadline'),
+    ('program_requirements', 'Requirements'),
+    ('program_apply', 'How to apply'),
+    ('program_events', 'Events'),
+    ('program_contact', 'Contact'),
+)
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def approx_tokens(text):
+    """Rough token count (~4 characters per token for English text); no tokenizer needed."""
+    return (len(text) + 3) // 4
+
+
+def _split_words(text, max_tokens):
+    words, parts, current = text.split(), [], []
+    for word in words:
+        if current and approx_tokens(' '.join(current + [word])) > max_tokens:
+            parts.append(' '.join(current))
+            current = []
+        current.append(word)
+    if current:
+        parts.append(' '.join(current))
+    return parts
+
+
+def _units(text, max_tokens):
+    """Paragraphs no larger than max_tokens (long ones split by sentence, then by word)."""
+    units = []
+    for paragraph in (line.strip() for line in text.splitlines()):
+        if not paragraph:
+            continue
+        if approx_tokens(paragraph) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            if approx_tokens(sentence) <= max_tokens:
+                units.append(sentence)
+            else:
+                units.extend(_split_words(sentence, max_tokens))
+    return units
+
+
+def _tail(text, overlap_tokens):
+    """The last words of text, about overlap_tokens long."""
+    if overlap_tokens <= 0:
+        return ''
+    words, tail = text.split(), []
+    while words and approx_tokens(' '.join([words[-1]] + tail)) <= overlap_tokens:
+        tail.insert(0, words.pop())
+    return ' '.join(tail)
+
+
+def split_text(text, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Splits text into chunks of at most ~max_tokens.
+
+    Returns a list of (chunk_text, overlap_chars): chunk_text starts with the tail of
+    the previous chunk and overlap_chars is the length of that repeated prefix
+    (including its separator), so adjacent chunks can be stitched back together.
+    """
+    # Leave room for the overlap so a chunk never exceeds the budget
+    unit_budget = max(1, max_tokens - overlap_tokens - 1)
+    chunks, current, overlap = [], [], ''
+    for unit in _units(text or '', unit_budget):
+        candidate = '\n'.join(([overlap] if overlap else []) + current + [unit])
+        if current and approx_tokens(candidate) > max_tokens:
+            chunk_text = '\n'.join(([overlap] if overlap else []) + current)
+            chunks.append((chunk_text, len(overlap) + 1 if overlap else 0))
+            overlap = _tail('\n'.join(current), overlap_tokens)
+            current = []
+        current.append(unit)
+    if current:
+        chunk_text = '\n'.join(([overlap] if overlap else []) + current)
+        chunks.append((chunk_text, len(overlap) + 1 if overlap else 0))
+    return chunks
+
+
+def chunk_program(doc, text_field, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Builds the chunk documents for one program document (as written by main.py).
+
+    Each chunk carries chunk_id, parent_id (the program's unique_id), chunk_index,
+    section, overlap_chars, title, program_name, website and its text in text_field.
+    """
+    sections = [(label, doc.get(field)) for field, label in SECTION_FIELDS if doc.get(field)]
+    if not sections and doc.get(text_field):
+        sections = [('Overview', doc.get(text_field))]
+
+    parent_id = doc.get('unique_id')
+    chunks = []
+    for label, text in sections:
+        for chunk_text, overlap_chars in split_text(str(text), max_tokens, overlap_tokens):
+            chunks.append({
+                'chunk_id': f"{parent_id}#{len(chunks)}",
+                'parent_id': parent_id,
+                'chunk_index': len(chunks),
+                'section': label,
+                'overlap_chars': overlap_chars,
+                'title': doc.get('title'),
+                'program_name': doc.get('program_name'),
+                'website': doc.get('website'),
+                text_field: chunk_text,
+            })
+    return chunks
+
+
+def embedding_text(chunk, text_field):
+    """What gets embedded: the chunk prefixed with its program title and section."""
+    return f"{chunk.get('title') or ''} - {chunk.get('section')}\n{chunk.get(text_field)}"
+
+
+def group_chunks_by_program(chunks, k, text_key='text_chunk'):
+    """
+    Groups retrieved chunks (best first) into at most k program results shaped
+    like the program-level search output (text_chunk, title, program_name,
+    unique_id, updated_at, score). Each program's chunks are put back in page
+    order; the overlap repeated by adjacent chunks is dropped.
+    """
+    programs = {}
+    for chunk in chunks:
+        parent_id = chunk.get('parent_id')
+        if parent_id not in programs:
+            if len(programs) >= k:
+                continue
+            programs[parent_id] = {
+                'title': chunk.get('title'),
+                'program_name': chunk.get('program_name'),
+                'unique_id': parent_id,
+                'updated_at': chunk.get('updated_at'),
+                'score': chunk.get('score'),
+                'chunks': [],
+            }
+        program = programs[parent_id]
+        program['chunks'].append(chunk)
+        if chunk.get('updated_at') is not None and (program['updated_at'] is None or chunk['updated_at'] > program['updated_at']):
+            program['updated_at'] = chunk['updated_at']
+
+    results = []
+    for program in programs.values():
+        parts, previous = [], None
+        for chunk in sorted(program.pop('chunks'), key=lambda c: c.get('chunk_index') or 0):
+            text = chunk.get(text_key) or ''
+            same_section = previous is not None and previous.get('section') == chunk.get('section')
+            if same_section and previous.get('chunk_index') == (chunk.get('chunk_index') or 0) - 1:
+                parts[-1] += '\n' + text[chunk.get('overlap_chars') or 0:]
+            elif same_section:
+                parts[-1] += '\n...\n' + text
+            else:
+                parts.append(f"{chunk.get('section')}:\n{text}")
+            previous = chunk
+        program['text_chunk'] = '\n\n'.join(parts)
+        results.append(program)
+    return results
+
+
+def store_program_chunks(docs, embedder, chunk_collection, failure_log, text_field, vector_field,
+                         max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, vector_storage="array"):
+    """
+    Chunks, embeds (one batched pass through `embedder`) and upserts the chunks of
+    the given program documents, then removes chunks left over from a longer
+    previous version. Returns (chunks_written, chunks_failed).
+    """
+    from pymongo import DeleteMany
+    from bulk_writer import BulkUpsertWriter, append_failure
+
+    chunks = [chunk for doc in docs if doc.get('unique_id') for chunk in chunk_program(doc, text_field, max_tokens, overlap_tokens)]
+    if not chunks:
+        return 0, 0
+    vectors = embedder.embed_texts([embedding_text(chunk, text_field) for chunk in chunks])
+
+    failed_parents = set()
+    writer = BulkUpsertWriter(chunk_collection, failure_log, vector_field=vector_field, vector_storage=vector_storage)
+    for n, chunk in enumerate(chunks):
+        if vectors[n] is None:
+            failed_parents.add(chunk['parent_id'])
+            append_failure(failure_log, 'embed_chunk', RuntimeError(embedder.errors.get(n) or 'no embedding returned'),
+                           unique_id=chunk['chunk_id'], title=chunk.get('title'), extra={'parent_id': chunk['parent_id']})
+            continue
+        chunk[vector_field] = vectors[n]
+        chunk['updated_at'] = datetime.now(timezone.utc)
+        writer.add({'chunk_id': chunk['chunk_id']}, chunk, unique_id=chunk['chunk_id'], title=chunk.get('title'))
+    writer.close()
+
+    counts = {}
+    for chunk in chunks:
+        counts[chunk['parent_id']] = counts.get(chunk['parent_id'], 0) + 1
+    stale = [DeleteMany({'parent_id': parent_id, 'chunk_index': {'$gte': count}})
+             for parent_id, count in counts.items() if parent_id not in failed_parents]
+    if stale:
+        try:
+            chunk_collection.bulk_write(stale, ordered=False)
+        except Exception as e:
+            print(f"Could not remove stale chunks: {e}")
+
+    failed = sum(1 for v in vectors if v is None) + writer.failed
+    return len(chunks) - failed, failed
@@ -0,0 +1,147 @@
+import re
+import threading
+from collections import namedtuple
+
+from chunking import approx_tokens
+
+
+def format_document(result, content):
+    """One retrieved document in the DOCUMENT START/END block the RAG prompt expects."""
+    return (
+        f"--- DOCUMENT START ---\n"
+        f"Program Name: {result.get('program_name', 'N/A')}\n"
+        f"Title: {result.get('title', 'N/A')}\n"
+        f"Content: {content}\n"
+        f"--- DOCUMENT END ---"
+    )
+
+
+_WORD = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"[.!?](?=\s)")
+
+# Below this many tokens of remaining budget, a passage is dropped instead of truncated
+MIN_TRUNCATED_TOKENS = 48
+
+
+def _shingles(paragraph, size):
+    """Hashed word n-grams of a paragraph (empty when it is shorter than one shingle)."""
+    words = _WORD.findall(paragraph.lower())
+    return {hash(tuple(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+def _truncate(text, max_tokens):
+    """Cuts text to ~max_tokens at the last sentence (or word) boundary that fits."""
+    limit = max_tokens * 4
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    ends = [m.end() for m in _SENTENCE_END.finditer(head)]
+    if ends and ends[-1] > limit // 2:
+        head = head[:ends[-1]]
+    else:
+        head = head.rsplit(None, 1)[0] if ' ' in head else head
+    return head.rstrip() + " [...]"
+
+
+# Result of ContextBuilder.build(): the prompt context, the documents in it and per-request stats
+BuiltContext = namedtuple('BuiltContext', ['context', 'sources', 'stats'])
+
+
+class ContextBuilder:
+    """
+    Assembles the prompt context from retrieved passages under a token budget.
+
+    Passages are taken best score first. Each paragraph is shingled (word
+    n-grams, hashed) and dropped when at least `dedup_threshold` of its shingles
+    were already emitted, so repeated programs and copy-pasted boilerplate are
+    paid for once; passages from the same unique_id are merged into one block.
+    The block that crosses `max_tokens` is truncated at a sentence boundary and
+    the rest are left out. build() reports the tokens saved against naively
+    concatenating every passage; cumulative totals are available from stats().
+    """
+
+    def __init__(self, max_tokens: int = 2000, dedup_threshold: float = 0.8, shingle_size: int = 5):
+        self.max_tokens = max_tokens
+        self.dedup_threshold = dedup_threshold
+        self.shingle_size = shingle_size
+        self._lock = threading.Lock()
+        self._totals = {'requests': 0, 'tokens_raw': 0, 'tokens_used': 0, 'tokens_saved': 0,
+                        'paragraphs_deduplicated': 0, 'passages_truncated': 0, 'passages_dropped': 0}
+
+    def build(self, passages):
+        """
+        `passages` is a list of (result, text) pairs as retrieved (result carries
+        title, program_name, unique_id, score, ...). Returns a BuiltContext.
+        """
+        passages = [(result, text) for result, text in passages if text]
+        tokens_raw = sum(approx_tokens(format_document(result, text)) for result, text in passages)
+        # Stable sort: results without a score (text fallback) keep their order
+        ranked = sorted(passages, key=lambda p: -(p[0].get('score') or 0.0))
+
+        seen = set()
+        blocks = []        # [result, [paragraphs]]
+        by_uid = {}
+        deduplicated = 0
+        for result, text in ranked:
+            kept = []
+            for paragraph in (line.strip() for line in str(text).splitlines()):
+                if not paragraph:
+                    continue
+                shingles = _shingles(paragraph, self.shingle_size)
+                if shingles and len(shingles & seen) >= self.dedup_threshold * len(shingles):
+                    deduplicated += 1
+                    continue
+                seen |= shingles
+                kept.append(paragraph)
+            if not kept:
+                continue
+            uid = result.get('unique_id')
+            if uid and uid in by_uid:
+                by_uid[uid][1].extend(kept)
+            else:
+                block = [result, kept]
+                blocks.append(block)
+                if uid:
+                    by_uid[uid] = block
+
+        chunks, sources = [], []
+        used = truncated = dropped = 0
+        for result, paragraphs in blocks:
+            formatted = format_document(result, "\n".join(paragraphs))
+            cost = approx_tokens(formatted)
+            remaining = self.max_tokens - used
+            if cost > remaining:
+                overhead = approx_tokens(format_document(result, ""))
+                if remaining - overhead < MIN_TRUNCATED_TOKENS:
+                    dropped += 1
+                    continue
+                formatted = format_document(result, _truncate("\n".join(paragraphs), remaining - overhead))
+                cost = approx_tokens(formatted)
+                truncated += 1
+            chunks.append(formatted)
+            sources.append(result)
+            used += cost
+
+        stats = {
+            'passages': len(passages),
+            'documents': len(chunks),
+            'tokens_raw': tokens_raw,
+            'tokens_used': used,
+            'tokens_saved': max(0, tokens_raw - used),
+            'paragraphs_deduplicated': deduplicated,
+            'passages_truncated': truncated,
+            'passages_dropped': dropped,
+        }
+        with self._lock:
+            self._totals['requests'] += 1
+            for key in ('tokens_raw', 'tokens_used', 'tokens_saved', 'paragraphs_deduplicated',
+                        'passages_truncated', 'passages_dropped'):
+                self._totals[key] += stats[key]
+        return BuiltContext("\n\n".join(chunks), sources, stats)
+
+    def stats(self):
+        with self._lock:
+            totals = dict(self._totals)
+        totals['max_tokens'] = self.max_tokens
+        totals['saved_ratio'] = round(totals['tokens_saved'] / totals['tokens_raw'], 4) if totals['tokens_raw'] else 0.0
+        return totals
@@ -0,0 +1,35 @@
+import sys
+from datetime import datetime, timezone
+
+from ragService import collection, chunk_collection, VECTOR_FIELD, VECTOR_STORAGE
+from bulk_writer import BulkUpsertWriter
+from vector_codec import decode_vector, describe_vector
+from work_queue import WORK_QUEUE_PATH
+
+# Rewrites stored embeddings in the VECTOR_STORAGE format (see vector_codec.py), e.g.
+# after switching from BSON arrays to float32 / int8 binary vectors. Pass --chunks to
+# convert the chunk collection as well. Converting int8 back to floats keeps the
+# quantization error; re-embed (backfill_embeddings.py) if full precision is needed.
+# The Atlas vector index picks up the new format by itself (see check_indexes_and_dims.py).
+
+targets = [('programs', collection)]
+if '--chunks' in sys.argv:
+    targets.append(('chunks', chunk_collection))
+
+for label, coll in targets:
+    writer = BulkUpsertWriter(coll, WORK_QUEUE_PATH, vector_field=VECTOR_FIELD, vector_storage=VECTOR_STORAGE)
+    skipped = 0
+    for doc in coll.find({VECTOR_FIELD: {'$exists': True}}, {VECTOR_FIELD: 1}):
+        value = doc.get(VECTOR_FIELD)
+        kind, _ = describe_vector(value)
+        vec = decode_vector(value)
+        if kind == VECTOR_STORAGE or vec is None:
+            skipped += 1
+            continue
+        # BulkUpsertWriter encodes the decoded values in VECTOR_STORAGE; updated_at lets the
+        # local vector index's incremental poll (and the answer cache) see the re-encoded vector
+        writer.add({'_id': doc['_id']}, {VECTOR_FIELD: vec.astype(float).tolist(), 'updated_at': datetime.now(timezone.utc)},
+                   upsert=False, unique_id=str(doc['_id']))
+    writer.close()
+    print(f"{label}: converted {writer.modified} vector(s) to {VECTOR_STORAGE}, "
+          f"{skipped} already in that format or unreadable, {writer.failed} failed")
@@ -0,0 +1,149 @@
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Case-folds, drops punctuation and collapses whitespace so trivial variants share a key."""
+    text = _PUNCTUATION.sub(" ", (text or "").casefold())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class EmbeddingCache:
+    """
+    Bounded in-process LRU + TTL cache for query embeddings, with an optional
+    SQLite second level so hits survive restarts and are shared across workers.
+
+    Keys are (model, task_type, normalized query). Safe to use from worker threads.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 24 * 3600, path: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self._entries = OrderedDict()   # key -> (stored_at, vector)
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        if path:
+            self._open_shared(path)
+
+    # ------------------------------------------------------------------
+    # Shared (SQLite) backend
+    # ------------------------------------------------------------------
+
+    def _open_shared(self, path):
+        try:
+            self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            # WAL lets several uvicorn workers read while one writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                " key TEXT PRIMARY KEY, vector BLOB NOT NULL, stored_at REAL NOT NULL)"
+            )
+        except sqlite3.Error as e:
+            print(f"Embedding cache: could not open shared cache at {path}: {e}; using memory only")
+            self._db = None
+
+    def _shared_get(self, key, now):
+        try:
+            row = self._db.execute(
+                "SELECT vector, stored_at FROM query_embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or now - row[1] > self.ttl_seconds:
+            return None
+        return row[1], array('d', row[0]).tolist()
+
+    def _shared_put(self, key, vector, now):
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, vector, stored_at) VALUES (?, ?, ?)",
+                (key, array('d', vector).tobytes(), now),
+            )
+            # Opportunistically drop expired rows so the file does not grow without bound
+            if self.misses % 256 == 0:
+                self._db.execute("DELETE FROM query_embeddings WHERE stored_at < ?", (now - self.ttl_seconds,))
+        except sqlite3.Error as e:
+            print(f"Embedding cache: shared write failed: {e}")
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def make_key(text, model=None, task_type=None):
+        return f"{model or ''}|{task_type or ''}|{normalize_query(text)}"
+
+    def get(self, text, model=None, task_type=None):
+        """Returns the cached vector (list of floats) or None on a miss."""
+        key = self.make_key(text, model, task_type)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+            if self._db is not None:
+                shared = self._shared_get(key, now)
+                if shared is not None:
+                    self._remember(key, shared[0], shared[1])
+                    self.hits += 1
+                    self.shared_hits += 1
+                    return shared[1]
+
+            self.misses += 1
+            return None
+
+    def put(self, text, vector, model=None, task_type=None):
+        if vector is None:
+            return
+        key = self.make_key(text, model, task_type)
+        now = time.time()
+        vector = [float(x) for x in vector]
+        with self._lock:
+            self._remember(key, now, vector)
+            if self._db is not None:
+                self._shared_put(key, vector, now)
+
+    def _remember(self, key, stored_at, vector):
+        self._entries[key] = (stored_at, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM query_embeddings")
+                except sqlite3.Error:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "shared_backend": self.path if self._db is not None else None,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
@@ -0,0 +1,233 @@
+# Retrieval evaluation: recall@k, MRR and latency for a labeled question set across
+# retrieval settings, so k / numCandidates / chunk size / backend are chosen on data.
+#
+# Usage: python evaluate_retrieval.py --labels labeled.jsonl [--k 1,3,4,5,10]
+#                                     [--num-candidates 50,100,200] [--backends atlas,local]
+#                                     [--units program,chunk] [--chunk-sizes 128,256,512]
+#                                     [--repeat 3] [--output eval.json]
+#        python evaluate_retrieval.py --offline   # synthetic corpus + fake embedder (see benchmark_rag.py)
+#
+# labeled.jsonl: one {"question": "...", "unique_ids": ["<expected program unique_id>", ...]} per line.
+#
+# Settings swept:
+#   atlas + program  -> $vectorSearch on VECTOR_INDEX_NAME for every --num-candidates value
+#   atlas + chunk    -> the stored chunk collection (CHUNK_VECTOR_INDEX_NAME), chunked at ingest time
+#   local + program  -> exact NumPy search (numCandidates does not apply)
+#   local + chunk    -> the programs re-chunked in memory at every --chunk-sizes value and embedded
+#                       once (vectors cached in --embedding-cache), searched exactly
+# Only the search is timed; query embeddings are computed (and cached) up front.
+import argparse
+import json
+import time
+
+import numpy as np
+
+import chunking
+import ragService
+from ragService import clients, EMBEDDING_MODEL, QUERY_TASK_TYPE, TEXT_FIELD, VECTOR_FIELD
+from batch_embedder import BatchEmbedder
+from embedding_cache import EmbeddingCache
+
+DOCUMENT_PROJECTION = {
+    "_id": 0, "unique_id": 1, "title": 1, "program_name": 1, "website": 1, "updated_at": 1, TEXT_FIELD: 1,
+    **{field: 1 for field, _ in chunking.SECTION_FIELDS},
+}
+
+
+def load_labels(path):
+    labels = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                labels.append((entry["question"], [str(uid) for uid in entry["unique_ids"]]))
+    return labels
+
+
+def score(ranked_ids, expected):
+    """(recall, reciprocal rank, hit) of one ranked result list against the expected unique_ids."""
+    expected = set(expected)
+    found = [uid for uid in ranked_ids if uid in expected]
+    first = next((rank for rank, uid in enumerate(ranked_ids, 1) if uid in expected), None)
+    return len(set(found)) / len(expected), (1.0 / first if first else 0.0), float(bool(found))
+
+
+# --------------------------------------------------------------------------
+# Embedding
+# --------------------------------------------------------------------------
+
+class CachedEmbedder:
+    """Embeds texts through BatchEmbedder, reusing vectors stored in an EmbeddingCache."""
+
+    def __init__(self, task_type=None, cache=None):
+        self.task_type = task_type
+        self.cache = cache or EmbeddingCache(max_entries=1 << 20)
+
+    def embed_texts(self, texts):
+        vectors = [self.cache.get(text, EMBEDDING_MODEL, self.task_type) for text in texts]
+        missing = [n for n, vec in enumerate(vectors) if vec is None]
+        if missing:
+            embedder = BatchEmbedder(clients.gemini_client, EMBEDDING_MODEL, task_type=self.task_type)
+            fresh = embedder.embed_texts([texts[n] for n in missing])
+            for n, vec in zip(missing, fresh):
+                if vec is not None:
+                    self.cache.put(texts[n], vec, EMBEDDING_MODEL, self.task_type)
+                vectors[n] = vec
+            print(f"Embedded {len(missing)} text(s) in {embedder.requests} request(s)")
+        return vectors
+
+
+class FakeEmbedder:
+    def embed_texts(self, texts):
+        from benchmark_rag import fake_embedding
+        return [fake_embedding(text) for text in texts]
+
+
+# --------------------------------------------------------------------------
+# Settings
+# --------------------------------------------------------------------------
+
+def _settings(args):
+    settings = []
+    for backend in args.backends:
+        for unit in args.units:
+            if backend == "atlas":
+                for num_candidates in args.num_candidates:
+                    settings.append({"backend": backend, "unit": unit, "chunk_tokens": "stored" if unit == "chunk" else None,
+                                     "num_candidates": num_candidates})
+            elif unit == "chunk":
+                for size in args.chunk_sizes:
+                    settings.append({"backend": backend, "unit": unit, "chunk_tokens": size, "num_candidates": None})
+            else:
+                settings.append({"backend": backend, "unit": unit, "chunk_tokens": None, "num_candidates": None})
+    return settings
+
+
+def _local_chunk_index(docs, size, overlap, embedder):
+    """LocalVectorIndex over the programs chunked at `size` tokens (kept in memory, not stored)."""
+    from benchmark_rag import InMemoryCollection
+    from local_vector_index import LocalVectorIndex
+
+    chunks = [chunk for doc in docs if doc.get("unique_id")
+              for chunk in chunking.chunk_program(doc, TEXT_FIELD, size, min(overlap, size // 4))]
+    vectors = embedder.embed_texts([chunking.embedding_text(chunk, TEXT_FIELD) for chunk in chunks])
+    stored = []
+    for chunk, vec in zip(chunks, vectors):
+        if vec is not None:
+            stored.append(dict(chunk, _id=chunk["chunk_id"], updated_at=docs[0].get("updated_at"), **{VECTOR_FIELD: vec}))
+    index = LocalVectorIndex(InMemoryCollection(stored, {"search": 0.0}), VECTOR_FIELD, TEXT_FIELD,
+                             refresh_seconds=float("inf"), meta_fields=ragService.CHUNK_META_FIELDS)
+    index.load()
+    return index, len(stored)
+
+
+def configure(setting, chunk_indexes):
+    """Points ragService's retrieval globals at one setting."""
+    ragService.RETRIEVER_BACKEND = setting["backend"]
+    ragService.RETRIEVAL_UNIT = setting["unit"]
+    if setting["num_candidates"]:
+        ragService.VECTOR_NUM_CANDIDATES = setting["num_candidates"]
+    ragService._local_vector_index = chunk_indexes.get(setting["chunk_tokens"]) if setting["backend"] == "local" else None
+
+
+def evaluate(setting, k, labels, query_vectors, repeat):
+    recalls, reciprocal_ranks, hits, latencies = [], [], [], []
+    for (question, expected), vector in zip(labels, query_vectors):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results = ragService._vector_search(vector, k)
+            latencies.append(time.perf_counter() - started)
+        recall, rr, hit = score([str(r.get("unique_id")) for r in results], expected)
+        recalls.append(recall)
+        reciprocal_ranks.append(rr)
+        hits.append(hit)
+    return dict(
+        setting, k=k,
+        recall=round(float(np.mean(recalls)), 4),
+        mrr=round(float(np.mean(reciprocal_ranks)), 4),
+        hit_rate=round(float(np.mean(hits)), 4),
+        p50_ms=round(float(np.percentile(latencies, 50)) * 1000, 2),
+        p95_ms=round(float(np.percentile(latencies, 95)) * 1000, 2),
+    )
+
+
+def print_result(r):
+    chunk = "-" if r["chunk_tokens"] is None else r["chunk_tokens"]
+    candidates = "exact" if r["num_candidates"] is None else r["num_candidates"]
+    print(f"{r['backend']:<6} {r['unit']:<8} {str(chunk):<7} {str(candidates):<6} {r['k']:<3} "
+          f"{r['recall']:7.3f} {r['mrr']:6.3f} {r['hit_rate']:6.3f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f}")
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep retrieval settings and report recall@k, MRR and latency")
+    parser.add_argument("--labels", help="JSONL of {question, unique_ids}")
+    parser.add_argument("--k", type=_int_list, default=[1, 3, 4, 5, 10])
+    parser.add_argument("--num-candidates", type=_int_list, default=[50, 100, 200], help="Atlas numCandidates values")
+    parser.add_argument("--backends", type=lambda v: v.split(","), default=["atlas", "local"])
+    parser.add_argument("--units", type=lambda v: v.split(","), default=["program"], help="program and/or chunk")
+    parser.add_argument("--chunk-sizes", type=_int_list, default=[ragService.CHUNK_MAX_TOKENS],
+                        help="Chunk token budgets for local + chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=ragService.CHUNK_OVERLAP_TOKENS)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed searches per question and setting")
+    parser.add_argument("--embedding-cache", default="eval_embeddings.sqlite",
+                        help="SQLite file caching query/chunk vectors between runs")
+    parser.add_argument("--offline", action="store_true",
+                        help="Synthetic corpus and fake embedder from benchmark_rag.py (no Atlas / Gemini)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.offline:
+        import benchmark_rag
+        benchmark_rag.install_backends(benchmark_rag.build_corpus(len(benchmark_rag.SEED_PROGRAMS)), {
+            "embed": 0.0, "search": 0.0, "generate": 0.0}, "atlas")
+        args.labels = args.labels or "fixtures/rag/labeled_queries_offline.jsonl"
+        query_embedder = document_embedder = FakeEmbedder()
+        print("Offline mode: the stubbed $vectorSearch is exact, so numCandidates does not change its results")
+    else:
+        cache = EmbeddingCache(max_entries=1 << 20, ttl_seconds=30 * 24 * 3600, path=args.embedding_cache)
+        query_embedder = CachedEmbedder(QUERY_TASK_TYPE, cache)
+        document_embedder = CachedEmbedder(None, cache)   # main.py embeds documents without a task type
+    if not args.labels:
+        parser.error("--labels is required (or use --offline)")
+
+    labels = load_labels(args.labels)
+    query_vectors = query_embedder.embed_texts([question for question, _ in labels])
+    keep = [n for n, vec in enumerate(query_vectors) if vec is not None]
+    if len(keep) < len(labels):
+        print(f"Skipping {len(labels) - len(keep)} question(s) that could not be embedded")
+    labels, query_vectors = [labels[n] for n in keep], [query_vectors[n] for n in keep]
+
+    settings = _settings(args)
+    chunk_indexes = {}
+    if any(s["backend"] == "local" for s in settings):
+        docs = list(clients.collection.find({"unique_id": {"$exists": True}}, DOCUMENT_PROJECTION))
+        for size in sorted({s["chunk_tokens"] for s in settings if s["backend"] == "local" and s["unit"] == "chunk"}):
+            chunk_indexes[size], count = _local_chunk_index(docs, size, args.chunk_overlap, document_embedder)
+            print(f"Chunk size {size}: {count} chunks from {len(docs)} programs")
+
+    print(f"{len(labels)} labeled questions, {len(settings)} setting(s) x k={args.k}")
+    print(f"{'backend':<6} {'unit':<8} {'chunk':<7} {'cands':<6} {'k':<3} {'recall':>7} {'MRR':>6} {'hit':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    results = []
+    for setting in settings:
+        configure(setting, chunk_indexes)
+        for k in args.k:
+            try:
+                result = evaluate(setting, k, labels, query_vectors, args.repeat)
+            except Exception as e:
+                print(f"{setting['backend']} {setting['unit']} {setting['chunk_tokens']} {setting['num_candidates']}: failed ({e})")
+                break
+            print_result(result)
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"labels": args.labels, "questions": len(labels), "results": results}, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import asyncio
+import re
+import urllib.parse
+
+import httpx
+from selectolax.lexbor import LexborHTMLParser
+
+from scraping import FIELD_SELECTORS
+
+# Lightweight scrape engine: pooled keep-alive HTTP requests + a fast HTML parser,
+# producing the same field dict as scraping.scrape_current_page. Pages that only
+# render with JavaScript (no title/overview in the server HTML) are handed to the
+# Selenium pool in parallel_scraper.
+
+LISTING_URL = "https://www.rd.usda.gov/programs-services/all-programs?page="
+LAST_PAGE_SELECTOR = "li.usa-pagination__item:nth-child(5) > a:nth-child(1)"
+PROGRAM_LINK_SELECTOR = "div.view-content:nth-child(3) .views-row a"
+
+# Fields without which a page is assumed to need a real browser
+REQUIRED_FIELDS = ('title', 'program_overview')
+
+# Placed in the items list for pages that answered 304 to a conditional request
+NOT_MODIFIED = object()
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) hackMidwest-usda-scraper",
+    "Accept": "text/html,application/xhtml+xml",
+}
+
+
+# Elements that start a new line in rendered text (inline elements such as <a> do not)
+_BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'footer', 'form',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre',
+    'section', 'table', 'td', 'th', 'tr', 'ul',
+}
+_INLINE_WHITESPACE = re.compile(r"[ \t\r\f\v\u00a0]+")
+
+
+def _node_text(node):
+    """Approximates Selenium's element.text: block elements start new lines, blank lines dropped."""
+    parts = []
+    for child in node.traverse(include_text=True):
+        if child.tag == '-text':
+            # Newlines inside source text are just wrapping; the browser renders them as spaces
+            parts.append((child.text_content or '').replace('\n', ' '))
+        elif child.tag in _BLOCK_TAGS:
+            parts.append('\n')
+    text = _INLINE_WHITESPACE.sub(' ', ''.join(parts))
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def parse_program_page(html, link):
+    """Extracts the scrape_current_page field contract from a program page's HTML."""
+    tree = LexborHTMLParser(html)
+    fields = {}
+    for name, (selector, attribute) in FIELD_SELECTORS.items():
+        try:
+            node = tree.css_first(selector)
+            if node is None:
+                fields[name] = None
+            elif attribute:
+                value = node.attributes.get(attribute)
+                # Selenium returns absolute URLs for href; match that
+                fields[name] = urllib.parse.urljoin(link, value) if (value and attribute == 'href') else value
+            else:
+                fields[name] = _node_text(node)
+        except Exception:
+            fields[name] = None
+        if name == 'title':
+            fields['website'] = link
+    return fields
+
+
+def needs_browser(fields):
+    return any(not fields.get(name) for name in REQUIRED_FIELDS)
+
+
+def make_client(concurrency=16, timeout=20.0):
+    """AsyncClient with a keep-alive pool sized to the scrape concurrency."""
+    return httpx.AsyncClient(
+        headers=DEFAULT_HEADERS,
+        follow_redirects=True,
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+    )
+
+
+def conditional_headers(validator):
+    """If-None-Match / If-Modified-Since headers from a stored {'etag', 'last_modified'} validator."""
+    headers = {}
+    if validator:
+        if validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        if validator.get('last_modified'):
+            headers['If-Modified-Since'] = validator['last_modified']
+    return headers
+
+
+async def fetch(client, url, retries=2, headers=None):
+    """GET with simple retries on network errors / 5xx; returns the httpx.Response."""
+    last_error = None
+    for attempt in range(1 + retries):
+        try:
+            response = await client.get(url, headers=headers)
+            if response.status_code < 500:
+                return response
+            last_error = f"HTTP {response.status_code}"
+        except httpx.HTTPError as e:
+            last_error = str(e) or type(e).__name__
+        await asyncio.sleep(0.5 * (2 ** attempt))
+    raise RuntimeError(f"GET {url} failed: {last_error}")
+
+
+async def list_program_links_http(client, listing_url=LISTING_URL):
+    """Collects program links from the paginated listing without a browser ([] if not server-rendered)."""
+    first = await fetch(client, listing_url + "0")
+    tree = LexborHTMLParser(first.text)
+    last = tree.css_first(LAST_PAGE_SELECTOR)
+    try:
+        pages = int(last.text(strip=True)) if last is not None else 1
+    except ValueError:
+        pages = 1
+
+    responses = [first] + list(await asyncio.gather(*[fetch(client, listing_url + str(i)) for i in range(1, pages)]))
+    links = []
+    for response in responses:
+        for node in LexborHTMLParser(response.text).css(PROGRAM_LINK_SELECTOR):
+            href = node.attributes.get('href')
+            if href:
+                links.append(urllib.parse.urljoin(str(response.url), href))
+    return links
+
+
+async def scrape_programs_http(links, concurrency=16, retries=2, client=None, validators=None):
+    """
+    Fetches and parses every link concurrently.
+
+    Returns (items, browser_links, failures): items in `links` order (None where
+    the page could not be used), the links whose HTML lacked REQUIRED_FIELDS
+    (JS-rendered), and link -> error for fetch failures.
+
+    `validators` maps link -> {'etag', 'last_modified'} from the previous crawl;
+    those pages are fetched conditionally and a 304 yields NOT_MODIFIED instead
+    of an item. Parsed items carry the response's http_etag / http_last_modified.
+    """
+    validators = validators or {}
+    own_client = client is None
+    client = client or make_client(concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(link):
+        async with semaphore:
+            try:
+                response = await fetch(client, link, retries, conditional_headers(validators.get(link)))
+                if response.status_code == 304:
+                    return NOT_MODIFIED, None
+                if response.status_code >= 400:
+                    return None, f"HTTP {response.status_code}"
+                item = parse_program_page(response.text, link)
+                item['http_etag'] = response.headers.get('etag')
+                item['http_last_modified'] = response.headers.get('last-modified')
+                return item, None
+            except Exception as e:
+                return None, str(e)
+
+    try:
+        results = await asyncio.gather(*[one(link) for link in links])
+    finally:
+        if own_client:
+            await client.aclose()
+
+    items, browser_links, failures = [], [], {}
+    for link, (item, error) in zip(links, results):
+        if item is None:
+            failures[link] = error
+            items.append(None)
+        elif item is NOT_MODIFIED:
+            items.append(item)
+        elif needs_browser(item):
+            browser_links.append(link)
+            items.append(item)
+        else:
+            items.append(item)
+    return items, browser_links, failures
+
+
+def scrape_programs_hybrid(links, concurrency=16, retries=2, selenium_workers=4, validators=None):
+    """
+    HTTP engine first; pages that need JavaScript, or that could not be fetched
+    over plain HTTP (e.g. blocked clients), go through the Selenium pool.
+    Same return shape as parallel_scraper.scrape_programs: (items, failures),
+    except that items may contain NOT_MODIFIED (see scrape_programs_http).
+    """
+    items, browser_links, http_failures = asyncio.run(
+        scrape_programs_http(links, concurrency, retries, validators=validators))
+    not_modified = sum(1 for item in items if item is NOT_MODIFIED)
+    print(f"HTTP engine: parsed {len(links) - len(browser_links) - len(http_failures) - not_modified}/{len(links)} pages, "
+          f"{not_modified} not modified, {len(browser_links)} need a browser, {len(http_failures)} failed")
+
+    browser_links = browser_links + list(http_failures)
+    failures = {}
+    if browser_links:
+        from parallel_scraper import scrape_programs   # Selenium is only imported when needed
+        browser_items, browser_failures = scrape_programs(browser_links, workers=selenium_workers, retries=retries)
+        by_link = dict(zip(browser_links, browser_items))
+        for n, link in enumerate(links):
+            if by_link.get(link) is not None:
+                items[n] = by_link[link]
+        # A JS page keeps its partial HTTP result; a page that failed both ways is reported
+        failures = {link: f"{http_failures[link]}; browser: {error}"
+                    for link, error in browser_failures.items() if link in http_failures}
+    return items, failures
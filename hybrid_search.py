@@ -0,0 +1,76 @@
+# Hybrid retrieval helpers: a keyword query against an inverted index (Atlas Search)
+# and reciprocal rank fusion (RRF) of the keyword and vector rankings. ragService
+# runs both searches concurrently and fuses them when HYBRID_RETRIEVAL is enabled.
+
+RRF_K = 60   # the usual RRF damping constant; larger values flatten the rank weighting
+
+# Fields the keyword side searches; program names and titles get a boost so
+# queries like "MPPEP" or "Section 502" land on the right program.
+TITLE_FIELDS = ("title", "program_name")
+BODY_FIELDS = ("program_overview",)
+
+
+def search_index_definition(text_field):
+    """Atlas Search (Lucene) index over the keyword fields, standard analyzer."""
+    fields = {name: {"type": "string"} for name in TITLE_FIELDS + BODY_FIELDS + (text_field,)}
+    return {"mappings": {"dynamic": False, "fields": fields}}
+
+
+def ensure_search_index(collection, index_name, text_field):
+    """Creates the Atlas Search index if it does not exist yet (it builds asynchronously on Atlas)."""
+    from pymongo.operations import SearchIndexModel
+    existing = {idx.get("name") for idx in collection.list_search_indexes()}
+    if index_name in existing:
+        return False
+    collection.create_search_index(SearchIndexModel(definition=search_index_definition(text_field), name=index_name))
+    return True
+
+
+def build_keyword_search_pipeline(user_query, limit, index_name, text_field, project):
+    """$search pipeline for the keyword side; `project` is the $project stage shared with vector search."""
+    body_fields = list(dict.fromkeys(BODY_FIELDS + (text_field,)))
+    return [
+        {
+            "$search": {
+                "index": index_name,
+                "compound": {
+                    "should": [
+                        {"text": {"query": user_query, "path": list(TITLE_FIELDS), "score": {"boost": {"value": 3}}}},
+                        {"text": {"query": user_query, "path": body_fields}},
+                    ],
+                    "minimumShouldMatch": 1,
+                },
+            }
+        },
+        {"$limit": limit},
+        {"$project": dict(project, score={"$meta": "searchScore"})},
+    ]
+
+
+def _fusion_key(doc):
+    return doc.get("unique_id") or doc.get("title")
+
+
+def reciprocal_rank_fusion(ranked_lists, limit, rrf_k=RRF_K):
+    """
+    Fuses ranked result lists: each document scores sum(1 / (rrf_k + rank)) over
+    the lists it appears in. Documents are matched on unique_id (or title); the
+    first list that returned a document supplies its fields, so pass the vector
+    results first to keep their (chunk-level) text. Returns the top `limit`
+    documents with 'score' replaced by the fused score and the original ranks in
+    'ranks' (list index -> rank).
+    """
+    fused = {}
+    for list_index, results in enumerate(ranked_lists):
+        for rank, doc in enumerate(results, start=1):
+            key = _fusion_key(doc)
+            if key is None:
+                key = ("anonymous", list_index, rank)
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {"doc": doc, "score": 0.0, "ranks": {}}
+            entry["score"] += 1.0 / (rrf_k + rank)
+            entry["ranks"][list_index] = rank
+
+    ordered = sorted(fused.values(), key=lambda e: -e["score"])[:limit]
+    return [dict(entry["doc"], score=entry["score"], ranks=entry["ranks"]) for entry in ordered]
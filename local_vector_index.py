@@ -0,0 +1,181 @@
+import threading
+import time
+
+import numpy as np
+
+from vector_codec import decode_vector, vector_dimensions
+
+# Metadata kept next to each vector; mirrors the $project stage of the Atlas pipeline
+_META_FIELDS = ("title", "program_name", "unique_id", "updated_at")
+
+
+class LocalVectorIndex:
+    """
+    In-memory replacement for the Atlas $vectorSearch stage.
+
+    All vectors are held in one contiguous float32 matrix with L2-normalized rows,
+    so a top-k query is a single matrix-vector product plus argpartition. Results
+    have the same shape as the Atlas pipeline output (text_chunk, title,
+    program_name, unique_id, updated_at, score) and the score uses the Atlas
+    cosine convention, (1 + cosine) / 2.
+
+    `collection` only needs a pymongo-style find(), so a local stand-in works too;
+    `meta_fields` selects what is returned with each hit (e.g. chunk metadata).
+    Changes are picked up incrementally by polling documents whose 'updated_at'
+    (stamped by main.py / backfill_embeddings.py) is newer than the last refresh;
+    a periodic full reload catches deletions.
+    """
+
+    def __init__(self, collection, vector_field, text_field, refresh_seconds: float = 60, full_reload_seconds: float = 3600,
+                 meta_fields=_META_FIELDS):
+        self.collection = collection
+        self.meta_fields = tuple(meta_fields)
+        self.vector_field = vector_field
+        self.text_field = text_field
+        self.refresh_seconds = refresh_seconds
+        self.full_reload_seconds = full_reload_seconds
+        self.dim = None
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._docs = []          # row -> metadata dict
+        self._rows = {}          # document key -> row
+        self._lock = threading.Lock()
+        self._last_seen = None   # newest updated_at seen so far
+        self._last_refresh = 0.0
+        self._last_full_load = 0.0
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def _projection(self):
+        projection = {self.vector_field: 1, self.text_field: 1, "program_overview": 1}
+        projection.update({f: 1 for f in self.meta_fields})
+        return projection
+
+    @staticmethod
+    def _doc_key(doc):
+        return str(doc.get("unique_id") or doc.get("_id"))
+
+    def _to_row(self, doc):
+        # Binary (float32 / int8) vectors are decoded in place; int8 rows are normalized like floats
+        vec = decode_vector(doc.get(self.vector_field))
+        if vec is None:
+            return None, None
+        vec = vec.astype(np.float32, copy=False)
+        if vec.size == 0 or (self.dim is not None and vec.size != self.dim):
+            return None, None
+        norm = float(np.linalg.norm(vec))
+        if norm == 0.0:
+            return None, None
+        meta = {f: doc.get(f) for f in self.meta_fields}
+        meta["text_chunk"] = doc.get(self.text_field) or doc.get("program_overview")
+        return vec / norm, meta
+
+    def load(self):
+        """(Re)builds the whole matrix from the collection."""
+        docs = list(self.collection.find({self.vector_field: {"$exists": True}}, self._projection()))
+        dims = [vector_dimensions(d.get(self.vector_field)) or 0 for d in docs]
+        # Use the most common dimension; documents embedded with another model are skipped
+        self.dim = max(set(dims), key=dims.count) if dims else None
+
+        vectors, metas, rows = [], [], {}
+        for doc in docs:
+            vec, meta = self._to_row(doc)
+            if vec is None:
+                continue
+            rows[self._doc_key(doc)] = len(metas)
+            vectors.append(vec)
+            metas.append(meta)
+
+        matrix = np.ascontiguousarray(np.vstack(vectors)) if vectors else np.zeros((0, self.dim or 0), dtype=np.float32)
+        stamps = [d.get("updated_at") for d in docs if d.get("updated_at") is not None]
+        now = time.time()
+        with self._lock:
+            self._matrix, self._docs, self._rows = matrix, metas, rows
+            self._last_seen = max(stamps) if stamps else None
+            self._last_refresh = self._last_full_load = now
+        print(f"Local vector index: loaded {len(metas)} vectors (dim={self.dim})")
+
+    def upsert_documents(self, docs):
+        """Adds or replaces rows for the given documents (same shape as collection documents)."""
+        with self._lock:
+            matrix, metas, rows = self._matrix, list(self._docs), dict(self._rows)
+            copied = False
+            new_vectors = []
+            for doc in docs:
+                vec, meta = self._to_row(doc)
+                if vec is None:
+                    continue
+                key = self._doc_key(doc)
+                if key in rows:
+                    if not copied:
+                        matrix = matrix.copy()   # never mutate an array a concurrent search may hold
+                        copied = True
+                    matrix[rows[key]] = vec
+                    metas[rows[key]] = meta
+                else:
+                    rows[key] = len(metas)
+                    metas.append(meta)
+                    new_vectors.append(vec)
+            if new_vectors:
+                base = matrix if matrix.size else np.zeros((0, new_vectors[0].size), dtype=np.float32)
+                matrix = np.ascontiguousarray(np.vstack([base] + new_vectors))
+            self._matrix, self._docs, self._rows = matrix, metas, rows
+
+    def refresh(self):
+        """Pulls documents changed since the last refresh (or reloads everything when due)."""
+        now = time.time()
+        if not self._last_full_load or now - self._last_full_load >= self.full_reload_seconds:
+            self.load()
+            return
+        # Before any document carried an updated_at stamp, pick up every stamped one
+        stamp_filter = {"$gt": self._last_seen} if self._last_seen is not None else {"$exists": True}
+        query = {self.vector_field: {"$exists": True}, "updated_at": stamp_filter}
+        changed = list(self.collection.find(query, self._projection()))
+        if changed:
+            self.upsert_documents(changed)
+            stamps = [d["updated_at"] for d in changed if d.get("updated_at") is not None]
+            if self._last_seen is not None:
+                stamps.append(self._last_seen)
+            self._last_seen = max(stamps) if stamps else None
+            print(f"Local vector index: refreshed {len(changed)} changed documents")
+        self._last_refresh = now
+
+    def refresh_due(self):
+        return not self._last_full_load or time.time() - self._last_refresh >= self.refresh_seconds
+
+    def maybe_refresh(self):
+        if self.refresh_due():
+            self.refresh()
+
+    # ------------------------------------------------------------------
+    # Query
+    # ------------------------------------------------------------------
+
+    def search(self, query_vector, k: int = 4):
+        """Returns the top-k documents for query_vector, best first."""
+        with self._lock:
+            matrix, docs = self._matrix, self._docs
+        n = len(docs)
+        if n == 0 or k <= 0:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32).ravel()
+        if q.size != matrix.shape[1]:
+            raise ValueError(f"Query vector has dimension {q.size}, index has {matrix.shape[1]}")
+        norm = float(np.linalg.norm(q))
+        if norm == 0.0:
+            return []
+        scores = matrix @ (q / norm)
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for row in top:
+            hit = dict(docs[row])
+            hit["score"] = (1.0 + float(scores[row])) / 2.0
+            results.append(hit)
+        return results
+
+    def __len__(self):
+        return len(self._docs)
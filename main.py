@@ -1,125 +1,170 @@
 #Main source code
 from scrapFromUSDA import WebAutomator
 from selenium.webdriver.common.by import By
-from scraping import scrape_current_page
-from ragService import gemini_client, collection, EMBEDDING_MODEL, VECTOR_FIELD, TEXT_FIELD, embedding_to_list
-import hashlib
+from parallel_scraper import scrape_programs
+import http_scraper
+import ragService
+ragService.require_settings()   # the clients imported below are created on first use; fail before that
+from ragService import gemini_client, collection, chunk_collection, EMBEDDING_MODEL, VECTOR_FIELD, TEXT_FIELD, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, BM25_INDEX_PATH, VECTOR_STORAGE
+from batch_embedder import BatchEmbedder
+from bulk_writer import BulkUpsertWriter, append_failure
+from change_detection import IngestSummary, load_known_programs, program_document, validators_for
+from chunking import store_program_chunks
+from work_queue import WORK_QUEUE_PATH
+import bm25_index
+import asyncio
 import os
-import traceback
-from pymongo.errors import InvalidDocument
+from datetime import datetime, timezone
+
+SCRAPER_WORKERS = int(os.getenv('SCRAPER_WORKERS') or 4)   # parallel headless browser sessions
+SCRAPER_RETRIES = int(os.getenv('SCRAPER_RETRIES') or 2)   # extra attempts per program page
+SCRAPER_ENGINE = (os.getenv('SCRAPER_ENGINE') or 'http').lower()   # 'http' (Selenium fallback) or 'selenium'
+INGEST_SUMMARY_PATH = os.getenv('INGEST_SUMMARY_PATH') or 'ingest_summary.json'
+INGEST_DELETE_REMOVED = (os.getenv('INGEST_DELETE_REMOVED') or '').lower() in ('1', 'true', 'yes')
+
+
+def list_program_links_selenium():
+    USDA = WebAutomator(True)
+    programLinks = []
+    USDA.navigate_to("https://www.rd.usda.gov/programs-services/all-programs?page=0")
+    index = USDA.find_element(By.CSS_SELECTOR, "li.usa-pagination__item:nth-child(5) > a:nth-child(1)").text
+    for i in range (0, int(index)):
+        USDA.navigate_to(("https://www.rd.usda.gov/programs-services/all-programs?page=" + str(i)))
+        programsList = USDA.find_element(By.CSS_SELECTOR, "div.view-content:nth-child(3)")
+        programs = programsList.find_elements(By.CLASS_NAME, "views-row")
+        for i in programs:
+            prog = i.find_element(By.TAG_NAME, "a").get_attribute("href")
+            programLinks.append(prog)
+    USDA.close_driver()
+    return programLinks
+
+
+async def _list_program_links_http():
+    async with http_scraper.make_client() as client:
+        return await http_scraper.list_program_links_http(client)
+
 
-USDA = WebAutomator(True)
 programLinks = []
-USDA.navigate_to("https://www.rd.usda.gov/programs-services/all-programs?page=0")
-index = USDA.find_element(By.CSS_SELECTOR, "li.usa-pagination__item:nth-child(5) > a:nth-child(1)").text
-for i in range (0, int(index)):
-    USDA.navigate_to(("https://www.rd.usda.gov/programs-services/all-programs?page=" + str(i)))
-    programsList = USDA.find_element(By.CSS_SELECTOR, "div.view-content:nth-child(3)")
-    programs = programsList.find_elements(By.CLASS_NAME, "views-row")
-    for i in programs:
-        prog = i.find_element(By.TAG_NAME, "a").get_attribute("href")
-        programLinks.append(prog)
-obj = []
-for i in programLinks:
-    USDA.navigate_to(i)
-    item = scrape_current_page(USDA, By, i)
-    obj.append(item)
-
-    # Prepare a text field for embedding and storage. Prefer program_overview, then overview link, then joined fields.
-    if item.get('program_overview'):
-        text_content = item.get('program_overview')
-    elif item.get('program_overview_link'):
-        text_content = item.get('program_overview_link')
-    else:
-        parts = []
-        for v in ['title', 'website', 'program_status', 'program_deadline', 'program_apply', 'program_requirements', 'program_contact', 'program_events']:
-            if item.get(v):
-                parts.append(str(item.get(v)))
-        text_content = "\n\n".join(parts) if parts else ""
+if SCRAPER_ENGINE == 'http':
+    try:
+        programLinks = asyncio.run(_list_program_links_http())
+    except Exception as e:
+        print(f"HTTP listing failed ({e}); falling back to Selenium")
+if not programLinks:
+    programLinks = list_program_links_selenium()
+
+# What the previous crawl stored (content hash + HTTP validators per program page)
+known_programs = load_known_programs(collection)
+summary = IngestSummary()
+
+# Program pages: the HTTP engine (Selenium only for JS-rendered pages) or a pool of browsers.
+# The HTTP engine re-fetches known pages conditionally, so unchanged pages answer 304.
+if SCRAPER_ENGINE == 'http':
+    obj, scrape_failures = http_scraper.scrape_programs_hybrid(programLinks, selenium_workers=SCRAPER_WORKERS, retries=SCRAPER_RETRIES,
+                                                               validators=validators_for(known_programs))
+else:
+    obj, scrape_failures = scrape_programs(programLinks, workers=SCRAPER_WORKERS, retries=SCRAPER_RETRIES)
+for link, error in scrape_failures.items():
+    append_failure(WORK_QUEUE_PATH, 'scrape', RuntimeError(error), unique_id=link, extra={'website': link})
+
+pending = []   # (item, doc, text_content) waiting for a batched embedding
+refreshed = []   # (unique_id, $set) for unchanged programs: new validators / checked_at only
+checked_at = datetime.now(timezone.utc)
+for link, item in zip(programLinks, obj):
+    if item is http_scraper.NOT_MODIFIED:
+        summary.unchanged.append(link)
+        refreshed.append((known_programs[link].get('unique_id'), {'checked_at': checked_at}))
+        continue
+    if item is None:
+        summary.failed.append(link)
+        continue
 
     # Use TEXT_FIELD from ragService (fallback to 'text' if missing)
     text_field_name = TEXT_FIELD or os.getenv('MONGO_TEXT_FIELD') or 'text'
 
-    # Create a stable unique id for upsert using the overview link or title
-    unique_key = item.get('program_overview_link') or item.get('title') or hashlib.sha256(text_content.encode('utf-8')).hexdigest()
+    # Text to embed (overview, else overview link, else joined fields) and a stable
+    # unique_id for the upsert (overview link or title); see change_detection.py
+    doc, text_content = program_document(item, text_field_name)
+
+    # Unchanged content keeps its stored embedding and document: no Gemini call and no
+    # updated_at bump, but the page's new ETag / Last-Modified are stored so the next
+    # crawl's conditional request can be answered with 304
+    if summary.classify(link, doc['content_hash'], known_programs) == 'unchanged':
+        refreshed.append((known_programs[link].get('unique_id'), {
+            'http_etag': item.get('http_etag'),
+            'http_last_modified': item.get('http_last_modified'),
+            'checked_at': checked_at,
+        }))
+        continue
+
+    pending.append((item, doc, text_content))
+
+# Programs stored by an earlier crawl that are no longer listed
+removed = summary.find_removed(known_programs, programLinks)
+deleted_ids = []
+if removed and INGEST_DELETE_REMOVED:
+    deleted_ids = [known_programs[website].get('unique_id') for website in removed]
+    result = collection.delete_many({'website': {'$in': removed}})
+    chunk_collection.delete_many({'website': {'$in': removed}})
+    print(f"Deleted {result.deleted_count} program(s) no longer listed")
+
+# Embed every scraped program in as few Gemini calls as possible (see batch_embedder.py)
+embedder = BatchEmbedder(gemini_client, EMBEDDING_MODEL)
+vectors = embedder.embed_texts([text_content for _, _, text_content in pending])
+embed_errors = embedder.errors
+print(f"Embedded {len(pending) - len(embed_errors)}/{len(pending)} programs in {embedder.requests} request(s)")
+
+# Queue all upserts; BulkUpsertWriter sanitizes each document up front and sends them
+# with unordered bulk_write calls, queuing per-operation failures for replay_failures.py
+writer = BulkUpsertWriter(collection, WORK_QUEUE_PATH, vector_field=VECTOR_FIELD, vector_storage=VECTOR_STORAGE)
+for n, (item, doc, text_content) in enumerate(pending):
+    unique_key = doc['unique_id']
+    normalized_vector = vectors[n]
+    if normalized_vector is None:
+        error = embed_errors.get(n) or 'Could not extract/normalize embedding vector from Gemini response'
+        print(f"Failed to embed item ({item.get('title')}): {error}")
+        summary.mark_failed(item.get('website'))
+        append_failure(WORK_QUEUE_PATH, 'embed', RuntimeError(error), unique_id=unique_key,
+                       title=item.get('title'), extra={'item': item})
+        continue
+
+    doc[VECTOR_FIELD] = normalized_vector
+    # Version stamp: ragService.answer_cache only reuses answers built from the same (unique_id, updated_at) set
+    doc['updated_at'] = datetime.now(timezone.utc)
+    writer.add({'unique_id': unique_key}, doc, unique_id=unique_key, title=item.get('title'))
+
+for unique_key, fields in refreshed:
+    if unique_key:
+        writer.add({'unique_id': unique_key}, fields, upsert=False, unique_id=unique_key)
+
+writer.close()
+print(f"Ingest complete: upserted={writer.upserted}, modified={writer.modified}, failed={writer.failed}")
+
+# Only programs whose upsert went through; the others are queued for replay_failures.py
+embedded_docs = []
+for item, doc, _ in pending:
+    if doc.get(VECTOR_FIELD) is None:
+        continue
+    if doc['unique_id'] in writer.failed_ids:
+        summary.mark_failed(item.get('website'))
+        continue
+    embedded_docs.append(doc)
+
+# Keyword index (see bm25_index.py): re-tokenize only added/changed programs; built from the collection the first time
+try:
+    bm25_index.update_index(BM25_INDEX_PATH, TEXT_FIELD, docs=embedded_docs, removed=deleted_ids, collection=collection)
+except Exception as e:
+    print(f"Could not update the BM25 index: {e}")
+
+# Passage-level chunks for every added/changed program (see chunking.py); unchanged programs keep theirs
+if embedded_docs:
+    chunk_embedder = BatchEmbedder(gemini_client, EMBEDDING_MODEL)
+    chunks_written, chunks_failed = store_program_chunks(
+        embedded_docs, chunk_embedder, chunk_collection, WORK_QUEUE_PATH, TEXT_FIELD, VECTOR_FIELD,
+        max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, vector_storage=VECTOR_STORAGE,
+    )
+    print(f"Chunked {len(embedded_docs)} program(s): {chunks_written} chunks written, {chunks_failed} failed "
+          f"({chunk_embedder.requests} embedding request(s))")
+summary.report(INGEST_SUMMARY_PATH)
 
-    # Embed the text and upsert into MongoDB
-    try:
-        # Gemini expects 'contents' (not 'content'). Accept string or list.
-        # Avoid truth-testing collection/gemini_client objects; compare with None explicitly
-        if gemini_client is None or collection is None:
-            raise RuntimeError('Gemini client or Mongo collection not initialized')
-        emb_resp = gemini_client.models.embed_content(model=EMBEDDING_MODEL, contents=[text_content])
-
-        # Robust extraction and normalization using helper from ragService
-        raw_vec = None
-        if hasattr(emb_resp, 'embedding'):
-            raw_vec = emb_resp.embedding
-        elif hasattr(emb_resp, 'embeddings'):
-            raw_vec = emb_resp.embeddings[0]
-        elif isinstance(emb_resp, dict):
-            raw_vec = emb_resp.get('embedding') or (emb_resp.get('embeddings') and emb_resp.get('embeddings')[0])
-
-        normalized_vector = embedding_to_list(raw_vec)
-        if normalized_vector is None:
-            raise ValueError('Could not extract/normalize embedding vector from Gemini response')
-
-        # Build document and upsert
-        doc = item.copy()
-        doc[text_field_name] = text_content
-        doc[VECTOR_FIELD] = normalized_vector
-        filter_q = {'unique_id': unique_key}
-        doc['unique_id'] = unique_key
-
-        try:
-            collection.update_one(filter_q, {'$set': doc}, upsert=True)
-            print(f"Upserted document for: {item.get('title') or unique_key}")
-        except InvalidDocument as ide:
-            # Attempt to sanitize and retry: remove problematic fields, convert vector to simple list or drop it
-            print(f"InvalidDocument on upsert for {item.get('title')}: {ide}; attempting sanitization and retry")
-            try:
-                # Remove any keys with leading $ or containing '.' (not allowed in BSON keys)
-                safe_doc = {}
-                for k, v in doc.items():
-                    if isinstance(k, str) and (k.startswith('$') or '.' in k):
-                        continue
-                    safe_doc[k] = v
-
-                # Ensure vector is a list of floats or remove it
-                if VECTOR_FIELD in safe_doc:
-                    try:
-                        safe_doc[VECTOR_FIELD] = [float(x) for x in safe_doc[VECTOR_FIELD]]
-                    except Exception:
-                        safe_doc.pop(VECTOR_FIELD, None)
-
-                collection.update_one(filter_q, {'$set': safe_doc}, upsert=True)
-                print(f"Upserted sanitized document for: {item.get('title') or unique_key}")
-            except Exception as e2:
-                print(f"Sanitized upsert failed for {item.get('title')}: {e2}")
-                # Log failed item + traceback
-                try:
-                    with open('failed_upserts.jsonl', 'a', encoding='utf-8') as f:
-                        f.write('{')
-                        f.write('"title": ' + repr(item.get('title')) + ',')
-                        f.write('"error": ' + repr(str(e2)) + ',')
-                        f.write('"trace": ' + repr(traceback.format_exc()))
-                        f.write('}\n')
-                except Exception:
-                    pass
-        except Exception as e:
-            # Generic failure already logged below
-            raise
-    except Exception as e:
-        print(f"Failed to embed/upsert item ({item.get('title')}): {e}")
-        # Log failed item to disk for later retry
-        try:
-            import json
-            with open('failed_upserts.jsonl', 'a', encoding='utf-8') as f:
-                json.dump({'item': item, 'error': str(e)}, f)
-                f.write('\n')
-        except Exception:
-            pass
-
-# Cleanup WebDriver
-USDA.close_driver()
 #print(obj)
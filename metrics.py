@@ -0,0 +1,235 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+# Minimal Prometheus-style metrics for the RAG pipeline (no client library needed):
+# histograms and counters rendered in the text exposition format by render(), plus a
+# per-request trace of stage timings for the Server-Timing header.
+#
+# When disabled, timed() returns a shared no-op context manager and observe()/inc()
+# return immediately, so instrumented code pays one attribute check per call.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+SCORE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, registry, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        if not self.registry.enabled or value is None:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _label_text(self.labels + ("le",), label_values + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            labels = _label_text(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, registry, name, help_text, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_label_text(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+class RequestTrace:
+    """Stage timings of one request, in the order they finished (for Server-Timing)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []   # (stage, seconds)
+
+    def add(self, stage, seconds):
+        self.stages.append((stage, seconds))
+
+    def server_timing(self, total=True):
+        """Server-Timing header value, e.g. 'embed;dur=41.2, vector_search;dur=63.0, total;dur=912.4'."""
+        parts = [f"{stage};dur={ms:.1f}" for stage, ms in self.as_dict().items()]
+        if total:
+            parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def as_dict(self):
+        timings = {}
+        for stage, seconds in self.stages:
+            timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 1)
+        return timings
+
+
+_current_trace = ContextVar("rag_request_trace", default=None)
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _StageTimer:
+    __slots__ = ("registry", "stage", "started")
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.record_stage(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Holds the pipeline metrics. `collectors` are callables run at render time that
+    return extra lines (e.g. cache counters taken from the caches' own stats()).
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._metrics = []
+        self._collectors = []
+        self.stage_seconds = self.histogram(
+            "rag_stage_duration_seconds", "Time spent in each RAG pipeline stage", LATENCY_BUCKETS, ("stage",))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        metric = Histogram(self, name, help_text, buckets, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(self, name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    # --- per-request tracing -------------------------------------------
+
+    def start_request(self):
+        """Starts a RequestTrace for the current context (None when disabled)."""
+        if not self.enabled:
+            return None
+        trace = RequestTrace()
+        _current_trace.set(trace)
+        return trace
+
+    def timed(self, stage):
+        """Context manager timing one pipeline stage (histogram + current request trace)."""
+        if not self.enabled:
+            return _NOOP_TIMER
+        return _StageTimer(self, stage)
+
+    def current_trace(self):
+        """RequestTrace of the current context, or None."""
+        return _current_trace.get() if self.enabled else None
+
+    def record_stage(self, stage, seconds):
+        if not self.enabled:
+            return
+        self.stage_seconds.observe(seconds, stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, seconds)
+
+    # --- exposition ----------------------------------------------------
+
+    def render(self):
+        if not self.enabled:
+            return "# metrics disabled (set METRICS_ENABLED=1)\n"
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                lines.append(f"# collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+def cache_lines(caches):
+    """Counter/gauge lines for caches exposing stats() with hits/misses (name -> cache)."""
+    lines = [
+        "# HELP rag_cache_hits_total Cache hits", "# TYPE rag_cache_hits_total counter",
+    ]
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    for name, s in stats.items():
+        lines.append(f'rag_cache_hits_total{{cache="{name}"}} {s.get("hits", 0)}')
+    lines += ["# HELP rag_cache_misses_total Cache misses", "# TYPE rag_cache_misses_total counter"]
+    for name, s in stats.items():
+        lines.append(f'rag_cache_misses_total{{cache="{name}"}} {s.get("misses", s.get("calls", 0))}')
+    lines += ["# HELP rag_cache_hit_ratio Cache hit ratio since start", "# TYPE rag_cache_hit_ratio gauge"]
+    for name, s in stats.items():
+        lines.append(f'rag_cache_hit_ratio{{cache="{name}"}} {float(s.get("hit_rate", 0.0))}')
+    return lines
@@ -0,0 +1,178 @@
+import importlib
+import threading
+
+from pymongo import ReadPreference, monitoring
+
+# Connection-pool / wire settings for the Mongo clients, and pymongo listeners that
+# count pool checkouts (and how long they waited) and command latencies, so pool
+# exhaustion and slow Atlas nodes show up in /stats/mongo and /metrics.
+
+# Python modules pymongo needs for each wire compressor (zlib ships with Python)
+_COMPRESSOR_MODULES = {
+    "zstd": ("compression.zstd", "backports.zstd"),
+    "snappy": ("snappy",),
+    "zlib": ("zlib",),
+}
+
+
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primarypreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondarypreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+
+def read_preference(name):
+    """ReadPreference for a mode name as in a connection string, e.g. "secondaryPreferred"."""
+    try:
+        return _READ_PREFERENCES[name.replace("_", "").lower()]
+    except KeyError:
+        raise ValueError(f"unknown read preference {name!r} (expected one of primary, primaryPreferred, "
+                         f"secondary, secondaryPreferred, nearest)") from None
+
+
+def available_compressors(names):
+    """The requested compressors (e.g. "zstd,snappy,zlib") whose modules are installed, in order."""
+    available = []
+    for name in (n.strip().lower() for n in names.split(",")):
+        for module in _COMPRESSOR_MODULES.get(name, ()):
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                continue
+            available.append(name)
+            break
+    return available
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Connection counts and checkout waits across every pool it is registered on.
+    `on_checkout(seconds)` is called with each checkout's wait (metrics hook).
+    """
+
+    def __init__(self, on_checkout=None):
+        self.on_checkout = on_checkout
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checked_in = 0
+        self.checkout_failed = {}   # reason -> count
+        self.cleared = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            reason = str(event.reason)
+            self.checkout_failed[reason] = self.checkout_failed.get(reason, 0) + 1
+
+    def connection_checked_out(self, event):
+        wait = event.duration or 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        if self.on_checkout:
+            self.on_checkout(wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_in += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": self.created - self.closed,
+                "in_use": self.checked_out - self.checked_in,
+                "created": self.created,
+                "closed": self.closed,
+                "checkouts": self.checked_out,
+                "checkout_failed": dict(self.checkout_failed),
+                "pool_cleared": self.cleared,
+                "avg_checkout_wait_ms": round(self.wait_total / self.checked_out * 1000, 3) if self.checked_out else 0.0,
+                "max_checkout_wait_ms": round(self.wait_max * 1000, 3),
+            }
+
+    def gauge_lines(self):
+        s = self.stats()
+        return [
+            "# HELP rag_mongo_connections_open Open Mongo connections", "# TYPE rag_mongo_connections_open gauge",
+            f"rag_mongo_connections_open {s['open']}",
+            "# HELP rag_mongo_connections_in_use Mongo connections checked out", "# TYPE rag_mongo_connections_in_use gauge",
+            f"rag_mongo_connections_in_use {s['in_use']}",
+        ]
+
+
+class CommandStatsListener(monitoring.CommandListener):
+    """
+    Per-command counts, failures and latency. `on_command(name, seconds, ok)` is the
+    metrics hook. MaxTimeMSExpired (code 50) failures are counted as timeouts.
+    """
+
+    def __init__(self, on_command=None):
+        self.on_command = on_command
+        self._lock = threading.Lock()
+        self.commands = {}   # name -> {"count", "failed", "timeouts", "total_ms", "max_ms"}
+
+    def _record(self, name, micros, ok, timeout=False):
+        ms = micros / 1000.0
+        with self._lock:
+            entry = self.commands.get(name)
+            if entry is None:
+                entry = self.commands[name] = {"count": 0, "failed": 0, "timeouts": 0, "total_ms": 0.0, "max_ms": 0.0}
+            entry["count"] += 1
+            entry["failed"] += not ok
+            entry["timeouts"] += timeout
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+        if self.on_command:
+            self.on_command(name, ms / 1000.0, ok)
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event.command_name, event.duration_micros, True)
+
+    def failed(self, event):
+        code = event.failure.get("code") if isinstance(event.failure, dict) else None
+        self._record(event.command_name, event.duration_micros, False, timeout=code == 50)
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: dict(entry, total_ms=round(entry["total_ms"], 1), max_ms=round(entry["max_ms"], 1),
+                           avg_ms=round(entry["total_ms"] / entry["count"], 2))
+                for name, entry in self.commands.items()
+            }
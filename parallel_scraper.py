@@ -0,0 +1,97 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from selenium.webdriver.common.by import By
+
+from scrapFromUSDA import WebAutomator
+from scraping import scrape_current_page
+
+
+class WebAutomatorPool:
+    """
+    One headless WebAutomator per worker thread, created on first use.
+
+    Each browser is a separate driver process, so threads give real parallelism
+    here; the pool only makes sure a session is never shared between threads.
+    """
+
+    def __init__(self, headless: bool = True, browser: str = 'firefox'):
+        self.headless = headless
+        self.browser = browser
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def get(self) -> WebAutomator:
+        automator = getattr(self._local, 'automator', None)
+        if automator is None:
+            automator = WebAutomator(self.headless, self.browser)
+            self._local.automator = automator
+            with self._lock:
+                self._all.append(automator)
+        return automator
+
+    def reset(self):
+        """Replaces this thread's session (e.g. after the browser crashed)."""
+        automator = getattr(self._local, 'automator', None)
+        self._local.automator = None
+        if automator is not None:
+            with self._lock:
+                if automator in self._all:
+                    self._all.remove(automator)
+            try:
+                automator.close_driver()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._lock:
+            automators, self._all = self._all, []
+        for automator in automators:
+            try:
+                automator.close_driver()
+            except Exception as e:
+                print(f"Error closing WebDriver: {e}")
+
+
+def _scrape_one(pool, link, retries):
+    last_error = None
+    partial = None
+    for attempt in range(1 + retries):
+        try:
+            automator = pool.get()
+            automator.navigate_to(link)
+            item = scrape_current_page(automator, By, link)
+            if item.get('title'):
+                return item, None
+            # No title usually means the page did not finish loading; retry, but keep what we got
+            partial = item
+            last_error = 'page loaded without a title'
+        except Exception as e:
+            last_error = str(e)
+            # A failed navigation usually means the session is unusable; start a fresh one
+            pool.reset()
+        print(f"Scrape attempt {attempt + 1} failed for {link}: {last_error}")
+    if partial is not None:
+        return partial, None
+    return None, last_error
+
+
+def scrape_programs(links, workers: int = 4, retries: int = 2, headless: bool = True, browser: str = 'firefox'):
+    """
+    Scrapes every program link with `workers` parallel browser sessions.
+
+    Returns (items, failures): items are in the same order as `links` (None where
+    every attempt failed) and failures maps link -> last error message.
+    """
+    pool = WebAutomatorPool(headless, browser)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = list(executor.map(lambda link: _scrape_one(pool, link, retries), links))
+    finally:
+        pool.close()
+
+    items = [item for item, _ in results]
+    failures = {link: error for link, (item, error) in zip(links, results) if item is None}
+    print(f"Scraped {len(links) - len(failures)}/{len(links)} program pages with {workers} worker(s)")
+    return items, failures
@@ -5,6 +5,8 @@ import remarkGfm from 'remark-gfm';
 
 // Configuration: Your FastAPI endpoint
 const API_ENDPOINT = 'https://usda-chatbotbackend.onrender.com/chat';
+// Server-Sent Events variant of the same endpoint (streams the answer token by token)
+const STREAM_ENDPOINT = `${API_ENDPOINT}/stream`;
 
 // Structure for a single message
 const initialMessages = [
@@ -15,6 +17,8 @@ function Chatbot() {
   const [messages, setMessages] = useState(initialMessages);
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  // True once the first streamed token has arrived (the answer is being rendered live)
+  const [isStreaming, setIsStreaming] = useState(false);
   const chatEndRef = useRef(null);
 
   // Scrolls to the bottom of the chat window when new messages arrive
@@ -35,8 +39,8 @@ function Chatbot() {
     setIsLoading(true);
 
     try {
-      // 2. Make the POST request to the RAG API
-      const response = await fetch(API_ENDPOINT, {
+      // 2. Make the POST request to the streaming RAG API
+      const response = await fetch(STREAM_ENDPOINT, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -45,31 +49,64 @@ function Chatbot() {
         body: JSON.stringify({ query: input }),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`HTTP error! Status: ${response.status}`);
       }
 
-      // 3. Parse the JSON response
-      const result = await response.json();
-      const assistantResponse = { 
-        role: 'assistant', 
-        // The response field is named 'response' by your FastAPI endpoint
-        content: result.response 
+      // 3. Read the SSE stream; each 'token' event appends text to the assistant message
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let started = false;
+
+      const appendToken = (text) => {
+        if (!started) {
+          // 4. First token: add the assistant message and hide the loading indicator
+          started = true;
+          setIsStreaming(true);
+          setMessages((prev) => [...prev, { role: 'assistant', content: text }]);
+          return;
+        }
+        setMessages((prev) => {
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, content: last.content + text }];
+        });
       };
 
-      // 4. Update state with AI's response
-      setMessages((prev) => [...prev, assistantResponse]);
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+          const rawEvent = buffer.slice(0, sep);
+          buffer = buffer.slice(sep + 2);
+
+          let eventName = 'message';
+          let data = '';
+          for (const line of rawEvent.split('\n')) {
+            if (line.startsWith('event:')) eventName = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+          }
+          if (eventName === 'token' && data) {
+            appendToken(JSON.parse(data).text);
+          }
+        }
+      }
 
     } catch (error) {
       console.error('API Call Error:', error);
       const errorMessage = { 
         role: 'assistant', 
-        content: `Error: Could not connect to the RAG service. Please ensure the backend is running on ${API_ENDPOINT} and check your CORS settings.` 
+        content: `Error: Could not connect to the RAG service. Please ensure the backend is running on ${STREAM_ENDPOINT} and check your CORS settings.` 
       };
       setMessages((prev) => [...prev, errorMessage]);
       
     } finally {
       setIsLoading(false);
+      setIsStreaming(false);
     }
   };
 
@@ -101,7 +138,7 @@ function Chatbot() {
           </div>
         ))}
         {/* Loading Indicator */}
-        {isLoading && (
+        {isLoading && !isStreaming && (
           <div style={styles.loadingMessage}>
       <div style={styles.messageBubble}>
         Sprout 🌱 is processing your query...
@@ -2,10 +2,28 @@ import os
 from dotenv import load_dotenv
 from google import genai
 from google.genai.errors import APIError
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient
 import certifi
 import urllib.parse
 import re
+import asyncio
+import contextvars
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from embedding_cache import EmbeddingCache
+from answer_cache import SemanticAnswerCache
+import chunking
+from chunking import group_chunks_by_program
+from context_builder import ContextBuilder
+from hybrid_search import build_keyword_search_pipeline, reciprocal_rank_fusion
+from reranker import Reranker
+from metrics import MetricsRegistry, TOKEN_BUCKETS, SCORE_BUCKETS, cache_lines
+from vector_codec import VECTOR_STORAGES, encode_vector, vector_dimensions
+from admission import AdmissionController, Overloaded, remaining_seconds
+from mongo_pool import CommandStatsListener, PoolStatsListener, available_compressors, read_preference
+from resilient_gemini import ResilientGeminiClient
 
 # 1. Load Environment Variables (happens once when the server starts)
 load_dotenv()
@@ -24,7 +42,245 @@ TEXT_FIELD = os.getenv("MONGO_TEXT_FIELD") or "text"      # 'text'
 
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
 RAG_CHAT_MODEL = 'gemini-2.5-flash'          # <-- DEFINES RAG_CHAT_MODEL
+# Answers come from this model while RAG_CHAT_MODEL's circuit breaker is open or it keeps failing ("" disables)
+RAG_FALLBACK_MODEL = os.getenv("RAG_FALLBACK_MODEL", "gemini-2.5-flash-lite")
 VECTOR_INDEX_NAME = "vector_index"           # <-- DEFINES VECTOR_INDEX_NAME
+# ANN candidates $vectorSearch considers per query (recall vs latency; see evaluate_retrieval.py)
+VECTOR_NUM_CANDIDATES = int(os.getenv("VECTOR_NUM_CANDIDATES") or 100)
+# How embeddings are written to Mongo (see vector_codec.py): "array" (BSON doubles, the
+# original format), "float32" or "int8" packed binary vectors. The query vector is sent
+# in the same format; convert existing documents with convert_vector_storage.py.
+VECTOR_STORAGE = (os.getenv("VECTOR_STORAGE") or "array").lower()
+if VECTOR_STORAGE not in VECTOR_STORAGES:
+    raise ValueError(f"VECTOR_STORAGE must be one of {', '.join(VECTOR_STORAGES)}, not {VECTOR_STORAGE!r}")
+
+# Query-embedding cache (see embedding_cache.py). Set EMBEDDING_CACHE_PATH to a
+# SQLite file to share cached query vectors across uvicorn workers and restarts.
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE") or 2048)
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS") or 24 * 3600)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or None
+QUERY_TASK_TYPE = "RETRIEVAL_QUERY"
+
+query_embedding_cache = EmbeddingCache(
+    max_entries=EMBEDDING_CACHE_SIZE,
+    ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS,
+    path=EMBEDDING_CACHE_PATH,
+)
+
+# Retriever backend for the vector step:
+#   "atlas" (default) - $vectorSearch against VECTOR_INDEX_NAME
+#   "local"           - in-process NumPy index over all VECTOR_FIELD vectors (see local_vector_index.py);
+#                       no network round-trip per query, refreshed every LOCAL_INDEX_REFRESH_SECONDS
+RETRIEVER_BACKEND = (os.getenv("RETRIEVER_BACKEND") or "atlas").lower()
+LOCAL_INDEX_REFRESH_SECONDS = float(os.getenv("LOCAL_INDEX_REFRESH_SECONDS") or 60)
+_local_vector_index = None
+
+# Retrieval unit (see chunking.py):
+#   "program" (default) - one vector per program document; whole overviews go into the prompt
+#   "chunk"             - searches the per-passage chunk collection written by main.py and
+#                         groups the matching passages by program (needs CHUNK_VECTOR_INDEX_NAME)
+RETRIEVAL_UNIT = (os.getenv("RETRIEVAL_UNIT") or "program").lower()
+CHUNK_COLLECTION_NAME = os.getenv("MONGO_CHUNK_COLLECTION_NAME") or f"{COLLECTION_NAME}_chunks"
+CHUNK_VECTOR_INDEX_NAME = os.getenv("CHUNK_VECTOR_INDEX_NAME") or "chunk_vector_index"
+CHUNKS_PER_RESULT = int(os.getenv("CHUNKS_PER_RESULT") or 3)   # chunks fetched per program requested
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS") or chunking.CHUNK_MAX_TOKENS)
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS") or chunking.CHUNK_OVERLAP_TOKENS)
+CHUNK_META_FIELDS = ("title", "program_name", "parent_id", "chunk_index", "section", "overlap_chars", "updated_at")
+
+# Hybrid retrieval (see hybrid_search.py): vector and keyword search run concurrently and
+# are merged with reciprocal rank fusion. The keyword side queries the Atlas Search
+# (inverted) index SEARCH_INDEX_NAME; hybrid_search.ensure_search_index creates it.
+HYBRID_RETRIEVAL = (os.getenv("HYBRID_RETRIEVAL") or "").lower() in ("1", "true", "yes")
+SEARCH_INDEX_NAME = os.getenv("SEARCH_INDEX_NAME") or "text_search_index"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES") or 10)   # results taken from each side before fusion
+_keyword_executor = None
+_keyword_search_warned = False
+
+# Local BM25 keyword index (see bm25_index.py), written by main.py / backfill_embeddings.py
+# into BM25_INDEX_PATH. When it exists it replaces the regex scan as the keyword fallback;
+# KEYWORD_BACKEND=local also makes it the keyword side of HYBRID_RETRIEVAL instead of Atlas Search.
+KEYWORD_BACKEND = (os.getenv("KEYWORD_BACKEND") or "atlas").lower()
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH") or "bm25_index"
+_bm25_index = None
+
+# Optional rerank stage (see reranker.py): RERANK_CANDIDATES documents are retrieved and
+# reordered by one batched RERANK_MODEL call; if that takes longer than RERANK_BUDGET_MS
+# the retrieval order is kept. Rankings are cached per (query hash, candidate documents).
+RERANK_ENABLED = (os.getenv("RERANK_ENABLED") or "").lower() in ("1", "true", "yes")
+RERANK_MODEL = os.getenv("RERANK_MODEL") or "gemini-2.5-flash-lite"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES") or 20)
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS") or 800)
+
+reranker = Reranker(RERANK_MODEL, budget_seconds=RERANK_BUDGET_MS / 1000.0)
+
+# Prompt context budget (see context_builder.py): passages are deduplicated by shingle
+# overlap and cut to CONTEXT_MAX_TOKENS (approximate tokens) before generation.
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS") or 2000)
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD") or 0.8)
+CONTEXT_LOG = (os.getenv("CONTEXT_LOG") or "").lower() in ("1", "true", "yes")   # print per-request token stats
+
+context_builder = ContextBuilder(max_tokens=CONTEXT_MAX_TOKENS, dedup_threshold=CONTEXT_DEDUP_THRESHOLD)
+
+# Semantic answer cache (see answer_cache.py): reuses a generated answer when a new
+# query embedding is within ANSWER_CACHE_SIMILARITY (cosine) of a cached one AND the
+# retrieved document set is identical. ANSWER_CACHE_SIZE=0 disables it.
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY") or 0.95)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE") or 512)
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS") or 6 * 3600)
+
+answer_cache = SemanticAnswerCache(
+    threshold=ANSWER_CACHE_SIMILARITY,
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+)
+
+# Pipeline metrics (see metrics.py): per-stage latency histograms (embed, vector_search,
+# rerank, fallback_search, prompt_build, generation, post_processing), token counts,
+# retrieval scores and cache hit rates. api_app exports them at /metrics and as a
+# Server-Timing header. Off by default; when off every hook is a no-op.
+METRICS_ENABLED = (os.getenv("METRICS_ENABLED") or "").lower() in ("1", "true", "yes")
+
+metrics = MetricsRegistry(enabled=METRICS_ENABLED)
+context_tokens_hist = metrics.histogram(
+    "rag_context_tokens", "Approximate prompt-context tokens per request (raw retrieved vs used)", TOKEN_BUCKETS, ("kind",))
+llm_tokens_hist = metrics.histogram(
+    "rag_llm_tokens", "Tokens reported by Gemini usage metadata per answer", TOKEN_BUCKETS, ("kind",))
+retrieval_score_hist = metrics.histogram(
+    "rag_retrieval_score", "Vector search scores of retrieved documents (top hit vs the rest)", SCORE_BUCKETS, ("rank",))
+answers_counter = metrics.counter("rag_answers_total", "Answers by outcome", ("outcome",))
+metrics.add_collector(lambda: cache_lines({
+    "query_embedding": query_embedding_cache, "answer": answer_cache, "rerank": reranker,
+}))
+
+# Admission control for the async pipeline (see admission.py): at most MAX_CONCURRENT_*
+# calls per stage reach Gemini / Atlas at once, ADMISSION_QUEUE_SIZE more may wait for a
+# slot (up to ADMISSION_MAX_WAIT_MS, and never past the request deadline api_app sets).
+# Beyond that the request is shed with Overloaded (503 + Retry-After). 0 disables a limit.
+MAX_CONCURRENT_EMBED = int(os.getenv("MAX_CONCURRENT_EMBED") or 32)
+MAX_CONCURRENT_SEARCH = int(os.getenv("MAX_CONCURRENT_SEARCH") or 32)
+MAX_CONCURRENT_GENERATE = int(os.getenv("MAX_CONCURRENT_GENERATE") or 16)
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE") or 64)
+ADMISSION_MAX_WAIT_MS = float(os.getenv("ADMISSION_MAX_WAIT_MS") or 10000)
+
+admission_wait_hist = metrics.histogram(
+    "rag_admission_wait_seconds", "Time spent queued for a stage slot", labels=("stage",))
+admission_rejected_counter = metrics.counter(
+    "rag_admission_rejected_total", "Stage calls shed by admission control", ("stage", "reason"))
+
+
+def _observe_admission_wait(stage, seconds):
+    admission_wait_hist.observe(seconds, stage)
+    trace = metrics.current_trace()
+    if trace is not None and seconds >= 0.001:
+        trace.add(f"queue_{stage}", seconds)
+
+
+admission = AdmissionController(
+    {"embed": MAX_CONCURRENT_EMBED, "search": MAX_CONCURRENT_SEARCH, "generate": MAX_CONCURRENT_GENERATE},
+    max_queue=ADMISSION_QUEUE_SIZE,
+    max_wait_seconds=ADMISSION_MAX_WAIT_MS / 1000.0,
+    on_wait=_observe_admission_wait,
+    on_reject=lambda stage, reason: admission_rejected_counter.inc(stage, reason),
+)
+metrics.add_collector(admission.gauge_lines)
+
+# Mongo client settings (see mongo_pool.py). The pool keeps MONGO_MIN_POOL_SIZE
+# connections open, closes ones idle for MONGO_MAX_IDLE_TIME_MS and makes a checkout
+# wait at most MONGO_WAIT_QUEUE_TIMEOUT_MS; MONGO_SOCKET_TIMEOUT_MS bounds any single
+# network read, so a stalled node cannot hold a worker forever. Wire compression uses
+# the first of MONGO_COMPRESSORS whose module is installed (pymongo[zstd,snappy]).
+# Retrieval reads (vector / keyword / fallback search) go to MONGO_SEARCH_READ_PREFERENCE
+# with a server-side maxTimeMS of MONGO_SEARCH_MAX_TIME_MS, cut to the request deadline.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE") or 50)
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE") or 2)
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS") or 300000)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS") or 5000)
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS") or 10000)
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS") or 30000)
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS") or "zstd,snappy,zlib"
+MONGO_SEARCH_READ_PREFERENCE = os.getenv("MONGO_SEARCH_READ_PREFERENCE") or "secondaryPreferred"
+MONGO_SEARCH_MAX_TIME_MS = int(os.getenv("MONGO_SEARCH_MAX_TIME_MS") or 5000)
+read_preference(MONGO_SEARCH_READ_PREFERENCE)   # fail at startup on a typo
+
+mongo_checkout_hist = metrics.histogram(
+    "rag_mongo_checkout_wait_seconds", "Time waited for a pooled Mongo connection")
+mongo_command_hist = metrics.histogram(
+    "rag_mongo_command_seconds", "Mongo command latency", labels=("command", "outcome"))
+mongo_pool_stats = PoolStatsListener(on_checkout=mongo_checkout_hist.observe)
+mongo_command_stats = CommandStatsListener(
+    on_command=lambda name, seconds, ok: mongo_command_hist.observe(seconds, name, "ok" if ok else "failed"))
+metrics.add_collector(mongo_pool_stats.gauge_lines)
+
+
+def _mongo_client_options():
+    options = dict(
+        tls=True,
+        tlsCAFile=certifi.where(),
+        serverSelectionTimeoutMS=10000,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        event_listeners=[mongo_pool_stats, mongo_command_stats],
+    )
+    compressors = available_compressors(MONGO_COMPRESSORS)
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+
+# Gemini calls go through ResilientGeminiClient (see resilient_gemini.py): up to
+# GEMINI_MAX_ATTEMPTS tries with jittered backoff within the request deadline, a
+# GEMINI_ATTEMPT_TIMEOUT_MS cap per try, a hedged duplicate request once the p95 latency
+# has passed (GEMINI_HEDGE), and a circuit breaker per model that opens after
+# GEMINI_BREAKER_FAILURES consecutive failures for GEMINI_BREAKER_RESET_SECONDS.
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS") or 3)
+GEMINI_ATTEMPT_TIMEOUT_MS = int(os.getenv("GEMINI_ATTEMPT_TIMEOUT_MS") or 30000)
+GEMINI_HEDGE = (os.getenv("GEMINI_HEDGE") or "1").lower() not in ("0", "false", "no")
+GEMINI_HEDGE_MIN_MS = float(os.getenv("GEMINI_HEDGE_MIN_MS") or 300)
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES") or 5)
+GEMINI_BREAKER_RESET_SECONDS = float(os.getenv("GEMINI_BREAKER_RESET_SECONDS") or 30)
+
+gemini_events_counter = metrics.counter(
+    "rag_gemini_events_total", "Gemini calls by outcome (ok, error, retry, hedge, hedge_win, failover, circuit_open)",
+    ("model", "method", "event"))
+
+
+def make_gemini_client(client):
+    """Wraps a genai.Client (or a stand-in with the same surface) in ResilientGeminiClient."""
+    return ResilientGeminiClient(
+        client,
+        fallbacks={RAG_CHAT_MODEL: RAG_FALLBACK_MODEL} if RAG_FALLBACK_MODEL else None,
+        max_attempts=GEMINI_MAX_ATTEMPTS,
+        attempt_timeout=GEMINI_ATTEMPT_TIMEOUT_MS / 1000.0,
+        hedge=GEMINI_HEDGE,
+        min_hedge_delay=GEMINI_HEDGE_MIN_MS / 1000.0,
+        breaker_failures=GEMINI_BREAKER_FAILURES,
+        breaker_reset_seconds=GEMINI_BREAKER_RESET_SECONDS,
+        on_event=lambda event, model, method: gemini_events_counter.inc(model, method, event),
+    )
+
+
+def _search_max_time_ms():
+    """Server-side time budget for one retrieval query: MONGO_SEARCH_MAX_TIME_MS, cut to the request deadline."""
+    return max(1, int(min(MONGO_SEARCH_MAX_TIME_MS, remaining_seconds() * 1000)))
+
+
+def _observe_scores(results):
+    if not metrics.enabled:
+        return
+    for n, result in enumerate(results):
+        retrieval_score_hist.observe(result.get('score'), "top" if n == 0 else "other")
+
+
+def _observe_usage(response):
+    """Prompt / completion token counts from a Gemini response (or the last stream chunk)."""
+    usage = getattr(response, "usage_metadata", None) if metrics.enabled else None
+    if usage is not None:
+        llm_tokens_hist.observe(getattr(usage, "prompt_token_count", None), "prompt")
+        llm_tokens_hist.observe(getattr(usage, "candidates_token_count", None), "completion")
 
 
 # Helper: convert various embedding container types into plain Python list of floats
@@ -78,9 +334,29 @@ def embedding_to_list(vec):
     except Exception:
         return None
 
-# --- 2. Initialize Clients Globally (These variables must be defined!) ---
-try:
-    # MongoDB Client
+# --- 2. Client registry: clients are created on first use, not at import time ---
+# Utility scripts that only need `collection` no longer build a Gemini client, and
+# an initialization failure raises a clear error where the client is used instead
+# of leaving the name undefined. `from ragService import collection` still works
+# (module __getattr__ below). api_app.py calls warm_up() on startup so the first
+# request does not pay for connecting.
+
+# Settings the ingest / backfill scripts cannot run without (a missing MONGODB_URI would
+# otherwise make MongoClient quietly try localhost, and the failure show up much later)
+REQUIRED_SETTINGS = ("MONGODB_URI", "MONGO_DB_NAME", "MONGO_COLLECTION_NAME", "EMBEDDING_MODEL")
+
+
+def require_settings():
+    """Exits with a clear message when required .env settings (or a Gemini API key) are missing."""
+    missing = [name for name in REQUIRED_SETTINGS if not os.getenv(name)]
+    if not (GEMINI_API_KEY or os.getenv("GOOGLE_API_KEY")):
+        missing.append("GEMINI_API_KEY")
+    if missing:
+        raise SystemExit(f"Missing required settings (see .env): {', '.join(missing)}")
+
+
+def _safe_mongo_uri():
+    """MONGODB_URI with the password percent-encoded."""
     safe_uri = MONGODB_URI
     try:
         if MONGODB_URI and '://' in MONGODB_URI and '@' in MONGODB_URI:
@@ -93,18 +369,598 @@ try:
                 safe_uri = f"{scheme}://{user}:{pw_enc}@{after}"
     except Exception:
         safe_uri = MONGODB_URI
+    return safe_uri
+
+
+class ClientRegistry:
+    """
+    Lazily created, process-wide clients: mongo_client, db, collection,
+    chunk_collection, async_mongo_client, async_collection, async_chunk_collection
+    and gemini_client (gemini_client.aio exposes the awaitable models API).
+    The *search_collection variants are the same collections read with
+    MONGO_SEARCH_READ_PREFERENCE, for the retrieval queries.
+
+    Access them as attributes (clients.collection). Creation is thread-safe and
+    happens once; failures are remembered in `errors` for the readiness probe.
+    override() replaces clients with stand-ins (benchmarks).
+    """
+
+    NAMES = ('mongo_client', 'db', 'collection', 'chunk_collection',
+             'async_mongo_client', 'async_collection', 'async_chunk_collection', 'gemini_client',
+             'search_collection', 'chunk_search_collection', 'async_search_collection', 'async_chunk_search_collection')
+    # search collection -> the collection it reads from
+    SEARCH_SOURCES = {
+        'search_collection': 'collection',
+        'chunk_search_collection': 'chunk_collection',
+        'async_search_collection': 'async_collection',
+        'async_chunk_search_collection': 'async_chunk_collection',
+    }
+
+    def __init__(self):
+        self._instances = {}
+        self._lock = threading.RLock()
+        self.errors = {}
+
+    def _create(self, name):
+        if name == 'mongo_client':
+            return MongoClient(_safe_mongo_uri(), **_mongo_client_options())
+        if name == 'db':
+            return self.get('mongo_client')[DB_NAME]
+        if name == 'collection':
+            return self.get('db')[COLLECTION_NAME]
+        if name == 'chunk_collection':
+            # Passage-level chunks (see chunking.py); searched when RETRIEVAL_UNIT is "chunk"
+            return self.get('db')[CHUNK_COLLECTION_NAME]
+        if name == 'async_mongo_client':
+            # Used by the async RAG paths; connects on first await
+            return AsyncMongoClient(_safe_mongo_uri(), **_mongo_client_options())
+        if name == 'async_collection':
+            return self.get('async_mongo_client')[DB_NAME][COLLECTION_NAME]
+        if name == 'async_chunk_collection':
+            return self.get('async_mongo_client')[DB_NAME][CHUNK_COLLECTION_NAME]
+        if name in self.SEARCH_SOURCES:
+            source = self.get(self.SEARCH_SOURCES[name])
+            return source.with_options(read_preference=read_preference(MONGO_SEARCH_READ_PREFERENCE))
+        if name == 'gemini_client':
+            from google.genai import types
+            return make_gemini_client(genai.Client(http_options=types.HttpOptions(timeout=GEMINI_ATTEMPT_TIMEOUT_MS)))
+        raise AttributeError(name)
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if name not in self._instances:
+                try:
+                    self._instances[name] = self._create(name)
+                    self.errors.pop(name, None)
+                except Exception as e:
+                    self.errors[name] = f"{type(e).__name__}: {e}"
+                    raise RuntimeError(f"Could not initialize {name}: {e}") from e
+            return self._instances[name]
+
+    def __getattr__(self, name):
+        if name in ClientRegistry.NAMES:
+            return self.get(name)
+        raise AttributeError(name)
+
+    def override(self, **instances):
+        with self._lock:
+            self._instances.update(instances)
+
+    def initialized(self):
+        return sorted(self._instances)
+
+
+clients = ClientRegistry()
+
+
+def _resilient_gemini_client():
+    if 'gemini_client' not in clients.initialized():
+        return None
+    client = clients.gemini_client
+    return client if isinstance(client, ResilientGeminiClient) else None
+
+
+def gemini_stats():
+    """Breaker states, hedge delays and call outcomes of the Gemini client (None before it is created)."""
+    client = _resilient_gemini_client()
+    return client.stats() if client is not None else None
+
+
+metrics.add_collector(lambda: _resilient_gemini_client().gauge_lines() if _resilient_gemini_client() else [])
+
+
+def __getattr__(name):
+    # Keeps `from ragService import collection, gemini_client` working for scripts
+    if name in ClientRegistry.NAMES:
+        return clients.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ----------------------------------------------------------------------
+# Shared helpers used by both the sync and async RAG paths.
+# ----------------------------------------------------------------------
+
+def _build_vector_search_pipeline(query_vector, k):
+    return [
+        {
+            "$vectorSearch": {
+                "index": VECTOR_INDEX_NAME, 
+                "path": VECTOR_FIELD,        # Uses 'embedding'
+                "queryVector": encode_vector(query_vector, VECTOR_STORAGE),
+                "numCandidates": max(VECTOR_NUM_CANDIDATES, k),
+                "limit": k,                   
+            }
+        },
+        {
+            # KEY CHANGE: Projecting text, title, and program_name
+            "$project": {
+                "_id": 0,
+                "text_chunk": f"${TEXT_FIELD}",
+                "title": "$title",
+                "program_name": "$program_name",
+                # unique_id/updated_at identify the document version for answer_cache
+                "unique_id": "$unique_id",
+                "updated_at": "$updated_at",
+                "score": {"$meta": "vectorSearchScore"}
+            }
+        }
+    ]
+
+
+def _build_chunk_search_pipeline(query_vector, limit):
+    return [
+        {
+            "$vectorSearch": {
+                "index": CHUNK_VECTOR_INDEX_NAME,
+                "path": VECTOR_FIELD,
+                "queryVector": encode_vector(query_vector, VECTOR_STORAGE),
+                "numCandidates": max(VECTOR_NUM_CANDIDATES, limit * 10),
+                "limit": limit,
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "text_chunk": f"${TEXT_FIELD}",
+                **{field: f"${field}" for field in CHUNK_META_FIELDS},
+                "score": {"$meta": "vectorSearchScore"}
+            }
+        }
+    ]
+
+
+def get_local_vector_index():
+    """Returns the process-wide LocalVectorIndex, building it on first use (over chunks when RETRIEVAL_UNIT is "chunk")."""
+    global _local_vector_index
+    if _local_vector_index is None:
+        from local_vector_index import LocalVectorIndex   # imports NumPy only when this backend is used
+        if RETRIEVAL_UNIT == "chunk":
+            _local_vector_index = LocalVectorIndex(
+                clients.chunk_collection, VECTOR_FIELD, TEXT_FIELD, refresh_seconds=LOCAL_INDEX_REFRESH_SECONDS,
+                meta_fields=CHUNK_META_FIELDS,
+            )
+        else:
+            _local_vector_index = LocalVectorIndex(
+                clients.collection, VECTOR_FIELD, TEXT_FIELD, refresh_seconds=LOCAL_INDEX_REFRESH_SECONDS
+            )
+    return _local_vector_index
+
+
+def _vector_search(query_vector, k):
+    """Top-k vector retrieval through the configured RETRIEVER_BACKEND (and RETRIEVAL_UNIT)."""
+    limit = k * CHUNKS_PER_RESULT if RETRIEVAL_UNIT == "chunk" else k
+    if RETRIEVER_BACKEND == "local":
+        index = get_local_vector_index()
+        index.maybe_refresh()
+        results = index.search(query_vector, limit)
+    elif RETRIEVAL_UNIT == "chunk":
+        results = list(clients.chunk_search_collection.aggregate(
+            _build_chunk_search_pipeline(query_vector, limit), maxTimeMS=_search_max_time_ms()))
+    else:
+        results = list(clients.search_collection.aggregate(
+            _build_vector_search_pipeline(query_vector, k), maxTimeMS=_search_max_time_ms()))
+    results = group_chunks_by_program(results, k) if RETRIEVAL_UNIT == "chunk" else results
+    _observe_scores(results)
+    return results
+
+
+async def _vector_search_async(query_vector, k):
+    limit = k * CHUNKS_PER_RESULT if RETRIEVAL_UNIT == "chunk" else k
+    if RETRIEVER_BACKEND == "local":
+        index = get_local_vector_index()
+        if index.refresh_due():
+            # Refresh reads from Mongo with the sync client; keep it off the event loop
+            await asyncio.to_thread(index.refresh)
+        results = index.search(query_vector, limit)
+    elif RETRIEVAL_UNIT == "chunk":
+        cursor = await clients.async_chunk_search_collection.aggregate(
+            _build_chunk_search_pipeline(query_vector, limit), maxTimeMS=_search_max_time_ms())
+        results = await cursor.to_list()
+    else:
+        cursor = await clients.async_search_collection.aggregate(
+            _build_vector_search_pipeline(query_vector, k), maxTimeMS=_search_max_time_ms())
+        results = await cursor.to_list()
+    results = group_chunks_by_program(results, k) if RETRIEVAL_UNIT == "chunk" else results
+    _observe_scores(results)
+    return results
+
+
+def _warn_keyword_search_failed(error):
+    global _keyword_search_warned
+    if not _keyword_search_warned:
+        _keyword_search_warned = True
+        where = f"local BM25 index at '{BM25_INDEX_PATH}'" if KEYWORD_BACKEND == "local" else f"Atlas Search index '{SEARCH_INDEX_NAME}'"
+        print(f"Keyword search unavailable (is the {where} built?): {error}")
+
+
+def get_bm25_index():
+    """Returns the process-wide BM25Index (mapped lazily, or at API startup via load_keyword_index)."""
+    global _bm25_index
+    if _bm25_index is None:
+        from bm25_index import BM25Index   # imports NumPy only when the index is used
+        _bm25_index = BM25Index(BM25_INDEX_PATH)
+    return _bm25_index
+
+
+def load_keyword_index():
+    """Memory-maps the local BM25 index if one has been built; returns True when it is loaded."""
+    return get_bm25_index().load()
+
+
+def _bm25_hits(user_query, limit):
+    index = get_bm25_index()
+    index.maybe_reload()
+    return index.search(user_query, limit)
+
+
+def _hydrate_bm25_hits(hits, docs):
+    """Attaches the stored text to BM25 hits, keeping the BM25 order and score."""
+    by_uid = {doc.get("unique_id"): doc for doc in docs}
+    results = []
+    for hit in hits:
+        doc = by_uid.get(hit["unique_id"])
+        if doc is not None:
+            doc.pop("_id", None)
+            results.append(dict(doc, text_chunk=doc.get(TEXT_FIELD) or doc.get("program_overview"), score=hit["score"]))
+    return results
+
+
+def _bm25_search(user_query, limit):
+    """BM25 top hits with their text ([] when there is no local index or nothing matches)."""
+    hits = _bm25_hits(user_query, limit)
+    if not hits:
+        return []
+    docs = clients.search_collection.find({"unique_id": {"$in": [hit["unique_id"] for hit in hits]}}, TEXT_FALLBACK_PROJECTION,
+                                          max_time_ms=_search_max_time_ms())
+    return _hydrate_bm25_hits(hits, list(docs))
+
+
+async def _bm25_search_async(user_query, limit):
+    hits = _bm25_hits(user_query, limit)
+    if not hits:
+        return []
+    cursor = clients.async_search_collection.find({"unique_id": {"$in": [hit["unique_id"] for hit in hits]}},
+                                                  TEXT_FALLBACK_PROJECTION, max_time_ms=_search_max_time_ms())
+    return _hydrate_bm25_hits(hits, await cursor.to_list())
+
+
+def _keyword_search_pipeline(user_query, limit):
+    return build_keyword_search_pipeline(user_query, limit, SEARCH_INDEX_NAME, TEXT_FIELD, KEYWORD_PROJECTION)
+
+
+def _keyword_search(user_query, limit):
+    try:
+        if KEYWORD_BACKEND == "local":
+            return _bm25_search(user_query, limit)
+        return list(clients.search_collection.aggregate(
+            _keyword_search_pipeline(user_query, limit), maxTimeMS=_search_max_time_ms()))
+    except Exception as e:
+        _warn_keyword_search_failed(e)
+        return []
+
+
+async def _keyword_search_async(user_query, limit):
+    try:
+        if KEYWORD_BACKEND == "local":
+            return await _bm25_search_async(user_query, limit)
+        cursor = await clients.async_search_collection.aggregate(
+            _keyword_search_pipeline(user_query, limit), maxTimeMS=_search_max_time_ms())
+        return await cursor.to_list()
+    except Exception as e:
+        _warn_keyword_search_failed(e)
+        return []
+
+
+def _candidates(query_vector, user_query, n):
+    """Top-n by vector search, or with HYBRID_RETRIEVAL vector + keyword search in parallel fused with RRF."""
+    global _keyword_executor
+    if not HYBRID_RETRIEVAL:
+        return _vector_search(query_vector, n)
+    if _keyword_executor is None:
+        _keyword_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="keyword-search")
+    limit = max(n, HYBRID_CANDIDATES)
+    # Run in a copy of this context so the keyword search sees the request deadline (and trace)
+    keyword_future = _keyword_executor.submit(contextvars.copy_context().run, _keyword_search, user_query, limit)
+    try:
+        vector_results = _vector_search(query_vector, limit)
+    except Exception as e:
+        print(f"Vector search failed, using keyword results only: {e}")
+        vector_results = []
+    return reciprocal_rank_fusion([vector_results, keyword_future.result()], n)
+
+
+async def _candidates_async(query_vector, user_query, n):
+    if not HYBRID_RETRIEVAL:
+        return await _vector_search_async(query_vector, n)
+    limit = max(n, HYBRID_CANDIDATES)
+    vector_results, keyword_results = await asyncio.gather(
+        _vector_search_async(query_vector, limit), _keyword_search_async(user_query, limit), return_exceptions=True
+    )
+    if isinstance(vector_results, BaseException):
+        print(f"Vector search failed, using keyword results only: {vector_results}")
+        vector_results = []
+    return reciprocal_rank_fusion([vector_results, keyword_results], n)
+
+
+def _retrieve_ranked(query_vector, user_query, k):
+    """Top-k documents for the prompt: retrieval, then the optional rerank stage (RERANK_ENABLED)."""
+    # The "vector_search" stage covers the keyword side too when HYBRID_RETRIEVAL runs it concurrently
+    with admission.sync_slot("search"), metrics.timed("vector_search"):
+        candidates = _candidates(query_vector, user_query, max(k, RERANK_CANDIDATES) if RERANK_ENABLED else k)
+    if not RERANK_ENABLED:
+        return candidates
+    # The rerank call is a Gemini generate call: it takes a "generate" slot like the answer does
+    with metrics.timed("rerank"):
+        return reranker.rerank(clients.gemini_client, user_query, candidates, k, admit=lambda: admission.sync_slot("generate"))
+
+
+async def _retrieve_ranked_async(query_vector, user_query, k):
+    async with admission.slot("search"):
+        with metrics.timed("vector_search"):
+            candidates = await _candidates_async(query_vector, user_query, max(k, RERANK_CANDIDATES) if RERANK_ENABLED else k)
+    if not RERANK_ENABLED:
+        return candidates
+    with metrics.timed("rerank"):
+        return await reranker.rerank_async(clients.gemini_client, user_query, candidates, k,
+                                           admit=lambda: admission.slot("generate"))
+
+
+# Projection used by the $text / regex fallback queries
+TEXT_FALLBACK_PROJECTION = {TEXT_FIELD: 1, "title": 1, "program_name": 1, "unique_id": 1, "updated_at": 1}
+
+# $project for keyword ($search) results; same shape as the vector search output
+KEYWORD_PROJECTION = {
+    "_id": 0,
+    "text_chunk": f"${TEXT_FIELD}",
+    "title": "$title",
+    "program_name": "$program_name",
+    "unique_id": "$unique_id",
+    "updated_at": "$updated_at",
+}
+
+# What retrieval hands to generation: the prompt context, the documents it was
+# built from (for answer_cache), the query vector and context_builder's token stats.
+Retrieval = namedtuple('Retrieval', ['context', 'sources', 'query_vector', 'context_stats'])
+
+
+def _build_context(results, text_key='text_chunk'):
+    """
+    Turns retrieved documents into the prompt context through context_builder
+    (score order, near-duplicate removal, CONTEXT_MAX_TOKENS budget).
+    Returns a BuiltContext(context, sources, stats); sources are the documents that made it in.
+    """
+    passages = []
+    for result in results:
+        if text_key == 'text_chunk':
+            chunk_text = result.get('text_chunk')
+        else:
+            chunk_text = result.get(text_key) or result.get('program_overview') or ''
+        passages.append((result, chunk_text))
+    with metrics.timed("prompt_build"):
+        built = context_builder.build(passages)
+    stats = built.stats
+    if stats['passages']:
+        context_tokens_hist.observe(stats['tokens_raw'], "raw")
+        context_tokens_hist.observe(stats['tokens_used'], "used")
+    if CONTEXT_LOG and stats['passages']:
+        print(f"Context: {stats['tokens_used']}/{stats['tokens_raw']} tokens "
+              f"(saved {stats['tokens_saved']}; {stats['paragraphs_deduplicated']} duplicate paragraphs, "
+              f"{stats['passages_truncated']} truncated, {stats['passages_dropped']} dropped)")
+    return built
+
+
+def _build_regex_fallback_filter(user_query):
+    """Builds the tokenized OR-regex filter used when no $text index exists (None if no tokens)."""
+    # extract words of length >=3 to avoid common stopwords
+    tokens = re.findall(r"\w{3,}", user_query)
+    tokens = [t for t in tokens if len(t) >= 3]
+    # limit tokens to avoid huge queries
+    tokens = tokens[:12]
+    or_clauses = []
+    for t in tokens:
+        safe_t = re.escape(t)
+        or_clauses.append({TEXT_FIELD: {"$regex": safe_t, "$options": "i"}})
+        or_clauses.append({"title": {"$regex": safe_t, "$options": "i"}})
+        or_clauses.append({"program_overview": {"$regex": safe_t, "$options": "i"}})
+    return {"$or": or_clauses} if or_clauses else None
+
+
+def _fallback_search(user_query, k):
+    """
+    Keyword fallback used when vector search returns nothing: the local BM25 index,
+    then MongoDB $text (requires a text index), then a tokenized OR-regex scan.
+    """
+    try:
+        text_candidates = _bm25_search(user_query, k)
+        if text_candidates:
+            return text_candidates
+    except Exception as e:
+        print(f"BM25 fallback failed: {e}")
+    try:
+        # Try $text search (will fail if no text index exists)
+        return list(clients.search_collection.find(
+            {"$text": {"$search": user_query}}, TEXT_FALLBACK_PROJECTION, max_time_ms=_search_max_time_ms()).limit(k))
+    except Exception:
+        # Fallback: try a tokenized OR-regex search across common text fields.
+        try:
+            regex_filter = _build_regex_fallback_filter(user_query)
+            if regex_filter:
+                return list(clients.search_collection.find(
+                    regex_filter, TEXT_FALLBACK_PROJECTION, max_time_ms=_search_max_time_ms()).limit(k))
+        except Exception:
+            pass
+    return []
+
+
+async def _fallback_search_async(user_query, k):
+    try:
+        text_candidates = await _bm25_search_async(user_query, k)
+        if text_candidates:
+            return text_candidates
+    except Exception as e:
+        print(f"BM25 fallback failed: {e}")
+    try:
+        return await clients.async_search_collection.find(
+            {"$text": {"$search": user_query}}, TEXT_FALLBACK_PROJECTION, max_time_ms=_search_max_time_ms()).limit(k).to_list()
+    except Exception:
+        try:
+            regex_filter = _build_regex_fallback_filter(user_query)
+            if regex_filter:
+                return await clients.async_search_collection.find(
+                    regex_filter, TEXT_FALLBACK_PROJECTION, max_time_ms=_search_max_time_ms()).limit(k).to_list()
+        except Exception:
+            pass
+    return []
+
+
+def _missing_context_message(num_vectors, sample_dim):
+    """Diagnostic returned when neither vector nor text search produced any context."""
+    if num_vectors > 0:
+        hint = (
+            f"No relevant context found by vector search. "
+            f"I see {num_vectors} documents that have a '{VECTOR_FIELD}' vector field"
+        )
+        if sample_dim:
+            hint += f" (sample embedding dimension: {sample_dim})."
+        hint += (
+            " This usually means an Atlas Search (vector) index is not configured on that field, "
+            f"or the index name is not '{VECTOR_INDEX_NAME}'.\n"
+            "Please create a Vector Search (KNN) index on your Atlas cluster for this collection "
+            f"targeting the field '{VECTOR_FIELD}' (dimensions should match the embedding size)."
+        )
+        return hint
+
+    return "I cannot find any relevant information in the knowledge base to answer that question."
+
+
+def _build_rag_prompt(context, user_query):
+    return f"""
+    You are an AI chatbot specializing in USDA Programs. Your goal is to provide a helpful 
+    and complete answer to the user's question *ONLY* based on the provided CONTEXT. 
+    Reference the 'Program Name' and 'Title' when possible to ground your answer. Do not use outside knowledge.
+
+    **RESPONSE FORMATTING INSTRUCTIONS:**
+    1. Start with a brief, friendly, and concise introduction.
+    2. Use clear **Markdown headings** (e.g., '## Program Details: [Program Name]') to organize the response.
+    3. **CRITICAL: Ensure there is always a BLANK LINE (\n\n) between every bulleted list and every heading** to enforce separation and readability.
+    4. **SYNTHESIZE:** Group all related facts (e.g., all requirements, all loan terms) into a single, concise bullet point *under a single label*. For example:
+        * **Loan Terms:** The maximum loan is 100% of the cost, with a 1.0% interest rate over up to 33 years.
+    5. **Do NOT repeat the same bold label (e.g., 'Purpose:', 'Loan Terms:') on consecutive bullet points.** Only use the bold label once per major topic group.
+    6. Be direct and avoid overly dense paragraphs.
+
+    If the context does not contain the answer, state clearly: 
+    "I cannot find the answer to that specific question in the USDA programs documentation."
+
+    CONTEXT (Retrieved from USDA Programs Documentation):
+    {context}
+
+    USER QUESTION: {user_query}
+
+    RESPONSE:
+    """
+
+
+def _query_embed_config():
+    from google.genai import types # Ensure types is imported for config
+
+    # 1. CRITICAL FIX: Use the correct configuration object for RETRIEVAL_QUERY
+    return types.EmbedContentConfig(
+        task_type=QUERY_TASK_TYPE
+    )
+
+# --- CRITICAL FIX: Enforce Newlines After Generation ---
+# Gemini often omits the blank line before a labeled bullet (e.g. "* **Purpose:**"),
+# so a double newline is inserted before every such label and the answer is stripped.
+# AnswerFormatter applies the same rewrite to a token stream: it holds back only the
+# tail of the buffer that could still grow into a label, so every chunk can be
+# forwarded as soon as it is safe, and the concatenated output is identical to
+# format_answer() on the full text.
+ANSWER_LABEL_PATTERN = re.compile(r'(\* \*\*[\w\s]+:\*\*)')
+# Matches any non-empty prefix of ANSWER_LABEL_PATTERN that runs to the end of the buffer
+_PARTIAL_LABEL_PATTERN = re.compile(r'\*(?: (?:\*(?:\*(?:[\w\s]+(?::(?:\*\*?)?)?)?)?)?)?\Z')
+
+
+class AnswerFormatter:
+    """Incremental version of format_answer() for streamed responses."""
 
-    mongo_client = MongoClient(safe_uri, tls=True, tlsCAFile=certifi.where(), serverSelectionTimeoutMS=10000)
-    db = mongo_client[DB_NAME]
-    collection = db[COLLECTION_NAME]         # <-- DEFINES collection
+    def __init__(self):
+        self._buffer = ""
+        self._pending_ws = ""   # trailing whitespace, only emitted once more text follows
+        self._started = False   # leading whitespace is dropped until the first visible char
 
-    # Gemini Client
-    gemini_client = genai.Client()           # <-- DEFINES gemini_client
+    def _emit(self, text):
+        text = self._pending_ws + text
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                self._pending_ws = ""
+                return ""
+            self._started = True
+        stripped = text.rstrip()
+        self._pending_ws = text[len(stripped):]
+        return stripped
 
-except Exception as e:
-    # Important: In a web service, logging this is better than exiting.
-    print(f"FATAL ERROR: Could not initialize database or Gemini client: {e}")
-    # You might raise an exception or set a global flag here to halt the service.
+    def _safe_cut(self):
+        # Hold back from the first position that could still start a label, but never
+        # split a label that is already complete (its closing '*' also looks like a start).
+        pos = 0
+        while True:
+            partial = _PARTIAL_LABEL_PATTERN.search(self._buffer, pos)
+            cut = partial.start() if partial else len(self._buffer)
+            straddling = None
+            for m in ANSWER_LABEL_PATTERN.finditer(self._buffer):
+                if m.start() >= cut:
+                    break
+                if cut < m.end():
+                    straddling = m
+                    break
+            if straddling is None:
+                return cut
+            pos = straddling.end()
+
+    def feed(self, chunk: str) -> str:
+        """Adds a streamed chunk and returns the formatted text that is safe to send now."""
+        if not chunk:
+            return ""
+        self._buffer += chunk
+        cut = self._safe_cut()
+        ready, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        return self._emit(ANSWER_LABEL_PATTERN.sub(r'\n\n\1', ready))
+
+    def flush(self) -> str:
+        """Returns whatever is still buffered once the stream has ended."""
+        ready, self._buffer = self._buffer, ""
+        out = self._emit(ANSWER_LABEL_PATTERN.sub(r'\n\n\1', ready))
+        self._pending_ws = ""
+        return out
+
+
+def format_answer(text: str) -> str:
+    formatter = AnswerFormatter()
+    return formatter.feed(text) + formatter.flush()
 
 # ----------------------------------------------------------------------
 # The get_rag_answer function starts below this block.
@@ -113,213 +969,351 @@ except Exception as e:
 def get_rag_answer(user_query: str, k: int = 4) -> str:
     """
     Performs the full RAG workflow: embed query, search MongoDB, and generate response.
+
+    Blocking variant of get_rag_answer_async for scripts and worker threads. It takes
+    the same admission stage slots, so it counts against MAX_CONCURRENT_* together
+    with the API, and raises Overloaded when a stage cannot admit it in time.
     """
     if not user_query:
         return "Please provide a question."
         
-    # --- 2.1 Embed the User Query ---
+    # --- 2.1 Embed the User Query (served from query_embedding_cache when possible) ---
     try:
-        from google.genai import types # Ensure types is imported for config
+        query_vector = query_embedding_cache.get(user_query, EMBEDDING_MODEL, QUERY_TASK_TYPE)
+        if query_vector is None:
+            with admission.sync_slot("embed"), metrics.timed("embed"):
+                query_embedding_response = clients.gemini_client.models.embed_content(
+                    model=EMBEDDING_MODEL,
+                    contents=[user_query],
+                    config=_query_embed_config() # Pass the configuration
+                )
 
-        # 1. CRITICAL FIX: Use the correct configuration object for RETRIEVAL_QUERY
-        config = types.EmbedContentConfig(
-            task_type="RETRIEVAL_QUERY"
-        )
+            # 2. Extract the list of floats directly. This resolves the 'cannot encode object' error.
+            # .embeddings[0].values extracts the Python list of floats needed by PyMongo.
+            query_vector = query_embedding_response.embeddings[0].values
 
-        query_embedding_response = gemini_client.models.embed_content(
-            model=EMBEDDING_MODEL,
-            contents=[user_query],
-            config=config # Pass the configuration
-        )
-        
-        # 2. Extract the list of floats directly. This resolves the 'cannot encode object' error.
-        # .embeddings[0].values extracts the Python list of floats needed by PyMongo.
-        query_vector = query_embedding_response.embeddings[0].values
-        
-        if query_vector is None:
-            return "Error: Could not extract embedding vector from Gemini response"
+            if query_vector is None:
+                return "Error: Could not extract embedding vector from Gemini response"
+            query_embedding_cache.put(user_query, query_vector, EMBEDDING_MODEL, QUERY_TASK_TYPE)
 
     except APIError as e:
         return f"Error embedding query with Gemini: {e}"
     # --- The function continues immediately after this block with step 2.2 ---
     
-    # --- 2.2 Perform Vector Search in MongoDB Atlas ---
+    # --- 2.2 Perform Vector Search (MongoDB Atlas or the local index, see RETRIEVER_BACKEND;
+    #         fused with keyword search when HYBRID_RETRIEVAL is on) ---
     try:
-        vector_search_pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": VECTOR_INDEX_NAME, 
-                    "path": VECTOR_FIELD,        # Uses 'embedding'
-                    "queryVector": query_vector,
-                    "numCandidates": 100, 
-                    "limit": k,                   
-                }
-            },
-            {
-                # KEY CHANGE: Projecting text, title, and program_name
-                "$project": {
-                    "_id": 0,
-                    "text_chunk": f"${TEXT_FIELD}",
-                    "title": "$title",
-                    "program_name": "$program_name",
-                    "score": {"$meta": "vectorSearchScore"}
-                }
-            }
-        ]
-
-        results = collection.aggregate(vector_search_pipeline)
+        results = _retrieve_ranked(query_vector, user_query, k)
         
-        # Compile the context from the top K results, including metadata
-        context_chunks = []
-        for result in results:
-            if result.get('text_chunk'):
-                chunk_text = result.get('text_chunk')
-                program_name = result.get('program_name', 'N/A')
-                title = result.get('title', 'N/A')
-                
-                # Format the context to be clear for the LLM
-                formatted_chunk = (
-                    f"--- DOCUMENT START ---\n"
-                    f"Program Name: {program_name}\n"
-                    f"Title: {title}\n"
-                    f"Content: {chunk_text}\n"
-                    f"--- DOCUMENT END ---"
-                )
-                context_chunks.append(formatted_chunk)
-
-        context = "\n\n".join(context_chunks)
+        # Compile the context from the top K results, including metadata (token-budgeted, deduplicated)
+        built = _build_context(results)
+        context, sources = built.context, built.sources
 
         if not context:
             # Attempt a text-based fallback retrieval so the chatbot can still answer
             # when a vector index is not present. First try MongoDB $text (requires a text index),
             # otherwise perform a case-insensitive regex search on the TEXT_FIELD.
-            text_candidates = []
-            try:
-                # Try $text search (will fail if no text index exists)
-                text_candidates = list(collection.find({"$text": {"$search": user_query}}, {TEXT_FIELD: 1, "title": 1, "program_name": 1}).limit(k))
-            except Exception:
-                # Fallback: try a tokenized OR-regex search across common text fields.
-                try:
-                    # extract words of length >=3 to avoid common stopwords
-                    tokens = re.findall(r"\w{3,}", user_query)
-                    tokens = [t for t in tokens if len(t) >= 3]
-                    # limit tokens to avoid huge queries
-                    tokens = tokens[:12]
-                    or_clauses = []
-                    for t in tokens:
-                        safe_t = re.escape(t)
-                        or_clauses.append({TEXT_FIELD: {"$regex": safe_t, "$options": "i"}})
-                        or_clauses.append({"title": {"$regex": safe_t, "$options": "i"}})
-                        or_clauses.append({"program_overview": {"$regex": safe_t, "$options": "i"}})
-
-                    if or_clauses:
-                        text_candidates = list(collection.find({"$or": or_clauses}, {TEXT_FIELD: 1, "title": 1, "program_name": 1}).limit(k))
-                    else:
-                        text_candidates = []
-                except Exception:
-                    text_candidates = []
+            # The local BM25 index (when built) answers from memory-mapped postings, no collection scan.
+            with admission.sync_slot("search"), metrics.timed("fallback_search"):
+                text_candidates = _fallback_search(user_query, k)
 
             if text_candidates:
                 # Build context from textual candidates and continue to LLM generation
-                context_chunks = []
-                for result in text_candidates:
-                    chunk_text = result.get(TEXT_FIELD) or result.get('program_overview') or ''
-                    program_name = result.get('program_name', 'N/A')
-                    title = result.get('title', 'N/A')
-                    formatted_chunk = (
-                        f"--- DOCUMENT START ---\n"
-                        f"Program Name: {program_name}\n"
-                        f"Title: {title}\n"
-                        f"Content: {chunk_text}\n"
-                        f"--- DOCUMENT END ---"
-                    )
-                    context_chunks.append(formatted_chunk)
-
-                context = "\n\n".join(context_chunks)
+                built = _build_context(text_candidates, text_key=TEXT_FIELD)
+                context, sources = built.context, built.sources
             else:
                 # If still no context, provide the diagnostic about missing vector index
                 try:
-                    num_vectors = collection.count_documents({VECTOR_FIELD: {'$exists': True}})
+                    num_vectors = clients.collection.count_documents({VECTOR_FIELD: {'$exists': True}})
                 except Exception:
                     num_vectors = 0
 
                 sample_dim = None
                 if num_vectors > 0:
                     try:
-                        sample = collection.find_one({VECTOR_FIELD: {'$exists': True}})
-                        if sample and isinstance(sample.get(VECTOR_FIELD), list):
-                            sample_dim = len(sample.get(VECTOR_FIELD))
+                        sample = clients.collection.find_one({VECTOR_FIELD: {'$exists': True}})
+                        if sample:
+                            sample_dim = vector_dimensions(sample.get(VECTOR_FIELD))
                     except Exception:
                         sample_dim = None
 
-                if num_vectors > 0:
-                    hint = (
-                        f"No relevant context found by vector search. "
-                        f"I see {num_vectors} documents that have a '{VECTOR_FIELD}' vector field"
-                    )
-                    if sample_dim:
-                        hint += f" (sample embedding dimension: {sample_dim})."
-                    hint += (
-                        " This usually means an Atlas Search (vector) index is not configured on that field, "
-                        f"or the index name is not '{VECTOR_INDEX_NAME}'.\n"
-                        "Please create a Vector Search (KNN) index on your Atlas cluster for this collection "
-                        f"targeting the field '{VECTOR_FIELD}' (dimensions should match the embedding size)."
-                    )
-                    return hint
-
-                return "I cannot find any relevant information in the knowledge base to answer that question."
+                answers_counter.inc("no_context")
+                return _missing_context_message(num_vectors, sample_dim)
             
+    except Overloaded:
+        raise
     except Exception as e:
         return f"Error during MongoDB Vector Search: {e}"
 
-    # --- 2.3 Generate the Final RAG Response (Updated Prompt) ---
-    system_prompt = f"""
-    You are an AI chatbot specializing in USDA Programs. Your goal is to provide a helpful 
-    and complete answer to the user's question *ONLY* based on the provided CONTEXT. 
-    Reference the 'Program Name' and 'Title' when possible to ground your answer. Do not use outside knowledge.
+    # --- 2.3 Reuse an answer generated from the same documents for a paraphrased question ---
+    cached_answer = answer_cache.lookup(query_vector, sources)
+    if cached_answer is not None:
+        answers_counter.inc("answer_cache")
+        return cached_answer
 
-    **RESPONSE FORMATTING INSTRUCTIONS:**
-    1. Start with a brief, friendly, and concise introduction.
-    2. Use clear **Markdown headings** (e.g., '## Program Details: [Program Name]') to organize the response.
-    3. **CRITICAL: Ensure there is always a BLANK LINE (\n\n) between every bulleted list and every heading** to enforce separation and readability.
-    4. **SYNTHESIZE:** Group all related facts (e.g., all requirements, all loan terms) into a single, concise bullet point *under a single label*. For example:
-        * **Loan Terms:** The maximum loan is 100% of the cost, with a 1.0% interest rate over up to 33 years.
-    5. **Do NOT repeat the same bold label (e.g., 'Purpose:', 'Loan Terms:') on consecutive bullet points.** Only use the bold label once per major topic group.
-    6. Be direct and avoid overly dense paragraphs.
+    # --- 2.4 Generate the Final RAG Response (Updated Prompt) ---
+    system_prompt = _build_rag_prompt(context, user_query)
 
-    If the context does not contain the answer, state clearly: 
-    "I cannot find the answer to that specific question in the USDA programs documentation."
+    try:
+        with admission.sync_slot("generate"), metrics.timed("generation"):
+            response = clients.gemini_client.models.generate_content(
+                model=RAG_CHAT_MODEL,
+                contents=system_prompt
+            )
+        final_answer = response.text
+        _observe_usage(response)
 
-    CONTEXT (Retrieved from USDA Programs Documentation):
-    {context}
+        # --- CRITICAL FIX: Enforce Newlines After Generation (see AnswerFormatter) ---
+        with metrics.timed("post_processing"):
+            formatted_answer = format_answer(final_answer)
+            answer_cache.store(query_vector, sources, formatted_answer)
+        answers_counter.inc("generated")
+        return formatted_answer
+    except APIError as e:
+        answers_counter.inc("error")
+        return f"Error generating final response: {e}"
 
-    USER QUESTION: {user_query}
 
-    RESPONSE:
+async def _retrieve_context_async(user_query: str, k: int):
+    """
+    Embeds the query and retrieves context (vector search, then $text/regex fallback).
+    Returns (Retrieval, None) on success or (None, message) when the caller should
+    answer with a message instead of calling the LLM.
     """
+    # --- 2.1 Embed the User Query (served from query_embedding_cache when possible) ---
+    try:
+        query_vector = query_embedding_cache.get(user_query, EMBEDDING_MODEL, QUERY_TASK_TYPE)
+        if query_vector is None:
+            async with admission.slot("embed"):
+                with metrics.timed("embed"):
+                    query_embedding_response = await clients.gemini_client.aio.models.embed_content(
+                        model=EMBEDDING_MODEL,
+                        contents=[user_query],
+                        config=_query_embed_config()
+                    )
+            query_vector = query_embedding_response.embeddings[0].values
+
+            if query_vector is None:
+                return None, "Error: Could not extract embedding vector from Gemini response"
+            query_embedding_cache.put(user_query, query_vector, EMBEDDING_MODEL, QUERY_TASK_TYPE)
+
+    except APIError as e:
+        return None, f"Error embedding query with Gemini: {e}"
 
+    # --- 2.2 Perform Vector Search (MongoDB Atlas or the local index, see RETRIEVER_BACKEND;
+    #         fused with keyword search when HYBRID_RETRIEVAL is on) ---
     try:
-        response = gemini_client.models.generate_content(
-            model=RAG_CHAT_MODEL,
-            contents=system_prompt
-        )
-        final_answer = response.text
+        results = await _retrieve_ranked_async(query_vector, user_query, k)
+        built = _build_context(results)
+        context = built.context
 
-        # --- CRITICAL FIX: Enforce Newlines After Generation ---
-        
-        # Regex to find a new bullet point or labeled section (e.g., "* **Purpose:**")
-        # and replace the start of the line with a double newline + the pattern.
-        # This fixes the issue of the AI not generating the separating blank line.
-        pattern = r'(\* \*\*[\w\s]+:\*\*)' 
-        
-        # Substitute, making sure the replacement is not at the very start of the text
-        formatted_answer = re.sub(pattern, r'\n\n\1', final_answer)
-        
-        # Clean up any initial double newlines that might be generated at the start
-        formatted_answer = formatted_answer.strip()
-        
-        # --- END CRITICAL FIX ---
+        if not context:
+            # Same BM25 -> $text -> regex fallback chain as the sync path
+            async with admission.slot("search"):
+                with metrics.timed("fallback_search"):
+                    text_candidates = await _fallback_search_async(user_query, k)
+
+            if text_candidates:
+                built = _build_context(text_candidates, text_key=TEXT_FIELD)
+                context = built.context
+            else:
+                try:
+                    num_vectors = await clients.async_collection.count_documents({VECTOR_FIELD: {'$exists': True}})
+                except Exception:
+                    num_vectors = 0
+
+                sample_dim = None
+                if num_vectors > 0:
+                    try:
+                        sample = await clients.async_collection.find_one({VECTOR_FIELD: {'$exists': True}})
+                        if sample:
+                            sample_dim = vector_dimensions(sample.get(VECTOR_FIELD))
+                    except Exception:
+                        sample_dim = None
+
+                answers_counter.inc("no_context")
+                return None, _missing_context_message(num_vectors, sample_dim)
+
+    except Overloaded:
+        raise
+    except Exception as e:
+        return None, f"Error during MongoDB Vector Search: {e}"
+
+    return Retrieval(context, built.sources, query_vector, built.stats), None
+
+
+async def get_rag_answer_async(user_query: str, k: int = 4) -> str:
+    """
+    Async variant of get_rag_answer: same workflow and return values, but uses
+    gemini_client.aio and the AsyncMongoClient so no worker thread is held while
+    waiting on Gemini or Atlas. Raises admission.Overloaded when a stage is saturated.
+    """
+    if not user_query:
+        return "Please provide a question."
+
+    retrieval, message = await _retrieve_context_async(user_query, k)
+    if message is not None:
+        return message
+
+    # --- 2.3 Reuse an answer generated from the same documents for a paraphrased question ---
+    cached_answer = answer_cache.lookup(retrieval.query_vector, retrieval.sources)
+    if cached_answer is not None:
+        answers_counter.inc("answer_cache")
+        return cached_answer
+
+    # --- 2.4 Generate the Final RAG Response ---
+    system_prompt = _build_rag_prompt(retrieval.context, user_query)
 
-        return response.text
+    try:
+        async with admission.slot("generate"):
+            with metrics.timed("generation"):
+                response = await clients.gemini_client.aio.models.generate_content(
+                    model=RAG_CHAT_MODEL,
+                    contents=system_prompt
+                )
+        _observe_usage(response)
+        with metrics.timed("post_processing"):
+            formatted_answer = format_answer(response.text)
+            answer_cache.store(retrieval.query_vector, retrieval.sources, formatted_answer)
+        answers_counter.inc("generated")
+        return formatted_answer
     except APIError as e:
-        return f"Error generating final response: {e}"
\ No newline at end of file
+        answers_counter.inc("error")
+        return f"Error generating final response: {e}"
+
+
+async def stream_rag_answer(user_query: str, k: int = 4):
+    """
+    Streaming variant of get_rag_answer_async: an async generator that yields the
+    formatted answer in pieces as Gemini produces them (generate_content_stream).
+    Error and "no context" messages are yielded as a single piece; admission.Overloaded
+    is raised before the first piece when a stage is saturated.
+    """
+    if not user_query:
+        yield "Please provide a question."
+        return
+
+    retrieval, message = await _retrieve_context_async(user_query, k)
+    if message is not None:
+        yield message
+        return
+
+    cached_answer = answer_cache.lookup(retrieval.query_vector, retrieval.sources)
+    if cached_answer is not None:
+        answers_counter.inc("answer_cache")
+        yield cached_answer
+        return
+
+    system_prompt = _build_rag_prompt(retrieval.context, user_query)
+    formatter = AnswerFormatter()
+    streamed = []
+    chunk = None
+
+    # "generation" spans the whole stream (formatting is interleaved with it, so there
+    # is no separate post_processing stage here); time to first token is api_app's.
+    # The generate slot is held until the stream ends.
+    try:
+        async with admission.slot("generate"):
+            generation_started = time.perf_counter()
+            stream = await clients.gemini_client.aio.models.generate_content_stream(
+                model=RAG_CHAT_MODEL,
+                contents=system_prompt
+            )
+            async for chunk in stream:
+                piece = formatter.feed(chunk.text or "")
+                if piece:
+                    streamed.append(piece)
+                    yield piece
+    except APIError as e:
+        answers_counter.inc("error")
+        yield f"Error generating final response: {e}"
+        return
+    metrics.record_stage("generation", time.perf_counter() - generation_started)
+    _observe_usage(chunk)
+
+    tail = formatter.flush()
+    if tail:
+        streamed.append(tail)
+        yield tail
+    answer_cache.store(retrieval.query_vector, retrieval.sources, "".join(streamed))
+    answers_counter.inc("generated")
+
+
+# ----------------------------------------------------------------------
+# Startup warm-up (called from api_app's lifespan hook)
+# ----------------------------------------------------------------------
+
+WARMUP_QUERY = "What USDA Rural Development programs are available?"
+# Steps that must succeed before the service reports ready; the others only warm caches
+WARMUP_REQUIRED_STEPS = ("mongo_ping", "embed")
+
+warmup_state = {
+    "status": "cold",          # cold -> warming -> ready | failed
+    "started_at": None,
+    "finished_at": None,
+    "duration_ms": None,
+    "steps": {},
+}
+
+
+async def _warm_step(name, step):
+    started = time.perf_counter()
+    try:
+        detail = await step()
+        warmup_state["steps"][name] = {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 1)}
+        if detail is not None:
+            warmup_state["steps"][name]["detail"] = detail
+        return detail
+    except Exception as e:
+        warmup_state["steps"][name] = {
+            "ok": False, "ms": round((time.perf_counter() - started) * 1000, 1), "error": f"{type(e).__name__}: {e}",
+        }
+        return None
+
+
+async def warm_up():
+    """
+    Opens the Mongo connection pool, embeds one query (also seeding the embedding
+    cache), touches the vector index (or loads the local one) and maps the BM25
+    index. Progress and per-step timings are kept in warmup_state.
+    """
+    warmup_state.update(status="warming", started_at=time.time(), finished_at=None, duration_ms=None, steps={})
+    started = time.perf_counter()
+
+    async def mongo_ping():
+        await clients.async_mongo_client.admin.command("ping")
+
+    async def embed():
+        response = await clients.gemini_client.aio.models.embed_content(
+            model=EMBEDDING_MODEL, contents=[WARMUP_QUERY], config=_query_embed_config()
+        )
+        vector = response.embeddings[0].values
+        query_embedding_cache.put(WARMUP_QUERY, vector, EMBEDDING_MODEL, QUERY_TASK_TYPE)
+        return {"dimensions": len(vector)}
+
+    await _warm_step("mongo_ping", mongo_ping)
+    embedded = await _warm_step("embed", embed)
+
+    async def vector_index():
+        vector = query_embedding_cache.get(WARMUP_QUERY, EMBEDDING_MODEL, QUERY_TASK_TYPE)
+        results = await _vector_search_async(vector, 1)
+        return {"backend": RETRIEVER_BACKEND, "unit": RETRIEVAL_UNIT, "hits": len(results)}
+
+    if embedded is not None:
+        await _warm_step("vector_index", vector_index)
+
+    async def keyword_index():
+        loaded = await asyncio.to_thread(load_keyword_index)
+        return {"bm25_loaded": loaded}
+
+    await _warm_step("keyword_index", keyword_index)
+
+    ok = all(warmup_state["steps"].get(name, {}).get("ok") for name in WARMUP_REQUIRED_STEPS)
+    warmup_state.update(
+        status="ready" if ok else "failed",
+        finished_at=time.time(),
+        duration_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+    print(f"Warm-up {warmup_state['status']} in {warmup_state['duration_ms']} ms: "
+          + ", ".join(f"{name}={'ok' if step['ok'] else 'FAILED'} ({step['ms']} ms)" for name, step in warmup_state["steps"].items()))
+    return warmup_state
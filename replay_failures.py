@@ -0,0 +1,332 @@
+# Replays the retry queue (work_queue.py) that main.py and the backfill scripts fill
+# through bulk_writer.append_failure(), as one batched job instead of a re-crawl:
+#   scrape       -> the pages are fetched again (HTTP engine, Selenium for JS pages)
+#   embed        -> program items are rebuilt (change_detection.program_document),
+#                   backfill failures re-read their document by _id
+#   embed_chunk  -> the chunk is rebuilt from its stored parent program
+#   upsert       -> the recorded filter/update is written again
+# Everything that needs a vector goes through one BatchEmbedder pass, and the writes
+# are sent as unordered bulk_write batches, --concurrency at a time. Tasks that fail
+# --max-attempts times are dead-lettered; the summary groups what is left by error.
+#
+# Usage: python replay_failures.py [--concurrency 8] [--max-attempts 5] [--kinds embed,upsert]
+#                                  [--limit N] [--all] [--dry-run]
+#        python replay_failures.py --import failed_upserts.jsonl   # queue an old JSONL failure log
+#        python replay_failures.py --summary                       # open tasks grouped by error
+#        python replay_failures.py --requeue-dead
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import bson
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, InvalidDocument
+
+from bulk_writer import sanitize_document
+from change_detection import program_document
+from chunking import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, chunk_program, embedding_text
+from work_queue import DEAD, DONE, WORK_QUEUE_PATH, WorkQueue
+
+WRITE_BATCH_SIZE = 100
+KINDS = ('scrape', 'embed', 'embed_chunk', 'upsert')
+
+
+class Replayer:
+    """
+    One replay run over a list of queued tasks. `run(tasks)` returns
+    {'done', 'retry', 'dead'} counts; every task ends up completed, rescheduled
+    with backoff, or dead-lettered in `queue`.
+    """
+
+    def __init__(self, queue, collection, chunk_collection, embedder, text_field, vector_field,
+                 vector_storage="array", concurrency=8, max_attempts=5, scrape=None,
+                 max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        self.queue = queue
+        self.collection = collection
+        self.chunk_collection = chunk_collection
+        self.embedder = embedder
+        self.text_field = text_field
+        self.vector_field = vector_field
+        self.vector_storage = vector_storage
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max_attempts
+        self.scrape = scrape or self._scrape_pages
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.outcomes = {'done': 0, 'retry': 0, 'dead': 0}
+        self.written_programs = []   # program documents written by this run (chunked afterwards)
+
+    # ------------------------------------------------------------------
+    # Outcomes
+    # ------------------------------------------------------------------
+
+    def _done(self, task):
+        self.queue.complete(task.id)
+        self.outcomes['done'] += 1
+
+    def _failed(self, task, error, retryable=True):
+        status = self.queue.fail(task.id, error, self.max_attempts, retryable=retryable)
+        self.outcomes['dead' if status == DEAD else 'retry'] += 1
+        print(f"{task.kind} {task.label()}: {error}{' (dead-lettered)' if status == DEAD else ''}")
+
+    # ------------------------------------------------------------------
+    # Rebuilding the work
+    # ------------------------------------------------------------------
+
+    def _scrape_pages(self, links):
+        import http_scraper
+        return http_scraper.scrape_programs_hybrid(links, concurrency=self.concurrency * 2)
+
+    def _program_jobs(self, tasks):
+        """(task, doc, text) for scrape tasks (pages fetched again) and item-based embed tasks."""
+        jobs = []
+        scrape_tasks = [t for t in tasks if t.kind == 'scrape']
+        if scrape_tasks:
+            links = [t.payload.get('website') or t.unique_id for t in scrape_tasks]
+            items, failures = self.scrape(links)
+            for task, link, item in zip(scrape_tasks, links, items):
+                if item is None:
+                    self._failed(task, RuntimeError(failures.get(link) or 'page could not be scraped'))
+                    continue
+                doc, text = program_document(item, self.text_field)
+                jobs.append((task, doc, text))
+        for task in tasks:
+            if task.kind == 'embed' and isinstance(task.payload.get('item'), dict):
+                doc, text = program_document(task.payload['item'], self.text_field)
+                jobs.append((task, doc, text))
+        return jobs
+
+    def _vector_jobs(self, tasks):
+        """(task, filter, text) for backfill embed tasks, whose documents are re-read by _id."""
+        tasks = [t for t in tasks if t.kind == 'embed' and not isinstance(t.payload.get('item'), dict)]
+        ids = [(t.payload.get('filter') or {}).get('_id') for t in tasks]
+        found = {}
+        if any(ids):
+            projection = {self.text_field: 1, 'program_overview': 1, 'title': 1}
+            found = {doc['_id']: doc for doc in self.collection.find({'_id': {'$in': [i for i in ids if i]}}, projection)}
+        jobs = []
+        for task, _id in zip(tasks, ids):
+            if _id is None:
+                self._failed(task, ValueError('neither the item nor a filter was recorded'), retryable=False)
+                continue
+            doc = found.get(ObjectId(_id) if isinstance(_id, str) else _id)
+            if doc is None:
+                self._failed(task, LookupError('document no longer exists'), retryable=False)
+                continue
+            text = doc.get(self.text_field) or doc.get('program_overview') or doc.get('title')
+            jobs.append((task, {'_id': doc['_id']}, text))
+        return jobs
+
+    def _chunk_jobs(self, tasks):
+        """(task, chunk, text) for embed_chunk tasks, rebuilt from the stored parent program."""
+        tasks = [t for t in tasks if t.kind == 'embed_chunk']
+        parent_ids = {t.payload.get('parent_id') for t in tasks} - {None}
+        chunks = {}
+        if parent_ids:
+            for parent in self.collection.find({'unique_id': {'$in': list(parent_ids)}}):
+                for chunk in chunk_program(parent, self.text_field, self.max_tokens, self.overlap_tokens):
+                    chunks[chunk['chunk_id']] = chunk
+        jobs = []
+        for task in tasks:
+            chunk = chunks.get(task.unique_id)
+            if chunk is None:
+                # The program is gone or was re-chunked differently since; a new ingest rewrites its chunks
+                self._failed(task, LookupError('chunk no longer produced by its program'), retryable=False)
+                continue
+            jobs.append((task, chunk, embedding_text(chunk, self.text_field)))
+        return jobs
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def _operation(self, task, coll, filter_q, set_doc, upsert, writes):
+        safe_doc = sanitize_document(set_doc, self.vector_field, self.vector_storage)
+        update = {'$set': safe_doc}
+        try:
+            bson.encode(update)
+            bson.encode(filter_q)
+        except (InvalidDocument, TypeError, OverflowError) as e:
+            self._failed(task, e, retryable=False)
+            return False
+        writes.append((task, coll, UpdateOne(filter_q, update, upsert=upsert)))
+        return True
+
+    def _collection_named(self, name):
+        for coll in (self.collection, self.chunk_collection):
+            if coll is not None and (name is None or coll.name == name):
+                return coll
+        return self.collection.database[name]
+
+    @staticmethod
+    def _write_batch(coll, ops):
+        """Sends one unordered bulk_write; returns {op index: error} for the operations that failed."""
+        try:
+            coll.bulk_write(ops, ordered=False)
+            return {}
+        except BulkWriteError as bwe:
+            return {err.get('index', 0): RuntimeError(err.get('errmsg')) for err in (bwe.details or {}).get('writeErrors', [])}
+        except Exception as e:
+            return {n: e for n in range(len(ops))}
+
+    def _write(self, writes):
+        """Bulk-writes (task, collection, op) triples, WRITE_BATCH_SIZE per batch and `concurrency` batches at a time."""
+        by_collection = {}
+        for task, coll, op in writes:
+            by_collection.setdefault(id(coll), (coll, []))[1].append((task, op))
+        batches = []
+        for coll, entries in by_collection.values():
+            for start in range(0, len(entries), WRITE_BATCH_SIZE):
+                batches.append((coll, entries[start:start + WRITE_BATCH_SIZE]))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(lambda b: self._write_batch(b[0], [op for _, op in b[1]]), batches))
+        failed = set()
+        for (coll, entries), errors in zip(batches, results):
+            for n, (task, _) in enumerate(entries):
+                if n in errors:
+                    failed.add(task.id)
+                    self._failed(task, errors[n])
+                else:
+                    self._done(task)
+        return failed
+
+    # ------------------------------------------------------------------
+    # Run
+    # ------------------------------------------------------------------
+
+    def run(self, tasks):
+        for task in tasks:
+            if task.kind not in KINDS:
+                self._failed(task, ValueError(f"unknown task kind {task.kind!r}"), retryable=False)
+        tasks = [t for t in tasks if t.kind in KINDS]
+
+        program_jobs = self._program_jobs(tasks)
+        vector_jobs = self._vector_jobs(tasks)
+        chunk_jobs = self._chunk_jobs(tasks)
+
+        # One batched embedding pass for everything that needs a vector
+        texts = [text for _, _, text in program_jobs + vector_jobs + chunk_jobs]
+        vectors = self.embedder.embed_texts(texts) if texts else []
+        if texts:
+            print(f"Embedded {len(texts) - len(self.embedder.errors)}/{len(texts)} texts in {self.embedder.requests} request(s)")
+
+        writes = []
+        now = datetime.now(timezone.utc)
+        programs = {}
+        for n, (task, target, _) in enumerate(program_jobs + vector_jobs + chunk_jobs):
+            if vectors[n] is None:
+                self._failed(task, RuntimeError(self.embedder.errors.get(n) or 'no embedding returned'))
+                continue
+            if n < len(program_jobs):
+                doc = dict(target, **{self.vector_field: vectors[n], 'updated_at': now})
+                if self._operation(task, self.collection, {'unique_id': doc['unique_id']}, doc, True, writes):
+                    programs[task.id] = doc
+            elif n < len(program_jobs) + len(vector_jobs):
+                self._operation(task, self.collection, target, {self.vector_field: vectors[n], 'updated_at': now},
+                                False, writes)
+            else:
+                chunk = dict(target, **{self.vector_field: vectors[n], 'updated_at': now})
+                self._operation(task, self.chunk_collection, {'chunk_id': chunk['chunk_id']}, chunk, True, writes)
+
+        for task in tasks:
+            if task.kind != 'upsert':
+                continue
+            update = task.payload.get('update')
+            if not update or task.payload.get('filter') is None:
+                # Rejected before it was sent (unencodable document): only a new ingest can rebuild it
+                self._failed(task, ValueError('no update recorded; re-run the ingest for this program'), retryable=False)
+                continue
+            writes.append((task, self._collection_named(task.payload.get('collection')),
+                           UpdateOne(task.payload['filter'], update, upsert=task.payload.get('upsert', True))))
+
+
+        failed = self._write(writes) if writes else set()
+        self.written_programs = [doc for task_id, doc in programs.items() if task_id not in failed]
+        return self.outcomes
+
+
+def print_summary(queue, top=20):
+    counts = queue.counts()
+    for status in ('pending', DEAD, DONE):
+        by_kind = counts.get(status, {})
+        print(f"{status:8} {sum(by_kind.values()):6}  " + ", ".join(f"{k}={n}" for k, n in sorted(by_kind.items())))
+    groups = queue.error_summary()
+    if not groups:
+        return
+    print(f"\n{'count':>6} {'dead':>5}  {'kind':12} {'error_class':22} error")
+    for g in groups[:top]:
+        print(f"{g['count']:6} {g['dead']:5}  {g['kind']:12} {(g['error_class'] or ''):22} {g['signature']}")
+    if len(groups) > top:
+        print(f"... {len(groups) - top} more error group(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay failed scrape / embed / upsert tasks from the retry queue")
+    parser.add_argument("--queue", default=WORK_QUEUE_PATH, help="SQLite queue file (WORK_QUEUE_PATH)")
+    parser.add_argument("--concurrency", type=int, default=8, help="bulk_write batches in flight (and 2x page fetches)")
+    parser.add_argument("--max-attempts", type=int, default=5, help="failed attempts before a task is dead-lettered")
+    parser.add_argument("--kinds", default="", help="comma-separated task kinds to replay (default: all)")
+    parser.add_argument("--limit", type=int, default=0, help="replay at most this many tasks")
+    parser.add_argument("--all", action="store_true", help="ignore the retry backoff of recently failed tasks")
+    parser.add_argument("--import", dest="import_paths", nargs="+", default=[], metavar="JSONL",
+                        help="queue the records of JSONL failure logs (e.g. failed_upserts.jsonl) first")
+    parser.add_argument("--summary", action="store_true", help="only print the queue grouped by error")
+    parser.add_argument("--requeue-dead", action="store_true", help="give dead-lettered tasks a fresh set of attempts")
+    parser.add_argument("--dry-run", action="store_true", help="import / requeue, then print the summary without replaying")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue)
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    for path in args.import_paths:
+        imported, skipped = queue.import_jsonl(path)
+        print(f"Imported {imported} task(s) from {path}" + (f" ({skipped} unreadable line(s) skipped)" if skipped else ""))
+    if args.requeue_dead:
+        print(f"Requeued {queue.requeue_dead(kinds)} dead task(s)")
+    if args.summary or args.dry_run:
+        print_summary(queue)
+        return
+
+    tasks = queue.due(kinds, args.limit or None, ignore_backoff=args.all)
+    if not tasks:
+        print("Nothing to replay")
+        print_summary(queue)
+        return
+
+    import ragService
+    ragService.require_settings()
+    from ragService import (collection, chunk_collection, gemini_client, EMBEDDING_MODEL, TEXT_FIELD, VECTOR_FIELD,
+                            VECTOR_STORAGE, BM25_INDEX_PATH, CHUNK_MAX_TOKENS as max_tokens,
+                            CHUNK_OVERLAP_TOKENS as overlap_tokens)
+    from batch_embedder import BatchEmbedder
+    from chunking import store_program_chunks
+    import bm25_index
+
+    started = time.perf_counter()
+    replayer = Replayer(queue, collection, chunk_collection, BatchEmbedder(gemini_client, EMBEDDING_MODEL),
+                        TEXT_FIELD, VECTOR_FIELD, VECTOR_STORAGE, concurrency=args.concurrency,
+                        max_attempts=args.max_attempts, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+    print(f"Replaying {len(tasks)} task(s)")
+    outcomes = replayer.run(tasks)
+
+    # Same follow-up as main.py for the programs written: keyword index and passage chunks
+    docs = replayer.written_programs
+    if docs:
+        try:
+            bm25_index.update_index(BM25_INDEX_PATH, TEXT_FIELD, docs=docs, collection=collection)
+        except Exception as e:
+            print(f"Could not update the BM25 index: {e}")
+        chunk_embedder = BatchEmbedder(gemini_client, EMBEDDING_MODEL)
+        written, failed = store_program_chunks(docs, chunk_embedder, chunk_collection, args.queue, TEXT_FIELD,
+                                               VECTOR_FIELD, max_tokens=max_tokens, overlap_tokens=overlap_tokens,
+                                               vector_storage=VECTOR_STORAGE)
+        print(f"Chunked {len(docs)} program(s): {written} chunks written, {failed} failed")
+
+    print(f"Replay complete in {time.perf_counter() - started:.1f}s: done={outcomes['done']}, "
+          f"retry={outcomes['retry']}, dead={outcomes['dead']}\n")
+    print_summary(queue)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+
+from google.genai import types
+
+from admission import Deadline, remaining_seconds, use_deadline
+from embedding_cache import normalize_query
+
+# Characters of each candidate shown to the reranking model
+PASSAGE_PREVIEW_CHARS = 700
+
+_JSON_ARRAY = re.compile(r"\[[\d\s,]*\]")
+
+
+def _doc_key(doc):
+    return (str(doc.get('unique_id') or doc.get('title')), str(doc.get('updated_at')))
+
+
+def build_rerank_prompt(query, candidates, k):
+    passages = []
+    for n, doc in enumerate(candidates):
+        text = (doc.get('text_chunk') or doc.get('program_overview') or '')[:PASSAGE_PREVIEW_CHARS]
+        passages.append(f"[{n}] {doc.get('title') or doc.get('program_name') or 'Untitled'}\n{text}")
+    return (
+        "You rank USDA program passages by how well they answer a question.\n"
+        f"QUESTION: {query}\n\n"
+        "PASSAGES:\n" + "\n\n".join(passages) + "\n\n"
+        f"Return ONLY a JSON array with the numbers of the {k} most relevant passages, most relevant first."
+    )
+
+
+def parse_ranking(text, num_candidates):
+    """Candidate indexes from the model's JSON array (invalid / duplicate entries are skipped)."""
+    match = _JSON_ARRAY.search(text or '')
+    if not match:
+        raise ValueError(f"no JSON array in rerank response: {(text or '')[:80]!r}")
+    order = []
+    for value in json.loads(match.group(0)):
+        if isinstance(value, int) and 0 <= value < num_candidates and value not in order:
+            order.append(value)
+    return order
+
+
+class Reranker:
+    """
+    Reorders retrieved candidates with one batched Gemini call per query.
+
+    The call gets `budget_seconds` (less when the request deadline is closer),
+    including any wait for the `admit` slot; when it is slower (or fails) the
+    candidates keep their retrieval (ANN / fused) order and the call is cancelled
+    (async) or cut off by its HTTP timeout (sync). Rankings are cached per
+    (normalized query hash, candidate (unique_id, updated_at) list) with LRU + TTL
+    eviction.
+    """
+
+    def __init__(self, model: str, budget_seconds: float = 0.8, max_entries: int = 1024, ttl_seconds: float = 3600):
+        self.model = model
+        self.budget_seconds = budget_seconds
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._cache = OrderedDict()   # key -> (stored_at, [candidate keys in ranked order])
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hits = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    # ------------------------------------------------------------------
+    # Cache
+    # ------------------------------------------------------------------
+
+    def _cache_key(self, query, candidates):
+        query_hash = hashlib.sha256(normalize_query(query).encode('utf-8')).hexdigest()
+        return (self.model, query_hash, tuple(_doc_key(doc) for doc in candidates))
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl_seconds:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _store(self, key, ranked_keys):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._cache[key] = (time.time(), ranked_keys)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def _apply(candidates, ranked_keys, k):
+        by_key = {_doc_key(doc): doc for doc in candidates}
+        ordered = [by_key[key] for key in ranked_keys if key in by_key]
+        # Anything the model left out keeps its retrieval order after the ranked ones
+        seen = set(ranked_keys)
+        ordered += [doc for doc in candidates if _doc_key(doc) not in seen]
+        return ordered[:k]
+
+    def _ranked_keys(self, text, candidates):
+        return [_doc_key(candidates[i]) for i in parse_ranking(text, len(candidates))]
+
+    # ------------------------------------------------------------------
+    # Rerank
+    # ------------------------------------------------------------------
+
+    def _budget(self):
+        """Seconds this rerank may take; sets them as the deadline of the current (copied) context."""
+        budget = min(self.budget_seconds, remaining_seconds())
+        if budget <= 0:
+            raise TimeoutError("no time left to rerank")
+        use_deadline(Deadline.after(budget))   # caps the slot wait and the client's retries
+        return budget
+
+    def _rank(self, client, query, candidates, k, admit):
+        self._budget()
+        with (admit or nullcontext)():
+            # The sync client cannot be cancelled: bound the HTTP request by what is left instead
+            timeout_ms = max(1, int(remaining_seconds() * 1000))
+            response = client.models.generate_content(
+                model=self.model, contents=build_rerank_prompt(query, candidates, k),
+                config=types.GenerateContentConfig(http_options=types.HttpOptions(timeout=timeout_ms)),
+            )
+        return self._ranked_keys(response.text, candidates)
+
+    async def _rank_async(self, client, query, candidates, k, admit):
+        self._budget()
+        async with (admit or nullcontext)():
+            response = await client.aio.models.generate_content(model=self.model, contents=build_rerank_prompt(query, candidates, k))
+        return self._ranked_keys(response.text, candidates)
+
+    def _failed(self, error, started):
+        if time.monotonic() - started >= self.budget_seconds or isinstance(error, TimeoutError) or remaining_seconds() <= 0:
+            self.timeouts += 1
+        else:
+            self.errors += 1
+            print(f"Rerank failed, keeping retrieval order: {error}")
+
+    def rerank(self, client, query, candidates, k, admit=None):
+        """
+        Top k of candidates after reranking (retrieval order on timeout / error).
+        `admit()` returns the context manager the model call runs in (an admission slot).
+        """
+        if len(candidates) <= 1 or client is None:
+            return candidates[:k]
+        key = self._cache_key(query, candidates)
+        cached = self._cached(key)
+        if cached is not None:
+            return self._apply(candidates, cached, k)
+
+        self.calls += 1
+        started = time.monotonic()
+        try:
+            # A copy of the context, so the rerank budget does not replace the request deadline
+            ranked = contextvars.copy_context().run(self._rank, client, query, candidates, k, admit)
+        except Exception as e:
+            self._failed(e, started)
+            return candidates[:k]
+        self._store(key, ranked)
+        return self._apply(candidates, ranked, k)
+
+    async def rerank_async(self, client, query, candidates, k, admit=None):
+        if len(candidates) <= 1 or client is None:
+            return candidates[:k]
+        key = self._cache_key(query, candidates)
+        cached = self._cached(key)
+        if cached is not None:
+            return self._apply(candidates, cached, k)
+
+        self.calls += 1
+        started = time.monotonic()
+        try:
+            # wait_for runs the call as a task (its own context) and cancels it when the budget runs out
+            ranked = await asyncio.wait_for(self._rank_async(client, query, candidates, k, admit), self.budget_seconds)
+        except Exception as e:
+            self._failed(e, started)
+            return candidates[:k]
+        self._store(key, ranked)
+        return self._apply(candidates, ranked, k)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._cache)
+        lookups = self.hits + self.calls
+        return {
+            "model": self.model,
+            "budget_ms": round(self.budget_seconds * 1000),
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "calls": self.calls,
+            "hits": self.hits,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,476 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+from google.genai.errors import APIError
+
+from admission import remaining_seconds
+
+# Wrapper around genai.Client with the same call surface (client.models.* and
+# client.aio.models.*) that makes each Gemini call:
+#   - retried on 408/429/5xx, timeouts and transport errors, with full-jitter
+#     exponential backoff (or the server's Retry-After), never past the request
+#     deadline (admission.start_deadline) and at most max_attempts times;
+#   - bounded by attempt_timeout per attempt (async; the sync client relies on the
+#     HTTP timeout it was created with);
+#   - hedged (async embed / generate only): if no answer has arrived after the p95
+#     latency of recent calls to that model, a duplicate request is sent and the
+#     first one to finish wins (no hedging until HEDGE_MIN_SAMPLES calls have succeeded);
+#   - guarded by a circuit breaker per model, and failed over to `fallbacks[model]`
+#     when the breaker is open or the model keeps failing.
+# Errors still surface as APIError, so callers keep their `except APIError` handling.
+
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+# Successful calls to a (model, method) needed before its p95 is trusted for hedging
+HEDGE_MIN_SAMPLES = 20
+
+
+def retry_after_seconds(error):
+    """Extracts the server-requested delay from a 429 APIError (header or RetryInfo), if any."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        value = headers.get('retry-after') or headers.get('Retry-After')
+        try:
+            if value is not None:
+                return float(value)
+        except (TypeError, ValueError):
+            pass
+    details = getattr(error, 'details', None)
+    if isinstance(details, dict):
+        for detail in (details.get('error') or {}).get('details') or []:
+            delay = isinstance(detail, dict) and detail.get('retryDelay')
+            if isinstance(delay, str) and delay.endswith('s'):
+                try:
+                    return float(delay[:-1])
+                except ValueError:
+                    pass
+    return None
+
+
+def _api_error(code, status, message):
+    return APIError(code, {"error": {"code": code, "status": status, "message": message}})
+
+
+class CircuitOpenError(APIError):
+    """Raised without calling Gemini while a model's circuit breaker is open."""
+
+    def __init__(self, model, retry_in):
+        super().__init__(503, {"error": {"code": 503, "status": "UNAVAILABLE",
+                                         "message": f"circuit open for {model}; retry in {retry_in:.0f}s"}})
+        self.model = model
+
+
+def is_retryable(error):
+    return isinstance(error, APIError) and (error.code in RETRYABLE_CODES or error.code is None)
+
+
+def _as_api_error(error, model):
+    """Timeouts and transport errors as APIError (504 / 503); APIErrors unchanged; None for anything else."""
+    if isinstance(error, APIError):
+        return error
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return _api_error(504, "DEADLINE_EXCEEDED", f"{model} did not answer in time")
+    if isinstance(error, (ConnectionError, OSError)) or type(error).__module__.startswith(("httpx", "httpcore", "aiohttp")):
+        return _api_error(503, "UNAVAILABLE", f"{model}: {type(error).__name__}: {error}")
+    return None
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures; open -> half_open
+    after `reset_seconds`, letting one probe call through; the probe closes it again
+    or re-opens it. A probe that ends without either (cancelled, or an error that
+    says nothing about the model's health) must call end_probe() so the next call
+    can probe instead.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """False while the call must not go through; "probe" for the half-open probe, else True."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return "probe"
+            return False
+
+    def end_probe(self):
+        """Lets another call probe when this probe ended without record_success() / record_failure()."""
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+
+    def retry_in(self):
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self.failures, "times_opened": self.times_opened}
+
+
+class LatencyWindow:
+    """The last `size` successful call latencies, for the hedge delay."""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, q):
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _SharedState:
+    """Breakers, latency windows and counters shared by a client and its with_options() copies."""
+
+    def __init__(self, breaker_failures, breaker_reset_seconds):
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_seconds = breaker_reset_seconds
+        self.breakers = {}    # model -> CircuitBreaker
+        self.latency = {}     # (model, method) -> LatencyWindow
+        self.counts = {}      # (model, method) -> {event: count}
+        self.lock = threading.Lock()
+
+    def breaker(self, model):
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            with self.lock:
+                breaker = self.breakers.setdefault(
+                    model, CircuitBreaker(self.breaker_failures, self.breaker_reset_seconds))
+        return breaker
+
+    def window(self, model, method):
+        window = self.latency.get((model, method))
+        if window is None:
+            with self.lock:
+                window = self.latency.setdefault((model, method), LatencyWindow())
+        return window
+
+
+class ResilientGeminiClient:
+    """
+    client = ResilientGeminiClient(genai.Client(), fallbacks={"gemini-2.5-flash": "gemini-2.5-flash-lite"})
+    client.models.generate_content(model=..., contents=...)             # sync: retries, breaker, failover
+    await client.aio.models.generate_content(model=..., contents=...)   # + attempt timeout and hedging
+
+    `on_event(event, model, method)` is called for ok / error / retry / hedge / hedge_win /
+    failover / circuit_open (metrics hook). Other attributes are the wrapped client's.
+    """
+
+    def __init__(self, client, fallbacks=None, max_attempts=3, attempt_timeout=30.0, backoff_base=0.25,
+                 backoff_max=4.0, hedge=True, min_hedge_delay=0.3,
+                 breaker_failures=5, breaker_reset_seconds=30.0, on_event=None, _shared=None):
+        self.client = client
+        self.fallbacks = dict(fallbacks or {})
+        self.max_attempts = max(1, max_attempts)
+        self.attempt_timeout = attempt_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.on_event = on_event
+        self._shared = _shared or _SharedState(breaker_failures, breaker_reset_seconds)
+        self.models = _SyncModels(self)
+        self.aio = _AsyncNamespace(self)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def with_options(self, **options):
+        """A copy with some settings changed that shares breakers, latencies and counters."""
+        settings = dict(
+            fallbacks=self.fallbacks, max_attempts=self.max_attempts, attempt_timeout=self.attempt_timeout,
+            backoff_base=self.backoff_base, backoff_max=self.backoff_max, hedge=self.hedge,
+            min_hedge_delay=self.min_hedge_delay,
+            on_event=self.on_event,
+        )
+        settings.update(options)
+        return ResilientGeminiClient(self.client, _shared=self._shared, **settings)
+
+    # --- bookkeeping ----------------------------------------------------
+
+    def _event(self, event, model, method):
+        with self._shared.lock:
+            counts = self._shared.counts.setdefault((model, method), {})
+            counts[event] = counts.get(event, 0) + 1
+        if self.on_event:
+            self.on_event(event, model, method)
+
+    def hedge_delay(self, model, method):
+        """Seconds to wait before hedging: the recent p95 (at least min_hedge_delay), None while unknown."""
+        p95 = self._shared.window(model, method).percentile(0.95)
+        return None if p95 is None else max(self.min_hedge_delay, p95)
+
+    def _candidates(self, model):
+        fallback = self.fallbacks.get(model)
+        return [model, fallback] if fallback and fallback != model else [model]
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+        server_delay = retry_after_seconds(error) if getattr(error, "code", None) == 429 else None
+        return max(delay, server_delay or 0.0)
+
+    def _after_failure(self, error, model, method, attempt, breaker):
+        """Returns the backoff before the next attempt, or re-raises `error` when retrying is pointless."""
+        if not is_retryable(error):
+            if error.code is not None and 400 <= error.code < 500:
+                breaker.record_success()    # the model answered; the request itself was bad
+            self._event("error", model, method)
+            raise error
+        breaker.record_failure()
+        self._event("error", model, method)
+        if attempt >= self.max_attempts or breaker.state == "open":
+            raise error
+        delay = self._backoff(attempt, error)
+        if delay >= remaining_seconds():
+            raise error
+        self._event("retry", model, method)
+        return delay
+
+    def _success(self, model, method, breaker, started):
+        breaker.record_success()
+        self._shared.window(model, method).add(time.perf_counter() - started)
+        self._event("ok", model, method)
+
+    # --- sync -------------------------------------------------------------
+
+    def call(self, method, model, **kwargs):
+        last_error = None
+        for n, candidate in enumerate(self._candidates(model)):
+            breaker = self._shared.breaker(candidate)
+            allowed = breaker.allow()
+            if not allowed:
+                self._event("circuit_open", candidate, method)
+                last_error = CircuitOpenError(candidate, breaker.retry_in())
+                continue
+            if n:
+                self._event("failover", model, method)
+            try:
+                return self._attempts(method, candidate, kwargs, breaker)
+            except APIError as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+            finally:
+                if allowed == "probe":
+                    breaker.end_probe()
+        raise last_error
+
+    def _attempts(self, method, model, kwargs, breaker):
+        fn = getattr(self.client.models, method)
+        for attempt in range(1, self.max_attempts + 1):
+            if remaining_seconds() <= 0:
+                raise _api_error(504, "DEADLINE_EXCEEDED", "request deadline passed before calling Gemini")
+            started = time.perf_counter()
+            try:
+                response = fn(model=model, **kwargs)
+            except Exception as e:
+                error = _as_api_error(e, model)
+                if error is None:
+                    raise
+                time.sleep(self._after_failure(error, model, method, attempt, breaker))
+                continue
+            self._success(model, method, breaker, started)
+            return response
+
+    # --- async ------------------------------------------------------------
+
+    async def call_async(self, method, model, hedge=None, **kwargs):
+        last_error = None
+        for n, candidate in enumerate(self._candidates(model)):
+            breaker = self._shared.breaker(candidate)
+            allowed = breaker.allow()
+            if not allowed:
+                self._event("circuit_open", candidate, method)
+                last_error = CircuitOpenError(candidate, breaker.retry_in())
+                continue
+            if n:
+                self._event("failover", model, method)
+            try:
+                return await self._attempts_async(method, candidate, kwargs, breaker,
+                                                  self.hedge if hedge is None else hedge)
+            except APIError as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+            finally:
+                # Cancellation, unmapped errors and the deadline check leave the breaker as it was
+                if allowed == "probe":
+                    breaker.end_probe()
+        raise last_error
+
+    async def _attempts_async(self, method, model, kwargs, breaker, hedge):
+        if method == "generate_content_stream":
+            call = lambda: _open_stream(self.client.aio.models.generate_content_stream, model, kwargs)   # noqa: E731
+        else:
+            fn = getattr(self.client.aio.models, method)
+            call = lambda: fn(model=model, **kwargs)   # noqa: E731
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = remaining_seconds()
+            if remaining <= 0:
+                raise _api_error(504, "DEADLINE_EXCEEDED", "request deadline passed before calling Gemini")
+            timeout = min(self.attempt_timeout, remaining)
+            started = time.perf_counter()
+            try:
+                hedge_delay = self.hedge_delay(model, method) if hedge else None
+                if hedge_delay is not None:
+                    response = await self._hedged(call, model, method, hedge_delay, timeout)
+                else:
+                    response = await asyncio.wait_for(call(), timeout)
+            except Exception as e:
+                error = _as_api_error(e, model)
+                if error is None:
+                    raise
+                await asyncio.sleep(self._after_failure(error, model, method, attempt, breaker))
+                continue
+            self._success(model, method, breaker, started)
+            return response
+
+    async def _hedged(self, call, model, method, delay, timeout):
+        """Runs call(); if it has not finished after `delay`, races a second call() against it."""
+        started = time.monotonic()
+        first = asyncio.ensure_future(call())
+        done, _ = await asyncio.wait({first}, timeout=min(delay, timeout))
+        if done:
+            return first.result()
+        self._event("hedge", model, method)
+        second = asyncio.ensure_future(call())
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                left = timeout - (time.monotonic() - started)
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, left), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._event("hedge_win", model, method)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (first, second):
+                if task.done() and not task.cancelled():
+                    task.exception()   # mark the loser's error as retrieved
+                task.cancel()
+
+    # --- stats ------------------------------------------------------------
+
+    def stats(self):
+        shared = self._shared
+        with shared.lock:
+            counts = {f"{model}:{method}": dict(c) for (model, method), c in shared.counts.items()}
+        return {
+            "breakers": {model: b.stats() for model, b in shared.breakers.items()},
+            "hedge_delay_ms": {
+                f"{model}:{method}": None if delay is None else round(delay * 1000, 1)
+                for (model, method), delay in ((key, self.hedge_delay(*key)) for key in list(shared.latency))
+            },
+            "calls": counts,
+            "fallbacks": self.fallbacks,
+        }
+
+    def gauge_lines(self):
+        lines = ["# HELP rag_gemini_circuit_open 1 while a model's circuit breaker is open",
+                 "# TYPE rag_gemini_circuit_open gauge"]
+        for model, breaker in self._shared.breakers.items():
+            lines.append(f'rag_gemini_circuit_open{{model="{model}"}} {int(breaker.state == "open")}')
+        return lines
+
+
+async def _open_stream(fn, model, kwargs):
+    """Opens a stream and waits for its first chunk, so a stalled stream counts as a failed attempt."""
+    stream = await fn(model=model, **kwargs)
+    iterator = stream.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        return _replay(None, iterator)
+    return _replay(first, iterator)
+
+
+async def _replay(first, iterator):
+    if first is None:
+        return
+    yield first
+    async for chunk in iterator:
+        yield chunk
+
+
+class _SyncModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def embed_content(self, model, **kwargs):
+        return self._owner.call("embed_content", model, **kwargs)
+
+    def generate_content(self, model, **kwargs):
+        return self._owner.call("generate_content", model, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._owner.client.models, name)
+
+
+class _AsyncModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def embed_content(self, model, **kwargs):
+        return await self._owner.call_async("embed_content", model, **kwargs)
+
+    async def generate_content(self, model, **kwargs):
+        return await self._owner.call_async("generate_content", model, **kwargs)
+
+    async def generate_content_stream(self, model, **kwargs):
+        # Not hedged: a duplicate stream would generate (and bill) the whole answer twice
+        return await self._owner.call_async("generate_content_stream", model, hedge=False, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._owner.client.aio.models, name)
+
+
+class _AsyncNamespace:
+    def __init__(self, owner):
+        self.models = _AsyncModels(owner)
+        self._owner = owner
+
+    def __getattr__(self, name):
+        return getattr(self._owner.client.aio, name)
@@ -1,4 +1,4 @@
-from ragService import collection, EMBEDDING_MODEL, VECTOR_FIELD, VECTOR_INDEX_NAME, gemini_client, embedding_to_list
+from ragService import collection, EMBEDDING_MODEL, VECTOR_FIELD, VECTOR_INDEX_NAME, VECTOR_NUM_CANDIDATES, gemini_client, embedding_to_list
 
 query = "How do I apply for a farm loan?"
 print('Query:', query)
@@ -25,7 +25,7 @@ pipeline = [
             "index": VECTOR_INDEX_NAME,
             "path": VECTOR_FIELD,
             "queryVector": vec,
-            "numCandidates": 50,
+            "numCandidates": VECTOR_NUM_CANDIDATES,
             "limit": 5
         }
     },
@@ -1,49 +1,61 @@
-def scrape_current_page(USDA, By, link):
+# CSS selectors for every field of a program page. The fragments (#overview, #to-apply, ...)
+# are sections of the same document, so all of them can be read from a single page load.
+PROGRAM_STATUS_SELECTOR = "#block-usda-rd-uswds-2-content--2 > article > div.grid-row.bg-base-lighter.margin-top-2.padding-105.program-heading > div.desktop---grid-col-3.tablet---grid-col-4.grid-col-12.padding-05 > div"
+PROGRAM_DEADLINE_SELECTOR = "#block-usda-rd-uswds-2-content--2 > article > div.grid-row.bg-base-lighter.margin-top-2.padding-105.program-heading > div.desktop---grid-col-9.tablet---grid-col-8.grid-col-12.padding-05 > div"
+
+# field name -> (CSS selector, attribute to read or None for the element text)
+FIELD_SELECTORS = {
+	'title': ("#main-content > div > div > div > h1", None),
+	'program_status': (PROGRAM_STATUS_SELECTOR, None),
+	'program_deadline': (PROGRAM_DEADLINE_SELECTOR, None),
+	'program_overview': ("#overview > div > div", None),
+	'program_apply': ("#to-apply", None),
+	'program_requirements': ("#other-requirements > div > div > div > div > div > div > p", None),
+	'program_contact': ("#contact > div > div > div > div > div > div > p:nth-child(5)", None),
+	'program_contact_link': ("#contact > div > div > div > div > div > div > p:nth-child(5) a", 'href'),
+	'program_events': ("#events", None),
+}
+
+# Fields that the original scraper read after navigating to their fragment
+FIELD_FRAGMENTS = {
+	'program_overview': "#overview",
+	'program_apply': "#to-apply",
+	'program_requirements': "#other-requirements",
+	'program_contact': "#contact",
+	'program_contact_link': "#contact",
+	'program_events': "#events",
+}
+
+
+def _read_field(USDA, By, selector, attribute):
+	element = USDA.find_element(By.CSS_SELECTOR, selector)
+	if attribute:
+		return element.get_attribute(attribute)
+	text = element.text
+	if not text:
+		# Sections hidden behind a collapsed tab report no visible .text; fall back to the DOM text
+		content = element.get_attribute('textContent')
+		if content:
+			text = "\n".join(line.strip() for line in content.splitlines() if line.strip())
+	return text
+
+
+def scrape_current_page(USDA, By, link, single_load=True):
+	"""
+	Extracts all program fields from the page that is currently loaded for `link`.
+
+	With single_load=True (default) every field is read from that one page load.
+	single_load=False keeps the old behaviour of navigating to each section's
+	#fragment before reading it.
+	"""
 	fields = {}
-	try:
-		fields['title'] = USDA.find_element(By.CSS_SELECTOR, "#main-content > div > div > div > h1").text
-	except Exception:
-		fields['title'] = None
-	try:
-		fields['website'] = link
-	except Exception:
-		fields['website'] = None
-	try:
-		fields['program_status'] = USDA.find_element(By.CSS_SELECTOR, "#block-usda-rd-uswds-2-content--2 > article > div.grid-row.bg-base-lighter.margin-top-2.padding-105.program-heading > div.desktop---grid-col-3.tablet---grid-col-4.grid-col-12.padding-05 > div").text
-	except Exception:
-		fields['program_status'] = None
-	try:
-		fields['program_deadline'] = USDA.find_element(By.CSS_SELECTOR, "#block-usda-rd-uswds-2-content--2 > article > div.grid-row.bg-base-lighter.margin-top-2.padding-105.program-heading > div.desktop---grid-col-9.tablet---grid-col-8.grid-col-12.padding-05 > div").text
-	except Exception:
-		fields['program_deadline'] = None
-	try:
-		USDA.navigate_to((link+"#overview"))
-		fields['program_overview'] = USDA.find_element(By.CSS_SELECTOR, "#overview > div > div").text
-	except Exception:
-		fields['program_overview'] = None
-	try:
-		USDA.navigate_to((link+"#to-apply"))
-		fields['program_apply'] = USDA.find_element(By.CSS_SELECTOR, "#to-apply").text
-	except Exception:
-		fields['program_apply'] = None
-	try:
-		USDA.navigate_to((link+"#other-requirements"))
-		fields['program_requirements'] = USDA.find_element(By.CSS_SELECTOR, "#other-requirements > div > div > div > div > div > div > p").text
-	except Exception:
-		fields['program_requirements'] = None
-	try:
-		USDA.navigate_to((link+"#contact"))
-		fields['program_contact'] = USDA.find_element(By.CSS_SELECTOR, "#contact > div > div > div > div > div > div > p:nth-child(5)").text
-	except Exception:
-		fields['program_contact'] = None
-	try:
-		USDA.navigate_to((link+"#contact"))
-		fields['program_contact_link'] = USDA.find_element(By.CSS_SELECTOR, "#contact > div > div > div > div > div > div > p:nth-child(5) a").get_attribute('href')
-	except Exception:
-		fields['program_contact_link'] = None
-	try:
-		USDA.navigate_to((link+"#events"))
-		fields['program_events'] = USDA.find_element(By.CSS_SELECTOR, "#events").text
-	except Exception:
-		fields['program_events'] = None
-	return fields
\ No newline at end of file
+	for name, (selector, attribute) in FIELD_SELECTORS.items():
+		try:
+			if not single_load and name in FIELD_FRAGMENTS:
+				USDA.navigate_to((link+FIELD_FRAGMENTS[name]))
+			fields[name] = _read_field(USDA, By, selector, attribute)
+		except Exception:
+			fields[name] = None
+		if name == 'title':
+			fields['website'] = link
+	return fields
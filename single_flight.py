@@ -0,0 +1,222 @@
+import asyncio
+import contextvars
+import time
+
+from admission import Deadline, Overloaded, current_deadline, use_deadline
+from embedding_cache import normalize_query
+
+# Single-flight request coalescing: concurrent requests for the same normalized
+# question share one pipeline run. The run executes in its own task, so a client
+# that disconnects (the leader included) does not cancel it for the others; once
+# it finishes the key is released and the next request starts a fresh run (by then
+# the answer cache usually serves it).
+#
+# The shared run does not belong to any one request: it starts in an empty
+# contextvars.Context with its own admission Deadline (the latest deadline of the
+# requests waiting on it, or `deadline_seconds`) and its own RequestTrace. Each
+# request still gives up at its own deadline, the leader's trace receives the shared
+# run's stage timings, and followers record their wait as a "coalesced" stage.
+
+
+def _deadline_at(default_seconds):
+    """The caller's own deadline instant, else `default_seconds` from now (None: none)."""
+    deadline = current_deadline()
+    if deadline is not None:
+        return deadline.at
+    return Deadline.after(default_seconds).at
+
+
+def _start_shared(factory, deadline, metrics):
+    """Runs `factory()` in a task with a fresh context; returns (task, the run's RequestTrace or None)."""
+    context = contextvars.Context()
+    context.run(use_deadline, deadline)
+    trace = context.run(metrics.start_request) if metrics is not None else None
+    task = asyncio.get_running_loop().create_task(context.run(factory), context=context)
+    return task, trace
+
+
+def _deadline_exceeded(retry_after=1):
+    return Overloaded("request deadline exceeded waiting for a coalesced run", retry_after,
+                      stage="coalesced", reason="deadline")
+
+
+def _record_wait(metrics, shared_trace, follower, started):
+    """Leader: the shared run's stage timings; follower: its wait as the "coalesced" stage."""
+    if metrics is None:
+        return
+    if follower:
+        metrics.record_stage("coalesced", time.perf_counter() - started)
+        return
+    trace = metrics.current_trace()
+    if trace is not None and shared_trace is not None:
+        trace.stages.extend(shared_trace.stages)
+
+
+class SingleFlight:
+    """
+    pending, coalesced = flight.join(question, lambda: get_rag_answer_async(question))
+    answer = await pending
+
+    The first caller for a key starts `factory()` in a task; callers arriving while
+    it runs await the same task and get the same result (or exception), each until
+    its own deadline (Overloaded after that). `metrics` is the MetricsRegistry whose
+    request traces receive the timings (optional).
+    """
+
+    def __init__(self, deadline_seconds=None, metrics=None):
+        self.deadline_seconds = deadline_seconds
+        self.metrics = metrics
+        self._inflight = {}   # key -> (asyncio.Task, Deadline, RequestTrace)
+        self.leaders = 0
+        self.followers = 0
+        self.timed_out = 0
+
+    def join(self, query, factory):
+        """Returns (awaitable result, is_follower)."""
+        key = normalize_query(query)
+        at = _deadline_at(self.deadline_seconds)
+        entry = self._inflight.get(key)
+        follower = entry is not None
+        if follower:
+            self.followers += 1
+            entry[1].extend(at)
+        else:
+            self.leaders += 1
+            deadline = Deadline(at)
+            task, trace = _start_shared(factory, deadline, self.metrics)
+            entry = self._inflight[key] = (task, deadline, trace)
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return self._wait(entry, at, follower), follower
+
+    async def _wait(self, entry, at, follower):
+        task, _, shared_trace = entry
+        started = time.perf_counter()
+        timeout = None if at is None else at - time.monotonic()
+        try:
+            if timeout is not None and timeout <= 0:
+                raise asyncio.TimeoutError
+            # shield: a caller that gives up or is cancelled does not cancel the shared run
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise _deadline_exceeded() from None
+        finally:
+            _record_wait(self.metrics, shared_trace, follower, started)
+
+    def stats(self):
+        calls = self.leaders + self.followers
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "timed_out": self.timed_out,
+            "coalesced_rate": (self.followers / calls) if calls else 0.0,
+        }
+
+
+class _Broadcast:
+    """Pieces of one streamed answer, replayed to every subscriber from the start."""
+
+    def __init__(self):
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Condition()
+
+    async def pump(self, stream):
+        try:
+            async for piece in stream:
+                async with self._changed:
+                    self.pieces.append(piece)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            async with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    async def subscribe(self, first_piece_timeout=None):
+        """Yields every piece; raises TimeoutError if nothing arrives within first_piece_timeout."""
+        sent = 0
+        while True:
+            async with self._changed:
+                ready = self._changed.wait_for(lambda: self.done or len(self.pieces) > sent)
+                if sent == 0 and first_piece_timeout is not None:
+                    await asyncio.wait_for(ready, max(0.0, first_piece_timeout))
+                else:
+                    await ready
+                pieces, done = self.pieces[sent:], self.done
+            for piece in pieces:
+                yield piece
+            sent += len(pieces)
+            if done and sent == len(self.pieces):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class StreamSingleFlight:
+    """
+    Streaming variant: the leader's token stream is consumed by one background task
+    and fanned out; followers receive the pieces produced so far, then the rest live.
+
+        pieces, coalesced = flight.stream(question, lambda: stream_rag_answer(question))
+        async for piece in pieces:
+            ...
+
+    As for /chat, a subscriber's deadline bounds its wait for the first piece (the
+    stage queues are all passed by then); the stream itself is not cut short.
+    """
+
+    def __init__(self, deadline_seconds=None, metrics=None):
+        self.deadline_seconds = deadline_seconds
+        self.metrics = metrics
+        self._inflight = {}   # key -> (_Broadcast, Deadline, RequestTrace)
+        self.leaders = 0
+        self.followers = 0
+        self.timed_out = 0
+
+    def stream(self, query, factory):
+        """Returns (async iterator of pieces, is_follower)."""
+        key = normalize_query(query)
+        at = _deadline_at(self.deadline_seconds)
+        entry = self._inflight.get(key)
+        follower = entry is not None
+        if follower:
+            self.followers += 1
+            entry[1].extend(at)
+        else:
+            self.leaders += 1
+            broadcast, deadline = _Broadcast(), Deadline(at)
+            task, trace = _start_shared(lambda: broadcast.pump(factory()), deadline, self.metrics)
+            entry = self._inflight[key] = (broadcast, deadline, trace)
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return self._subscribe(entry, at, follower), follower
+
+    async def _subscribe(self, entry, at, follower):
+        broadcast, _, shared_trace = entry
+        started = time.perf_counter()
+        first = True
+        try:
+            async for piece in broadcast.subscribe(None if at is None else at - time.monotonic()):
+                if first and follower:
+                    _record_wait(self.metrics, shared_trace, follower, started)
+                first = False
+                yield piece
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise _deadline_exceeded() from None
+        finally:
+            if first or not follower:
+                _record_wait(self.metrics, shared_trace, follower, started)
+
+    def stats(self):
+        calls = self.leaders + self.followers
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "timed_out": self.timed_out,
+            "coalesced_rate": (self.followers / calls) if calls else 0.0,
+        }
@@ -0,0 +1,62 @@
+from answer_cache import SemanticAnswerCache, source_key
+
+DOCS = [{"unique_id": "a", "updated_at": "2025-01-01"}, {"unique_id": "b", "updated_at": "2025-01-02"}]
+
+
+def test_source_key_is_order_independent_and_versioned():
+    assert source_key(DOCS) == source_key(list(reversed(DOCS)))
+    assert source_key(DOCS) != source_key([DOCS[0], dict(DOCS[1], updated_at="2025-02-01")])
+    assert source_key([{"title": "no unique_id"}]) is None
+    assert source_key([]) is None
+
+
+def test_hit_at_or_above_threshold():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store([1.0, 0.0], DOCS, "answer")
+
+    # Scale does not matter (cosine), and a near-identical paraphrase still hits
+    assert cache.lookup([2.0, 0.0], DOCS) == "answer"
+    assert cache.lookup([1.0, 0.2], DOCS) == "answer"        # cos ~0.981
+    assert cache.lookup([1.0, 0.5], DOCS) is None            # cos ~0.894
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_best_match_wins():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store([1.0, 0.0], DOCS, "first")
+    cache.store([1.0, 0.3], DOCS, "second")
+
+    assert cache.lookup([1.0, 0.31], DOCS) == "second"
+
+
+def test_miss_when_sources_differ():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store([1.0, 0.0], DOCS, "answer")
+
+    assert cache.lookup([1.0, 0.0], DOCS[:1]) is None
+    # A re-upserted document gets a new updated_at, so the old answer no longer matches
+    assert cache.lookup([1.0, 0.0], [DOCS[0], dict(DOCS[1], updated_at="2025-03-01")]) is None
+    assert cache.lookup([1.0, 0.0], list(reversed(DOCS))) == "answer"
+
+
+def test_invalidate_documents():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store([1.0, 0.0], DOCS, "from a and b")
+    cache.store([0.0, 1.0], [{"unique_id": "c", "updated_at": "x"}], "from c")
+
+    cache.invalidate_documents(["b"])
+
+    assert cache.lookup([1.0, 0.0], DOCS) is None
+    assert cache.lookup([0.0, 1.0], [{"unique_id": "c", "updated_at": "x"}]) == "from c"
+    assert cache.stats()["invalidations"] == 1
+    assert cache.stats()["entries"] == 1
+
+
+def test_unstorable_inputs_are_ignored():
+    cache = SemanticAnswerCache()
+    cache.store([0.0, 0.0], DOCS, "zero vector")
+    cache.store([1.0, 0.0], [{"title": "no id"}], "no source key")
+    cache.store([1.0, 0.0], DOCS, "")
+
+    assert cache.stats()["entries"] == 0
+    assert cache.lookup(None, DOCS) is None
@@ -0,0 +1,86 @@
+import os
+
+from bm25_index import BM25Index, rebuild_index, update_index
+
+PROGRAMS = [
+    {"unique_id": "broadband", "title": "ReConnect Broadband Program", "program_overview": "Loans and grants for rural broadband internet."},
+    {"unique_id": "water", "title": "Water and Waste Disposal Loans", "program_overview": "Funding for rural drinking water systems."},
+    {"unique_id": "housing", "title": "Single Family Housing Direct Loans", "program_overview": "Home loans for low income rural families."},
+]
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        return [dict(doc) for doc in self.docs]
+
+
+def _ids(hits):
+    return [hit["unique_id"] for hit in hits]
+
+
+def test_update_index_builds_from_collection_first(tmp_path):
+    path = str(tmp_path / "bm25")
+    generation = update_index(path, "text", docs=[], collection=FakeCollection(PROGRAMS))
+
+    index = BM25Index(path)
+    assert generation == 1 and index.load()
+    assert len(index) == 3
+    # Title hits are weighted above overview hits
+    assert _ids(index.search("broadband"))[0] == "broadband"
+    assert index.search("nonexistentterm") == []
+
+
+def test_incremental_upsert_and_remove(tmp_path):
+    path = str(tmp_path / "bm25")
+    rebuild_index(path, "text", FakeCollection(PROGRAMS))
+
+    changed = dict(PROGRAMS[1], title="Water and Environmental Programs", program_overview="Wastewater and stormwater.")
+    added = {"unique_id": "energy", "title": "Rural Energy for America Program", "program_overview": "Solar grants."}
+    generation = update_index(path, "text", docs=[changed, added], removed=["housing"])
+
+    index = BM25Index(path)
+    index.load()
+    assert generation == 2 and index.generation == 2
+    assert len(index) == 3
+    assert index.search("housing") == []
+    assert _ids(index.search("solar")) == ["energy"]
+    assert _ids(index.search("stormwater")) == ["water"]
+    # The old text of a re-upserted document is gone
+    assert index.search("drinking") == []
+    assert _ids(index.search("broadband")) == ["broadband"]
+
+
+def test_reader_switches_generations_on_reload(tmp_path):
+    path = str(tmp_path / "bm25")
+    rebuild_index(path, "text", FakeCollection(PROGRAMS))
+    index = BM25Index(path, reload_seconds=0)
+    index.load()
+    assert index.search("solar") == []
+
+    update_index(path, "text", docs=[{"unique_id": "energy", "title": "Solar Energy Grants"}])
+
+    # Still on the mapped generation until maybe_reload() sees the new manifest
+    assert index.generation == 1 and index.search("solar") == []
+    index.maybe_reload()
+    assert index.generation == 2
+    assert _ids(index.search("solar")) == ["energy"]
+
+
+def test_old_generations_are_cleaned_up(tmp_path):
+    path = str(tmp_path / "bm25")
+    rebuild_index(path, "text", FakeCollection(PROGRAMS))
+    for n in range(3):
+        update_index(path, "text", docs=[{"unique_id": f"extra{n}", "title": f"Extra {n}"}])
+
+    generations = {name.split(".")[1] for name in os.listdir(path) if name.startswith("postings.")}
+    # The current generation and the one before it (for readers that have not reloaded yet)
+    assert generations == {"3", "4"}
+
+
+def test_commit_without_changes_keeps_generation(tmp_path):
+    path = str(tmp_path / "bm25")
+    assert rebuild_index(path, "text", FakeCollection(PROGRAMS)) == 1
+    assert update_index(path, "text", docs=[], removed=["not-indexed"]) == 1
@@ -0,0 +1,94 @@
+from pymongo.errors import BulkWriteError
+
+import bulk_writer
+from bulk_writer import BulkUpsertWriter
+
+
+class FakeResult:
+    def __init__(self, n):
+        self.bulk_api_result = {"nUpserted": n, "nModified": 0, "nMatched": 0}
+
+
+class FakeCollection:
+    name = "programs"
+
+    def __init__(self):
+        self.batches = []
+
+    def bulk_write(self, ops, ordered=True):
+        self.batches.append(ops)
+        return FakeResult(len(ops))
+
+
+class RejectingCollection(FakeCollection):
+    """Rejects the operation at `bad_index` of each batch, as the server does with ordered=False."""
+
+    def __init__(self, bad_index):
+        super().__init__()
+        self.bad_index = bad_index
+
+    def bulk_write(self, ops, ordered=True):
+        self.batches.append(ops)
+        raise BulkWriteError({"nUpserted": len(ops) - 1, "nModified": 0, "nMatched": 0,
+                              "writeErrors": [{"index": self.bad_index, "code": 11000, "errmsg": "E11000 duplicate key"}]})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_writer(monkeypatch, tmp_path, **kwargs):
+    clock = FakeClock()
+    monkeypatch.setattr(bulk_writer.time, "monotonic", clock)
+    collection = FakeCollection()
+    writer = BulkUpsertWriter(collection, str(tmp_path / "queue.sqlite"), **kwargs)
+    return writer, collection, clock
+
+
+def test_flushes_at_batch_size(monkeypatch, tmp_path):
+    writer, collection, _ = make_writer(monkeypatch, tmp_path, batch_size=2)
+    writer.add({"unique_id": "a"}, {"title": "A"})
+    assert collection.batches == []
+    writer.add({"unique_id": "b"}, {"title": "B"})
+    assert len(collection.batches) == 1 and writer.upserted == 2
+
+
+def test_maybe_flush_waits_for_the_interval(monkeypatch, tmp_path):
+    writer, collection, clock = make_writer(monkeypatch, tmp_path, batch_size=100, flush_interval=5.0)
+    assert writer.maybe_flush() is False          # nothing queued
+
+    writer.add({"unique_id": "a"}, {"title": "A"})
+    clock.now += 4.9
+    assert writer.maybe_flush() is False and collection.batches == []
+
+    # Slow work between adds: the queued write goes out without waiting for another add
+    clock.now += 0.2
+    assert writer.maybe_flush() is True
+    assert len(collection.batches) == 1
+
+    writer.close()                                # nothing left to send
+    assert len(collection.batches) == 1
+
+
+def test_unencodable_document_is_skipped(monkeypatch, tmp_path):
+    writer, collection, _ = make_writer(monkeypatch, tmp_path)
+    assert writer.add({"unique_id": "a"}, {"bad": object()}, unique_id="a") is False
+    assert writer.failed == 1
+    writer.close()
+    assert collection.batches == []
+
+
+def test_failed_ids_cover_rejected_and_unencodable_writes(monkeypatch, tmp_path):
+    writer, _, _ = make_writer(monkeypatch, tmp_path)
+    writer.collection = RejectingCollection(bad_index=1)
+    writer.add({"unique_id": "a"}, {"title": "A"}, unique_id="a")
+    writer.add({"unique_id": "b"}, {"title": "B"}, unique_id="b")
+    writer.add({"unique_id": "c"}, {"bad": object()}, unique_id="c")
+    writer.close()
+
+    assert writer.failed_ids == {"b", "c"}
+    assert writer.upserted == 1 and writer.failed == 2
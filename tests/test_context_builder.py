@@ -0,0 +1,77 @@
+from chunking import approx_tokens
+from context_builder import MIN_TRUNCATED_TOKENS, ContextBuilder, format_document
+
+BOILERPLATE = "Applications must be submitted electronically through Grants.gov before the deadline."
+
+
+def _result(uid, score, title=None):
+    return {"unique_id": uid, "score": score, "title": title or uid, "program_name": title or uid}
+
+
+def test_near_duplicate_paragraphs_are_dropped():
+    builder = ContextBuilder(max_tokens=10_000)
+    built = builder.build([
+        (_result("a", 0.9), f"Grants for rural broadband.\n{BOILERPLATE}"),
+        (_result("b", 0.8), f"Loans for water systems.\n{BOILERPLATE}"),
+    ])
+
+    assert built.context.count(BOILERPLATE) == 1
+    assert built.stats["paragraphs_deduplicated"] == 1
+    assert "Loans for water systems." in built.context
+    assert built.stats["tokens_saved"] > 0
+
+
+def test_short_paragraphs_are_never_deduplicated():
+    # Fewer words than one shingle: nothing to compare, so both are kept
+    built = ContextBuilder(max_tokens=10_000).build([(_result("a", 0.9), "Contact us."),
+                                                     (_result("b", 0.8), "Contact us.")])
+
+    assert built.context.count("Contact us.") == 2
+    assert built.stats["paragraphs_deduplicated"] == 0
+
+
+def test_passages_of_one_program_are_merged():
+    built = ContextBuilder(max_tokens=10_000).build([
+        (_result("a", 0.9), "First passage about the loan program terms."),
+        (_result("b", 0.7), "A different program entirely with other rules."),
+        (_result("a", 0.8), "Second passage about eligibility for applicants."),
+    ])
+
+    assert built.context.count("--- DOCUMENT START ---") == 2
+    assert [r["unique_id"] for r in built.sources] == ["a", "b"]
+    first_block = built.context.split("--- DOCUMENT END ---")[0]
+    assert "First passage" in first_block and "Second passage" in first_block
+
+
+def test_best_scores_first():
+    built = ContextBuilder(max_tokens=10_000).build([(_result("low", 0.1), "Low scoring text here."),
+                                                     (_result("high", 0.9), "High scoring text here.")])
+
+    assert [r["unique_id"] for r in built.sources] == ["high", "low"]
+
+
+def test_block_crossing_budget_is_truncated_at_a_sentence():
+    first = "Alpha program text. " * 10
+    second = " ".join(f"Sentence number {n} about the second program." for n in range(100))
+    budget = approx_tokens(format_document(_result("a", 0.9), first.strip())) + MIN_TRUNCATED_TOKENS + 40
+
+    built = ContextBuilder(max_tokens=budget).build([(_result("a", 0.9), first), (_result("b", 0.8), second)])
+
+    assert built.stats["passages_truncated"] == 1
+    assert built.stats["passages_dropped"] == 0
+    assert built.stats["tokens_used"] <= budget
+    assert ". [...]" in built.context
+    assert len(built.sources) == 2
+
+
+def test_block_is_dropped_when_too_little_budget_remains():
+    first = "Alpha program text. " * 10
+    budget = approx_tokens(format_document(_result("a", 0.9), first.strip())) + MIN_TRUNCATED_TOKENS // 2
+
+    built = ContextBuilder(max_tokens=budget).build([(_result("a", 0.9), first),
+                                                     (_result("b", 0.8), "Beta program text. " * 50)])
+
+    assert built.stats["passages_dropped"] == 1
+    assert built.stats["passages_truncated"] == 0
+    assert [r["unique_id"] for r in built.sources] == ["a"]
+    assert "Beta" not in built.context
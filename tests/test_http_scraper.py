@@ -0,0 +1,78 @@
+import os
+import sys
+import types
+
+import httpx
+
+import http_scraper
+from scraping import FIELD_SELECTORS
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures", "usda")
+LINK = "https://www.rd.usda.gov/programs-services/business-programs/meat-and-poultry-processing-expansion-program"
+
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_program_page_fields():
+    fields = http_scraper.parse_program_page(_fixture("program_page.html"), LINK)
+
+    # Every FIELD_SELECTORS field plus the website, as scraping.scrape_current_page returns them
+    assert set(fields) == set(FIELD_SELECTORS) | {"website"}
+    assert fields == {
+        "title": "Meat and Poultry Processing Expansion Program",
+        "website": LINK,
+        "program_status": "CLOSED",
+        "program_deadline": "Applications for Phase III Invasive Wild Caught Catfish must be submitted through "
+                            "Grants.gov by 11:59 p.m. on October 6, 2025",
+        "program_overview": "What does this program do?\n"
+                            "The Meat and Poultry Processing Expansion Program (MPPEP) provides grants to help "
+                            "eligible meat and poultry processors expand their capacity.\n"
+                            "USDA MPPEP Phase III is making competitive grant funding available specifically for "
+                            "the processing of wild-caught invasive catfish.\n"
+                            "Who can apply for this program?\n"
+                            "For-profit entities\nNonprofit entities\nTribes and Tribal entities",
+        "program_apply": "To Apply\nApplications must be submitted electronically through Grants.gov.",
+        "program_requirements": "Applicants must have a Unique Entity Identifier and an active SAM.gov registration.",
+        "program_contact": "Email: MPPEP program staff",
+        # Relative hrefs are made absolute, as Selenium's get_attribute('href') does
+        "program_contact_link": "https://www.rd.usda.gov/contact-us/mppep",
+        "program_events": "Events\nNo upcoming events.",
+    }
+    assert not http_scraper.needs_browser(fields)
+
+
+def test_js_only_page_needs_browser():
+    fields = http_scraper.parse_program_page(_fixture("js_only_page.html"), LINK)
+
+    assert fields["website"] == LINK
+    assert all(fields[name] is None for name in FIELD_SELECTORS)
+    assert http_scraper.needs_browser(fields)
+
+
+def test_hybrid_routes_js_pages_to_browser(monkeypatch):
+    pages = {"https://example.test/static": _fixture("program_page.html"),
+             "https://example.test/js": _fixture("js_only_page.html")}
+
+    def handler(request):
+        return httpx.Response(200, text=pages[str(request.url)], headers={"etag": '"v1"'})
+
+    monkeypatch.setattr(http_scraper, "make_client",
+                        lambda concurrency=16, timeout=20.0: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    browser_calls = []
+
+    def scrape_programs(links, workers=4, retries=2):
+        browser_calls.append(list(links))
+        return [{"title": "Rendered", "program_overview": "From the browser", "website": link} for link in links], {}
+
+    monkeypatch.setitem(sys.modules, "parallel_scraper", types.SimpleNamespace(scrape_programs=scrape_programs))
+
+    items, failures = http_scraper.scrape_programs_hybrid(list(pages))
+
+    assert browser_calls == [["https://example.test/js"]]
+    assert failures == {}
+    assert items[0]["title"] == "Meat and Poultry Processing Expansion Program"
+    assert items[0]["http_etag"] == '"v1"'
+    assert items[1]["title"] == "Rendered"
@@ -0,0 +1,91 @@
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from types import SimpleNamespace
+
+from admission import remaining_seconds, start_deadline
+from reranker import Reranker
+
+CANDIDATES = [{"unique_id": uid, "title": uid.upper(), "text_chunk": f"about {uid}"} for uid in ("a", "b", "c")]
+
+
+class FakeModels:
+    def __init__(self, text="[2, 0, 1]", delay=0.0):
+        self.text = text
+        self.delay = delay
+        self.configs = []
+        self.cancelled = False
+
+    def generate_content(self, model, contents, config=None):
+        self.configs.append(config)
+        return SimpleNamespace(text=self.text)
+
+    async def generate_async(self, model, contents, config=None):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return SimpleNamespace(text=self.text)
+
+
+def fake_client(**kwargs):
+    models = FakeModels(**kwargs)
+    aio = SimpleNamespace(models=SimpleNamespace(generate_content=models.generate_async))
+    return SimpleNamespace(models=models, aio=aio), models
+
+
+def _ids(docs):
+    return [doc["unique_id"] for doc in docs]
+
+
+def test_rerank_runs_in_the_admission_slot_and_caches():
+    client, models = fake_client()
+    entered = []
+
+    @contextmanager
+    def admit():
+        entered.append(remaining_seconds())
+        yield
+
+    reranker = Reranker("m", budget_seconds=0.5)
+    assert _ids(reranker.rerank(client, "q", CANDIDATES, 2, admit=admit)) == ["c", "a"]
+    assert len(entered) == 1 and 0 < entered[0] <= 0.5     # the slot wait is capped by the budget
+    timeout_ms = models.configs[0].http_options.timeout
+    assert 0 < timeout_ms <= 500
+
+    # Served from the cache: no second call and no slot
+    assert _ids(reranker.rerank(client, "q", CANDIDATES, 2, admit=admit)) == ["c", "a"]
+    assert len(entered) == 1 and reranker.stats()["hits"] == 1
+
+
+def test_rerank_budget_does_not_replace_the_request_deadline():
+    client, _ = fake_client()
+    start_deadline(30.0)
+    try:
+        Reranker("m", budget_seconds=0.2).rerank(client, "q", CANDIDATES, 2)
+        assert remaining_seconds() > 20
+    finally:
+        start_deadline(None)
+
+
+def test_async_rerank_cancels_the_call_when_over_budget():
+    client, models = fake_client(delay=5.0)
+    reranker = Reranker("m", budget_seconds=0.05)
+    admitted = []
+
+    @asynccontextmanager
+    async def admit():
+        admitted.append(True)
+        yield
+
+    result = asyncio.run(reranker.rerank_async(client, "q", CANDIDATES, 2, admit=admit))
+    assert _ids(result) == ["a", "b"]          # retrieval order
+    assert models.cancelled and admitted == [True]
+    assert reranker.stats()["timeouts"] == 1 and reranker.stats()["errors"] == 0
+
+
+def test_error_keeps_retrieval_order():
+    client, _ = fake_client(text="no ranking here")
+    reranker = Reranker("m")
+    assert _ids(reranker.rerank(client, "q", CANDIDATES, 3)) == ["a", "b", "c"]
+    assert reranker.stats()["errors"] == 1
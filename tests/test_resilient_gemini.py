@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+from google.genai.errors import APIError
+
+from resilient_gemini import CircuitOpenError, ResilientGeminiClient, _api_error
+
+
+class ScriptedModels:
+    """Raises (or returns) the scripted outcomes in order, one per call."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def generate_content(self, model, **kwargs):
+        return self._next()
+
+    async def _generate_async(self, model, **kwargs):
+        return self._next()
+
+
+class FakeClient:
+    def __init__(self, outcomes):
+        self.models = ScriptedModels(outcomes)
+        self.aio = type("Aio", (), {})()
+        self.aio.models = type("AioModels", (), {"generate_content": self.models._generate_async})()
+
+
+def make_client(outcomes):
+    fake = FakeClient(outcomes)
+    client = ResilientGeminiClient(fake, max_attempts=1, hedge=False, breaker_failures=2, breaker_reset_seconds=0.0)
+    return client, fake
+
+
+def unavailable():
+    return _api_error(503, "UNAVAILABLE", "overloaded")
+
+
+def open_breaker(client):
+    for _ in range(2):
+        with pytest.raises(APIError):
+            client.models.generate_content(model="m", contents="q")
+    assert client.stats()["breakers"]["m"]["state"] == "open"
+
+
+def test_bad_request_probe_closes_the_breaker():
+    client, fake = make_client([unavailable(), unavailable(), _api_error(400, "INVALID_ARGUMENT", "bad"), "ok"])
+    open_breaker(client)
+
+    with pytest.raises(APIError) as raised:
+        client.models.generate_content(model="m", contents="q")
+    assert raised.value.code == 400 and not isinstance(raised.value, CircuitOpenError)
+
+    # The model answered the probe, so the next call goes through instead of "circuit open"
+    assert client.stats()["breakers"]["m"]["state"] == "closed"
+    assert client.models.generate_content(model="m", contents="q") == "ok"
+    assert fake.models.calls == 4
+
+
+def test_unmapped_error_releases_the_probe():
+    client, _ = make_client([unavailable(), unavailable(), ValueError("bug"), "ok"])
+    open_breaker(client)
+
+    with pytest.raises(ValueError):
+        client.models.generate_content(model="m", contents="q")
+    assert client.stats()["breakers"]["m"]["state"] == "half_open"
+    assert client.models.generate_content(model="m", contents="q") == "ok"
+    assert client.stats()["breakers"]["m"]["state"] == "closed"
+
+
+def test_cancelled_async_probe_releases_the_probe():
+    client, _ = make_client([unavailable(), unavailable(), asyncio.CancelledError(), "ok"])
+    open_breaker(client)
+
+    async def run():
+        with pytest.raises(asyncio.CancelledError):
+            await client.aio.models.generate_content(model="m", contents="q")
+        return await client.aio.models.generate_content(model="m", contents="q")
+
+    assert asyncio.run(run()) == "ok"
+    assert client.stats()["breakers"]["m"]["state"] == "closed"
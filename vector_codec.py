@@ -0,0 +1,99 @@
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
+
+# Storage formats for embeddings in Mongo (VECTOR_STORAGE):
+#   "array"   - BSON array of doubles (the original format; 8 bytes plus a type byte and an
+#               index-string key per element, ~13 bytes per dimension for 768-d vectors)
+#   "float32" - packed BSON binary vector (subtype 9), 4 bytes per dimension
+#   "int8"    - packed BSON binary vector, 1 byte per dimension, scalar-quantized per vector
+#
+# int8 vectors are scaled so the largest absolute component maps to 127. The scale
+# differs per vector, which leaves cosine similarity (the index's metric) unchanged
+# apart from rounding; the scale itself is not stored.
+#
+# decode_vector() turns any of the three into a NumPy array; binary vectors are read
+# with np.frombuffer straight from the BSON bytes (no copy, no per-element objects).
+
+VECTOR_STORAGES = ("array", "float32", "int8")
+
+# dtype byte (first byte of a subtype-9 Binary) -> NumPy dtype / storage name
+_FLOAT32 = BinaryVectorDtype.FLOAT32.value[0]
+_INT8 = BinaryVectorDtype.INT8.value[0]
+_DTYPES = {_FLOAT32: np.dtype("<f4"), _INT8: np.dtype("i1")}
+_NAMES = {_FLOAT32: "float32", _INT8: "int8"}
+
+
+def quantize_int8(values):
+    vec = np.asarray(values, dtype=np.float32).ravel()
+    peak = float(np.max(np.abs(vec))) if vec.size else 0.0
+    if peak == 0.0:
+        return np.zeros(vec.size, dtype=np.int8)
+    return np.clip(np.rint(vec * (127.0 / peak)), -127, 127).astype(np.int8)
+
+
+def encode_vector(values, storage="array"):
+    """Embedding (list / array of floats) in the given storage format."""
+    if storage == "array":
+        return [float(x) for x in values]
+    if storage == "float32":
+        return Binary.from_vector(np.asarray(values, dtype=np.float32).ravel(), BinaryVectorDtype.FLOAT32)
+    if storage == "int8":
+        return Binary.from_vector(quantize_int8(values), BinaryVectorDtype.INT8)
+    raise ValueError(f"unknown vector storage {storage!r} (expected one of {', '.join(VECTOR_STORAGES)})")
+
+
+def is_binary_vector(value):
+    return isinstance(value, Binary) and value.subtype == 9
+
+
+def decode_vector(value):
+    """
+    NumPy view of a stored embedding: float32 / int8 for binary vectors (sharing the
+    BSON buffer), float64 for arrays. Returns None for anything else.
+    """
+    if is_binary_vector(value):
+        dtype = _DTYPES.get(value[0])
+        if dtype is None:
+            raise ValueError(f"unsupported binary vector dtype 0x{value[0]:02x} (packed bit vectors are not used here)")
+        return np.frombuffer(value, dtype=dtype, offset=2)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return np.asarray(value, dtype=np.float64)
+    return None
+
+
+def describe_vector(value):
+    """(storage name, dimensions) of a stored embedding, e.g. ("int8", 768); (type name, None) if unknown."""
+    if is_binary_vector(value):
+        vec = decode_vector(value) if value[0] in _DTYPES else None
+        return _NAMES.get(value[0], f"binary 0x{value[0]:02x}"), None if vec is None else int(vec.size)
+    if isinstance(value, list):
+        return "array", len(value)
+    return type(value).__name__, None
+
+
+def vector_dimensions(value):
+    return describe_vector(value)[1]
+
+
+def vector_index_definition(path, num_dimensions, similarity="cosine", quantization=None):
+    """
+    Atlas Vector Search index definition. Binary float32 / int8 vectors are detected
+    from the stored BinData, so the same definition covers every storage format;
+    `quantization` ("scalar" / "binary") additionally quantizes float vectors inside
+    the index only (smaller index memory, the documents keep full precision).
+    """
+    field = {"type": "vector", "path": path, "numDimensions": int(num_dimensions), "similarity": similarity}
+    if quantization:
+        field["quantization"] = quantization
+    return {"fields": [field]}
+
+
+def ensure_vector_index(collection, index_name, path, num_dimensions, similarity="cosine", quantization=None):
+    """Creates the Atlas Vector Search index if it does not exist yet (it builds asynchronously on Atlas)."""
+    from pymongo.operations import SearchIndexModel
+    existing = {idx.get("name") for idx in collection.list_search_indexes()}
+    if index_name in existing:
+        return False
+    definition = vector_index_definition(path, num_dimensions, similarity, quantization)
+    collection.create_search_index(SearchIndexModel(definition=definition, name=index_name, type="vectorSearch"))
+    return True
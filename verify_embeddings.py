@@ -1,17 +1,38 @@
-from ragService import collection, VECTOR_FIELD, VECTOR_INDEX_NAME
+import bson
+import numpy as np
+
+from ragService import collection, VECTOR_FIELD, VECTOR_INDEX_NAME, VECTOR_STORAGE
+from vector_codec import decode_vector, describe_vector
 
 print('Counting docs with vector field...')
 print(collection.count_documents({VECTOR_FIELD: {'$exists': True}}))
 
+# Storage format census: BSON arrays of doubles vs packed binary vectors (see vector_codec.py)
+print(f'\nVector storage (configured VECTOR_STORAGE={VECTOR_STORAGE}):')
+formats, invalid, payload_bytes = {}, 0, 0
+for doc in collection.find({VECTOR_FIELD: {'$exists': True}}, {VECTOR_FIELD: 1}):
+    value = doc.get(VECTOR_FIELD)
+    kind, dims = describe_vector(value)
+    formats[(kind, dims)] = formats.get((kind, dims), 0) + 1
+    vec = decode_vector(value)   # zero-copy view for binary vectors
+    if vec is None or not vec.size or not np.isfinite(vec).all() or not np.any(vec):
+        invalid += 1
+    payload_bytes += len(bson.encode({VECTOR_FIELD: value}))
+for (kind, dims), n in sorted(formats.items(), key=lambda item: -item[1]):
+    print(f'- {kind} x {dims}: {n} document(s)')
+print(f'Invalid (empty / zero / non-finite) vectors: {invalid}')
+print(f'Vector payload (BSON-encoded): {payload_bytes / 2**20:.2f} MiB')
+
 # sample vector length
 doc = collection.find_one({VECTOR_FIELD: {'$exists': True}})
 if doc:
     vec = doc.get(VECTOR_FIELD)
-    print('Sample vector type:', type(vec))
-    if isinstance(vec, list):
-        print('Sample vector length:', len(vec))
+    kind, dims = describe_vector(vec)
+    print('Sample vector type:', kind)
+    print('Sample vector length:', dims)
 
 # run vectorSearch with and without index name (some Atlas versions accept empty index)
+# The stored sample is reused as the query vector, so it has the indexed type already
 from bson import SON
 
 try:
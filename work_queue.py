@@ -0,0 +1,261 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from bson import json_util
+
+# Durable retry queue for ingest work that failed (scrape, embed, embed_chunk,
+# upsert). main.py and the backfill scripts record failures here through
+# bulk_writer.append_failure(); replay_failures.py replays them in one batched
+# run. Tasks are keyed by kind + target, so recording the same failure twice
+# updates one row instead of queuing duplicate work. A task that fails
+# `max_attempts` times is dead-lettered (status 'dead') until --requeue-dead.
+
+WORK_QUEUE_PATH = os.getenv("WORK_QUEUE_PATH") or "work_queue.sqlite"
+
+PENDING, DONE, DEAD = "pending", "done", "dead"
+
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+
+_BRACED = re.compile(r"\{.*\}|\[.*\]", re.S)
+_QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"")
+_HEX = re.compile(r"\b[0-9a-f]{24,}\b")
+_NUMBER = re.compile(r"\b(\d+\.\d+|\d{6,})\b")   # durations, timestamps; keeps codes like 429 / 11000
+_WHITESPACE = re.compile(r"\s+")
+
+
+def error_signature(message, max_chars=120):
+    """
+    The error message without the parts that differ between occurrences (documents,
+    lists, quoted values, ids, long numbers), so one root cause groups into one row.
+    """
+    text = _BRACED.sub("{…}", message or "")
+    text = _QUOTED.sub("'…'", text)
+    text = _HEX.sub("<id>", text)
+    text = _NUMBER.sub("N", text)
+    text = _WHITESPACE.sub(" ", text).strip()
+    return text[:max_chars]
+
+
+def task_key(kind, unique_id=None, payload=None):
+    """Idempotency key: the kind plus its target (unique_id, else the write filter)."""
+    payload = payload or {}
+    target = unique_id or payload.get("website")
+    if target is None and payload.get("filter") is not None:
+        target = json_util.dumps(payload["filter"], sort_keys=True)
+    if kind == "upsert" and payload.get("collection"):
+        target = f"{payload['collection']}:{target}"
+    return f"{kind}:{target}"
+
+
+class Task:
+    __slots__ = ("id", "kind", "unique_id", "title", "payload", "attempts", "error_class", "error")
+
+    def __init__(self, id, kind, unique_id, title, payload, attempts, error_class, error):
+        self.id = id
+        self.kind = kind
+        self.unique_id = unique_id
+        self.title = title
+        self.payload = json_util.loads(payload) if payload else {}
+        self.attempts = attempts
+        self.error_class = error_class
+        self.error = error
+
+    def label(self):
+        return self.title or self.unique_id or str(self.id)
+
+
+class WorkQueue:
+    """
+    SQLite-backed task queue (WAL, so a replay can run while an ingest records new
+    failures). Safe to use from worker threads.
+    """
+
+    def __init__(self, path=WORK_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " task_key TEXT NOT NULL UNIQUE,"
+            " kind TEXT NOT NULL,"
+            " unique_id TEXT,"
+            " title TEXT,"
+            " payload TEXT,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " error_class TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " next_attempt_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_due ON tasks (status, next_attempt_at)")
+
+    def add(self, kind, error, unique_id=None, title=None, payload=None, error_class=None):
+        """
+        Records a failed task (idempotent per task_key). A task already queued keeps
+        its attempt count; a finished one is queued again from zero; a dead one stays
+        dead. Returns the task key.
+        """
+        key = task_key(kind, unique_id, payload)
+        if error_class is None:
+            error_class = type(error).__name__ if isinstance(error, BaseException) else "Error"
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO tasks (task_key, kind, unique_id, title, payload, error_class, error,"
+                " created_at, updated_at, next_attempt_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (task_key) DO UPDATE SET"
+                " title = COALESCE(excluded.title, title), payload = excluded.payload,"
+                " error_class = excluded.error_class, error = excluded.error, updated_at = excluded.updated_at,"
+                " attempts = CASE WHEN status = 'done' THEN 0 ELSE attempts END,"
+                " status = CASE WHEN status = 'dead' THEN 'dead' ELSE 'pending' END",
+                (key, kind, None if unique_id is None else str(unique_id), title,
+                 json_util.dumps(payload or {}), error_class, str(error), now, now, now),
+            )
+        return key
+
+    def due(self, kinds=None, limit=None, ignore_backoff=False):
+        """Pending tasks whose backoff has elapsed (all pending ones with ignore_backoff), oldest first."""
+        sql = "SELECT id, kind, unique_id, title, payload, attempts, error_class, error FROM tasks WHERE status = 'pending'"
+        params = []
+        if not ignore_backoff:
+            sql += " AND next_attempt_at <= ?"
+            params.append(time.time())
+        if kinds:
+            sql += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            params.extend(kinds)
+        sql += " ORDER BY id"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [Task(*row) for row in rows]
+
+    def complete(self, task_id):
+        with self._lock:
+            self._db.execute("UPDATE tasks SET status = 'done', error = NULL, updated_at = ? WHERE id = ?",
+                             (time.time(), task_id))
+
+    def fail(self, task_id, error, max_attempts, retryable=True):
+        """
+        Counts a failed attempt. The task is dead-lettered once it has failed
+        `max_attempts` times (or at once when not retryable), otherwise it is retried
+        after an exponential backoff. Returns the new status.
+        """
+        error_class = type(error).__name__ if isinstance(error, BaseException) else "Error"
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT attempts FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            status = DEAD if not retryable or attempts >= max_attempts else PENDING
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+            self._db.execute(
+                "UPDATE tasks SET status = ?, attempts = ?, error_class = ?, error = ?, updated_at = ?,"
+                " next_attempt_at = ? WHERE id = ?",
+                (status, attempts, error_class, str(error), now, now + delay, task_id),
+            )
+        return status
+
+    def requeue_dead(self, kinds=None):
+        """Gives dead-lettered tasks a fresh set of attempts; returns how many."""
+        sql = "UPDATE tasks SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE status = 'dead'"
+        params = [time.time()]
+        if kinds:
+            sql += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            params.extend(kinds)
+        with self._lock:
+            return self._db.execute(sql, params).rowcount
+
+    def counts(self):
+        """{status: {kind: count}}"""
+        with self._lock:
+            rows = self._db.execute("SELECT status, kind, COUNT(*) FROM tasks GROUP BY status, kind").fetchall()
+        counts = {}
+        for status, kind, n in rows:
+            counts.setdefault(status, {})[kind] = n
+        return counts
+
+    def error_summary(self, statuses=(PENDING, DEAD)):
+        """
+        Open tasks grouped by (kind, error_class, error signature), largest group
+        first: [{'kind', 'error_class', 'signature', 'count', 'dead', 'example'}].
+        """
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT kind, error_class, error, status, COALESCE(title, unique_id) FROM tasks"
+                f" WHERE status IN ({', '.join('?' for _ in statuses)})", list(statuses),
+            ).fetchall()
+        groups = {}
+        for kind, error_class, error, status, label in rows:
+            signature = error_signature(error)
+            group = groups.get((kind, error_class, signature))
+            if group is None:
+                group = groups[(kind, error_class, signature)] = {
+                    "kind": kind, "error_class": error_class, "signature": signature,
+                    "count": 0, "dead": 0, "example": label,
+                }
+            group["count"] += 1
+            group["dead"] += status == DEAD
+        return sorted(groups.values(), key=lambda g: -g["count"])
+
+    def import_jsonl(self, path):
+        """
+        Queues the records of a failure log written before this queue existed:
+        append_failure() JSON lines ({"stage", "unique_id", "error", ...}) and the
+        older {"item": {...}, "error": "..."} lines, which become 'embed' tasks.
+        Returns (imported, skipped).
+        """
+        from change_detection import program_document
+
+        imported = skipped = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json_util.loads(line)
+                except ValueError:
+                    skipped += 1
+                    continue
+                if record.get("stage"):
+                    payload = {k: v for k, v in record.items()
+                               if k not in ("stage", "unique_id", "title", "error_class", "error", "failed_at")}
+                    self.add(record["stage"], record.get("error"), unique_id=record.get("unique_id"),
+                             title=record.get("title"), payload=payload, error_class=record.get("error_class"))
+                elif isinstance(record.get("item"), dict):
+                    item = record["item"]
+                    unique_id = program_document(item, "text")[0]["unique_id"]
+                    # The old format did not record the exception type
+                    self.add("embed", record.get("error"), unique_id=unique_id, title=item.get("title"),
+                             payload={"item": item}, error_class="unknown")
+                else:
+                    skipped += 1
+                    continue
+                imported += 1
+        return imported, skipped
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def open_queue(path=None):
+    """The process-wide WorkQueue for `path` (default WORK_QUEUE_PATH)."""
+    path = path or WORK_QUEUE_PATH
+    with _queues_lock:
+        queue = _queues.get(path)
+        if queue is None:
+            queue = _queues[path] = WorkQueue(path)
+        return queue